@@ -31,16 +31,21 @@ from __future__ import print_function
 import argparse
 import collections
 from datetime import datetime
+import hashlib
 import json
+import sys
 import time
 
 from ..lib import dsub_util
 from ..lib import param_util
+from ..lib import poll_util
 from ..providers import provider_base
 
 import tabulate
 import yaml
 
+SLEEP_FUNCTION = time.sleep  # so we can replace it in tests
+
 
 class OutputFormatter(object):
   """Base class for supported output formats."""
@@ -51,10 +56,26 @@ class OutputFormatter(object):
   def prepare_output(self, row):
     return row
 
+  def prepare_summary_output(self, row):
+    return row
+
   def print_table(self, table):
     """Function to be defined by the derived class to print output."""
     raise NotImplementedError('print_table method not defined!')
 
+  def print_rows(self, rows, summary=False):
+    """Print an iterable of rows, by default as a table.
+
+    Streaming formatters print each row as it is generated.
+
+    Args:
+      rows: an iterable of rows, as returned by prepare_output.
+      summary: whether the rows are job summaries, as returned by
+        prepare_summary_output.
+    """
+    del summary  # unused
+    self.print_table(list(rows))
+
 
 class TextOutput(OutputFormatter):
   """Format output for text display."""
@@ -82,11 +103,28 @@ class TextOutput(OutputFormatter):
     return ', '.join('%s=%s' % (key, value)
                      for key, value in sorted(values.iteritems()))
 
-  def prepare_output(self, row):
+  def _map_columns(self, row, column_map):
+    """An OrderedDict of the row's values, labeled and ordered for display."""
+    new_row = collections.OrderedDict()
+    for col in column_map:
+      field_name = col[0]
+      if field_name not in row:
+        continue
 
+      text_label = col[1]
+
+      if len(col) == 2:
+        new_row[text_label] = row[field_name]
+      else:
+        format_fn = col[2]
+        new_row[text_label] = format_fn(row[field_name])
+
+    return new_row
+
+  def _task_column_map(self):
     # Define the ordering of fields for text output along with any
     # transformations.
-    column_map = [
+    return [
         ('job-id', 'Job ID',),
         ('job-name', 'Job Name',),
         ('task-id', 'Task',),
@@ -102,27 +140,112 @@ class TextOutput(OutputFormatter):
         ('outputs', 'Outputs', self.format_inputs_outputs),
     ]
 
-    new_row = collections.OrderedDict()
-    for col in column_map:
-      field_name = col[0]
-      if field_name not in row:
-        continue
+  def _summary_column_map(self):
+    return [
+        ('job-id', 'Job ID',),
+        ('job-name', 'Job Name',),
+        ('status', 'Status',),
+        ('tasks', 'Tasks',),
+        ('running', 'Running',),
+        ('success', 'Succeeded',),
+        ('failure', 'Failed',),
+        ('canceled', 'Canceled',),
+    ]
 
-      text_label = col[1]
+  def prepare_output(self, row):
+    return self._map_columns(row, self._task_column_map())
 
-      if len(col) == 2:
-        new_row[text_label] = row[field_name]
-      else:
-        format_fn = col[2]
-        new_row[text_label] = format_fn(row[field_name])
+  def prepare_summary_output(self, row):
+    return self._map_columns(row, self._summary_column_map())
 
-    return new_row
+  def columns(self, summary=False):
+    """Returns the labels of every column that rows may have, in order."""
+    if summary:
+      return [col[1] for col in self._summary_column_map()]
+    fields = set(
+        col.key for col in (_FULL_COLUMNS if self._full else _SHORT_COLUMNS))
+    return [col[1] for col in self._task_column_map() if col[0] in fields]
 
   def print_table(self, table):
     print(tabulate.tabulate(table, headers='keys'))
     print('')
 
 
+class FixedWidthTextOutput(TextOutput):
+  """Stream output as text, in columns of predetermined widths.
+
+  Unlike TextOutput, the column widths do not depend on the values, so each
+  row is printed as soon as it is available. Longer values are trimmed.
+  """
+
+  _COLUMN_WIDTHS = {
+      'Job ID': 40,
+      'Job Name': 20,
+      'Task': 8,
+      'Status': TextOutput._MAX_ERROR_MESSAGE_LENGTH,
+      'Status-details': 40,
+      'Last Update': 19,
+      'Created': 19,
+      'Ended': 19,
+      'User': 12,
+      'Internal ID': 40,
+      'Logging': 40,
+      'Inputs': 40,
+      'Outputs': 40,
+      'Tasks': 8,
+      'Running': 8,
+      'Succeeded': 9,
+      'Failed': 8,
+      'Canceled': 8,
+  }
+  _DEFAULT_COLUMN_WIDTH = 20
+
+  def __init__(self, full):
+    super(FixedWidthTextOutput, self).__init__(full)
+
+  @staticmethod
+  def to_text(value):
+    """Returns a value as unicode; byte strings are decoded as UTF-8."""
+    if value is None:
+      return u''
+    if isinstance(value, str):
+      return value.decode('utf-8', 'replace')
+    return unicode(value)
+
+  def format_row(self, values, widths):
+    return u'  '.join(
+        self.trim_display_field(value, width).ljust(width)
+        for value, width in zip(values, widths)).rstrip()
+
+  def print_line(self, line):
+    encoding = getattr(sys.stdout, 'encoding', None) or 'utf-8'
+    print(line.encode(encoding, 'replace'))
+
+  def print_rows(self, rows, summary=False):
+    # The columns are known before the first row, so that all rows of a poll
+    # event line up, whichever of their fields are empty.
+    columns = self.columns(summary)
+    widths = [
+        self._COLUMN_WIDTHS.get(column, self._DEFAULT_COLUMN_WIDTH)
+        for column in columns
+    ]
+
+    printed = False
+    for row in rows:
+      if not printed:
+        self.print_line(self.format_row(columns, widths))
+        self.print_line(
+            self.format_row(['-' * width for width in widths], widths))
+        printed = True
+
+      self.print_line(self.format_row(
+          [self.to_text(row.get(column)) for column in columns], widths))
+      sys.stdout.flush()
+
+    if printed:
+      print('')
+
+
 class YamlOutput(OutputFormatter):
   """Format output for YAML display."""
 
@@ -143,6 +266,20 @@ class YamlOutput(OutputFormatter):
     print(yaml.dump(table, default_flow_style=False))
 
 
+class YamlStreamOutput(YamlOutput):
+  """Stream output as YAML, one document per row."""
+
+  def __init__(self, full):
+    super(YamlStreamOutput, self).__init__(full)
+
+  def print_rows(self, rows, summary=False):
+    del summary  # unused
+    for row in rows:
+      print(yaml.dump(row, default_flow_style=False, explicit_start=True),
+            end='')
+      sys.stdout.flush()
+
+
 class JsonOutput(OutputFormatter):
   """Format output for JSON display."""
 
@@ -159,41 +296,61 @@ class JsonOutput(OutputFormatter):
     print(json.dumps(table, indent=2, default=self.serialize))
 
 
+class NdjsonOutput(JsonOutput):
+  """Stream output as newline-delimited JSON, one object per row."""
+
+  def __init__(self, full):
+    super(NdjsonOutput, self).__init__(full)
+
+  def print_rows(self, rows, summary=False):
+    del summary  # unused
+    for row in rows:
+      print(json.dumps(row, default=self.serialize))
+      sys.stdout.flush()
+
+
+# Would like to include the Job ID in the default set of columns, but
+# it is a long value and would leave little room for status and update time.
+
+_ROW_SPEC = collections.namedtuple('row_spec',
+                                   ['key', 'optional', 'default_value'])
+
+# pyformat: disable
+_DEFAULT_COLUMNS = [
+    _ROW_SPEC('job-name', False, None),
+    _ROW_SPEC('task-id', True, None),
+    _ROW_SPEC('last-update', False, None)
+]
+_SHORT_COLUMNS = _DEFAULT_COLUMNS + [
+    _ROW_SPEC('status-message', False, None),
+]
+_FULL_COLUMNS = _DEFAULT_COLUMNS + [
+    _ROW_SPEC('job-id', False, None),
+    _ROW_SPEC('user-id', False, None),
+    _ROW_SPEC('status', False, None),
+    _ROW_SPEC('status-detail', False, None),
+    _ROW_SPEC('create-time', False, None),
+    _ROW_SPEC('end-time', False, 'NA'),
+    _ROW_SPEC('internal-id', False, None),
+    _ROW_SPEC('logging', False, None),
+    _ROW_SPEC('inputs', False, {}),
+    _ROW_SPEC('outputs', False, {}),
+    _ROW_SPEC('envs', False, {}),
+    _ROW_SPEC('labels', False, {}),
+]
+# pyformat: enable
+
+
+def _row_fields(full):
+  """The task fields read by dstat_job_producer to prepare its rows."""
+  columns = _FULL_COLUMNS if full else _SHORT_COLUMNS
+  return [col.key for col in columns] + ['job-id', 'task-id', 'task-status']
+
+
 def prepare_row(task, full):
   """return a dict with the task's info (more if "full" is set)."""
 
-  # Would like to include the Job ID in the default set of columns, but
-  # it is a long value and would leave little room for status and update time.
-
-  row_spec = collections.namedtuple('row_spec',
-                                    ['key', 'optional', 'default_value'])
-
-  # pyformat: disable
-  default_columns = [
-      row_spec('job-name', False, None),
-      row_spec('task-id', True, None),
-      row_spec('last-update', False, None)
-  ]
-  short_columns = default_columns + [
-      row_spec('status-message', False, None),
-  ]
-  full_columns = default_columns + [
-      row_spec('job-id', False, None),
-      row_spec('user-id', False, None),
-      row_spec('status', False, None),
-      row_spec('status-detail', False, None),
-      row_spec('create-time', False, None),
-      row_spec('end-time', False, 'NA'),
-      row_spec('internal-id', False, None),
-      row_spec('logging', False, None),
-      row_spec('inputs', False, {}),
-      row_spec('outputs', False, {}),
-      row_spec('envs', False, {}),
-      row_spec('labels', False, {}),
-  ]
-  # pyformat: enable
-
-  columns = full_columns if full else short_columns
+  columns = _FULL_COLUMNS if full else _SHORT_COLUMNS
 
   row = {}
   for col in columns:
@@ -274,8 +431,27 @@ def parse_arguments():
       type=int,
       help='Polling interval (in seconds) for checking job status '
       'when --wait is set.')
+  parser.add_argument(
+      '--max-poll-interval',
+      default=120,
+      type=int,
+      help='With --wait, while no task changes the polling interval grows '
+      'from --poll-interval up to this many seconds. Set to --poll-interval '
+      'or less to poll at a fixed interval.')
   parser.add_argument(
       '--wait', action='store_true', help='Wait until jobs have all completed.')
+  parser.add_argument(
+      '--incremental',
+      action='store_true',
+      help="""With --wait, after the first poll only check tasks that are
+          still running and only list tasks that changed since the previous
+          poll. Tasks created after the first poll are not listed.""")
+  parser.add_argument(
+      '--cache',
+      action='store_true',
+      help="""Keep a local cache of the tasks listed (in ~/.dsub/cache), so
+          that later invocations with the same filters only fetch new and
+          running tasks. Only used by the google provider.""")
   parser.add_argument(
       '--limit',
       type=int,
@@ -290,6 +466,17 @@ def parse_arguments():
       '--format',
       choices=['text', 'json', 'yaml', 'provider-json'],
       help='Set the output format.')
+  parser.add_argument(
+      '--summary',
+      action='store_true',
+      help="""List one row per job, with the number of its tasks in each
+          status, rather than one row per task.""")
+  parser.add_argument(
+      '--stream',
+      action='store_true',
+      help="""Print each task as soon as it is fetched, rather than one table
+          per poll. Text is printed in fixed-width columns, json as one
+          object per line and yaml as one document per task.""")
   # Add provider-specific arguments
   provider_base.add_provider_argument(parser)
 
@@ -299,6 +486,10 @@ def parse_arguments():
   for arg in provider_required_args[args.provider]:
     if not args.__getattribute__(arg):
       parser.error('argument --%s is required' % arg)
+  if args.summary and args.incremental:
+    parser.error('argument --summary not allowed with --incremental')
+  if args.summary and args.format == 'provider-json':
+    parser.error('argument --summary not allowed with --format provider-json')
   return args
 
 
@@ -310,21 +501,28 @@ def main():
   create_time = param_util.age_to_create_time(args.age)
 
   # Set up the output formatter
+  if args.stream:
+    text_output, yaml_output, json_output = (FixedWidthTextOutput,
+                                             YamlStreamOutput, NdjsonOutput)
+  else:
+    text_output, yaml_output, json_output = (TextOutput, YamlOutput,
+                                             JsonOutput)
+
   if args.format == 'json':
-    output_formatter = JsonOutput(args.full)
+    output_formatter = json_output(args.full)
   elif args.format == 'text':
-    output_formatter = TextOutput(args.full)
+    output_formatter = text_output(args.full)
   elif args.format == 'yaml':
-    output_formatter = YamlOutput(args.full)
+    output_formatter = yaml_output(args.full)
   elif args.format == 'provider-json':
-    output_formatter = JsonOutput(args.full)
+    output_formatter = json_output(args.full)
   else:
     # If --full is passed, then format defaults to yaml.
     # Else format defaults to text
     if args.full:
-      output_formatter = YamlOutput(args.full)
+      output_formatter = yaml_output(args.full)
     else:
-      output_formatter = TextOutput(args.full)
+      output_formatter = text_output(args.full)
 
   # Set up the Genomics Pipelines service interface
   provider = provider_base.get_provider(args)
@@ -351,17 +549,139 @@ def main():
       max_tasks=args.limit,
       full_output=args.full,
       poll_interval=poll_interval,
-      raw_format=bool(args.format == 'provider-json'))
+      raw_format=bool(args.format == 'provider-json'),
+      incremental=args.incremental,
+      max_poll_interval=args.max_poll_interval,
+      stream=args.stream,
+      summary=args.summary)
+
+  if args.summary:
+    prepare_output = output_formatter.prepare_summary_output
+  else:
+    prepare_output = output_formatter.prepare_output
 
   # Track if any jobs are running in the event --wait was requested.
+  first_poll = True
   for poll_event_tasks in job_producer:
+    if args.stream:
+      # Rows are printed as they are fetched; polls without rows print nothing.
+      output_formatter.print_rows(
+          (prepare_output(row) for row in poll_event_tasks),
+          summary=args.summary)
+      continue
+
+    # With --incremental, don't print empty tables for polls without changes.
+    if args.incremental and not first_poll and not poll_event_tasks:
+      continue
+    first_poll = False
+
     table = []
     for row in poll_event_tasks:
-      row = output_formatter.prepare_output(row)
+      row = prepare_output(row)
       table.append(row)
     output_formatter.print_table(table)
 
 
+class _PollEvent(object):
+  """What dstat_job_producer learns about the tasks of one poll event."""
+
+  def __init__(self):
+    self.some_job_running = False
+    self.row_count = 0
+    # Digest of the rows, to detect changes between polls in constant memory.
+    self.digest = hashlib.sha1()
+    # With incremental polling, the running tasks and their rows.
+    self.running_tasks = []
+    self.running_rows = {}
+
+
+def _poll_event_rows(tasks, poll, previous_rows, full_output, raw_format,
+                     incremental):
+  """Generates the rows of a poll event, recording what it sees in poll."""
+  for task in tasks:
+    # Format tasks as specified.
+    if raw_format:
+      row = task.raw_task_data()
+    else:
+      row = prepare_row(task, full_output)
+
+    # Determine if any of the jobs are running.
+    task_running = task.get_field('task-status') == 'RUNNING'
+    if task_running:
+      poll.some_job_running = True
+
+    if incremental:
+      key = (task.get_field('job-id'), task.get_field('task-id'))
+      if task_running:
+        poll.running_rows[key] = row
+        poll.running_tasks.append(task)
+      if previous_rows.get(key) == row:
+        continue
+    else:
+      # Byte strings are read as latin-1, which decodes any of them; the
+      # digest only needs to change when the row does.
+      poll.digest.update(
+          json.dumps(row, sort_keys=True, default=str, encoding='latin-1'))
+
+    poll.row_count += 1
+    yield row
+
+
+# Task fields read to summarize jobs.
+_SUMMARY_FIELDS = ['job-id', 'job-name', 'task-status', 'end-time']
+
+# Count of tasks of each status, in a job summary row.
+_SUMMARY_COUNTS = {
+    'RUNNING': 'running',
+    'SUCCESS': 'success',
+    'FAILURE': 'failure',
+    'CANCELED': 'canceled',
+}
+
+
+def _summary_rows(tasks, poll):
+  """Generates a row per job, with counts of its tasks by status.
+
+  The status of each job is that of its dominant task, as for dsub --wait.
+
+  Args:
+    tasks: an iterable of tasks.
+    poll: a _PollEvent in which to record what the rows show.
+
+  Yields:
+    A dict for each job, once all tasks are counted.
+  """
+  rows = collections.OrderedDict()
+  importance = {}
+  for task in tasks:
+    job_id = task.get_field('job-id')
+    row = rows.get(job_id)
+    if not row:
+      row = {
+          'job-id': job_id,
+          'job-name': task.get_field('job-name'),
+          'tasks': 0,
+      }
+      row.update({count: 0 for count in _SUMMARY_COUNTS.values()})
+      rows[job_id] = row
+
+    status = task.get_field('task-status')
+    row['tasks'] += 1
+    row[_SUMMARY_COUNTS[status]] += 1
+    if status == 'RUNNING':
+      poll.some_job_running = True
+
+    task_importance = dsub_util.importance_of_task(task)
+    if job_id not in importance or task_importance < importance[job_id]:
+      importance[job_id] = task_importance
+      row['status'] = status
+
+  for row in rows.values():
+    poll.digest.update(json.dumps(row, sort_keys=True))
+    poll.row_count += 1
+    yield row
+
+
 def dstat_job_producer(provider,
                        status_list,
                        user_list=None,
@@ -373,7 +693,11 @@ def dstat_job_producer(provider,
                        max_tasks=0,
                        full_output=False,
                        poll_interval=0,
-                       raw_format=False):
+                       raw_format=False,
+                       incremental=False,
+                       max_poll_interval=None,
+                       stream=False,
+                       summary=False):
   """Generate jobs as lists of task dicts ready for formatting/output.
 
   This function separates dstat logic from flag parsing and user output. Users
@@ -398,41 +722,80 @@ def dstat_job_producer(provider,
                 provider-specific view of tasks is absolutely required.
                 (NB: provider interfaces change over time, no transition path
                 will be provided for users depending on this flag).
+    incremental: (bool) after the first poll event, refresh only the tasks
+                 which were still running and yield only the tasks which
+                 changed since the previous poll event. Tasks created after
+                 the first poll event are not yielded.
+    max_poll_interval: (int) if set, the wait between poll events grows from
+                       poll_interval up to this many seconds while the tasks
+                       do not change.
+    stream: (bool) yield each poll event as an iterator over its task dicts,
+            which generates them as the tasks are fetched, instead of as a
+            list.
+    summary: (bool) instead of a dict per task, yield a dict per job with the
+             number of its tasks of each status. Only the task fields needed
+             for counting are fetched. Not supported with raw_format or
+             incremental.
 
   Yields:
     lists of task dictionaries - each list representing a dstat poll event.
   """
-  some_job_running = True
-  while some_job_running:
-    # Get a batch of jobs.
-    tasks = provider.lookup_job_tasks(
-        status_list,
-        user_list=user_list,
-        job_list=job_list,
-        job_name_list=job_name_list,
-        task_list=task_list,
-        labels=label_list,
-        create_time=create_time,
-        max_tasks=max_tasks)
-
-    some_job_running = False
-
-    formatted_tasks = []
-    for task in tasks:
-      # Format tasks as specified.
-      if raw_format:
-        formatted_tasks.append(task.raw_task_data())
-      else:
-        formatted_tasks.append(prepare_row(task, full_output))
+  running_tasks = None
+  previous_rows = {}
+  previous_digest = None
+  scheduler = poll_util.PollScheduler(poll_interval, max_poll_interval)
+
+  # Unless the raw tasks are wanted, fetch only what the rows need.
+  if summary:
+    fields = _SUMMARY_FIELDS
+  elif raw_format:
+    fields = None
+  else:
+    fields = _row_fields(full_output)
+
+  while True:
+    if running_tasks is None:
+      # Get a batch of jobs, formatting tasks as they arrive.
+      tasks = provider.iter_job_tasks(
+          status_list,
+          user_list=user_list,
+          job_list=job_list,
+          job_name_list=job_name_list,
+          task_list=task_list,
+          labels=label_list,
+          create_time=create_time,
+          max_tasks=max_tasks,
+          fields=fields)
+    else:
+      # Tasks that completed can't change, so don't fetch them again.
+      tasks = provider.refresh_tasks(running_tasks)
+
+    poll = _PollEvent()
+    if summary:
+      rows = _summary_rows(tasks, poll)
+    else:
+      rows = _poll_event_rows(tasks, poll, previous_rows, full_output,
+                              raw_format, incremental)
+    if stream:
+      yield rows
+      # Finish the poll event, in case the consumer did not.
+      for _ in rows:
+        pass
+    else:
+      yield list(rows)
 
-      # Determine if any of the jobs are running.
-      if task.get_field('task-status') == 'RUNNING':
-        some_job_running = True
+    # Poll less often while nothing changes.
+    if incremental:
+      running_tasks = poll.running_tasks
+      previous_rows = poll.running_rows
+      changed = poll.row_count > 0
+    else:
+      changed = poll.digest.digest() != previous_digest
+      previous_digest = poll.digest.digest()
 
-    # Yield the tasks and determine if the loop should continue.
-    yield formatted_tasks
-    if poll_interval and some_job_running:
-      time.sleep(poll_interval)
+    # Determine if the loop should continue.
+    if poll_interval and poll.some_job_running:
+      SLEEP_FUNCTION(scheduler.next_interval(changed))
     else:
       break
 
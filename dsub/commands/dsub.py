@@ -29,7 +29,9 @@ import time
 from ..lib import dsub_errors
 from ..lib import dsub_util
 from ..lib import job_util
+from ..lib import journal_util
 from ..lib import param_util
+from ..lib import poll_util
 from ..lib.dsub_util import print_error
 from ..providers import provider_base
 
@@ -293,6 +295,13 @@ def parse_arguments(prog, argv):
       type=int,
       help='Polling interval (in seconds) for checking job status '
       'when --wait or --after are set.')
+  parser.add_argument(
+      '--max-poll-interval',
+      default=120,
+      type=int,
+      help='While job status does not change, the polling interval grows '
+      'from --poll-interval up to this many seconds. Set to --poll-interval '
+      'or less to poll at a fixed interval.')
   parser.add_argument(
       '--after',
       nargs='+',
@@ -306,6 +315,14 @@ def parse_arguments(prog, argv):
           and --output-recursive parameters already exist. Note that wildcard
           and recursive outputs cannot be strictly verified. See the
           documentation for details.""")
+  parser.add_argument(
+      '--resume',
+      metavar='JOB_ID',
+      help="""Resume submission of a --tasks job that did not finish
+          submitting. The tasks file is re-read and only tasks not recorded
+          as launched in the job's submission journal (in ~/.dsub/journal)
+          are submitted, under the original job-id. Other flags should match
+          the original submission.""")
 
   # Add dsub resource requirement arguments
   parser.add_argument(
@@ -325,6 +342,22 @@ def parse_arguments(prog, argv):
 
   # Add provider-specific arguments
   provider_base.add_provider_argument(parser)
+  local = parser.add_argument_group(
+      title='local', description='Options for the local provider')
+  local.add_argument(
+      '--max-concurrent-tasks',
+      default=0,
+      type=int,
+      help="""Maximum number of tasks to run at once. Tasks are also queued
+      until their --min-cores and --min-ram fit in the host capacity left by
+      running tasks. Default is 0 (no limit beyond the host capacity).""")
+  local.add_argument(
+      '--input-cache-size',
+      default=0,
+      type=float,
+      help="""Size (in GB) of the host cache of --input files. Files in the
+      cache are not copied again for later tasks; the least recently used
+      files are removed when the cache is full. Default is 0 (no cache).""")
   google = parser.add_argument_group(
       title='google',
       description='Options for the Google provider (Pipelines API)')
@@ -359,6 +392,21 @@ def parse_arguments(prog, argv):
       after a localization, docker command, or delocalization failure.
       Allows for connecting to the VM for debugging.
       Default is 0; maximum allowed value is 86400 (1 day).""")
+  google.add_argument(
+      '--submit-parallelism',
+      default=1,
+      type=int,
+      help="""Number of task submission requests to send concurrently.
+      Useful for jobs with large numbers of tasks. If requests get rate
+      limited, all concurrent submissions slow down together.""")
+  google.add_argument(
+      '--submit-batch-size',
+      default=1,
+      type=int,
+      help="""Number of task submission requests to send in a single batch
+      HTTP request. Tasks that fail with a transient error are resubmitted on
+      their own. Combines with --submit-parallelism: each concurrent
+      submission sends one batch. Maximum allowed value is 1000.""")
 
   args = parser.parse_args(argv)
 
@@ -366,6 +414,14 @@ def parse_arguments(prog, argv):
   for arg in provider_required_args[args.provider]:
     if not args.__getattribute__(arg):
       parser.error('argument --%s is required' % arg)
+  if args.submit_parallelism < 1:
+    parser.error('argument --submit-parallelism must be at least 1')
+  if args.max_concurrent_tasks < 0:
+    parser.error('argument --max-concurrent-tasks must not be negative')
+  if args.input_cache_size < 0:
+    parser.error('argument --input-cache-size must not be negative')
+  if not 1 <= args.submit_batch_size <= 1000:
+    parser.error('argument --submit-batch-size must be between 1 and 1000')
   return args
 
 
@@ -412,7 +468,11 @@ def get_job_metadata(args, script, provider):
   return job_metadata
 
 
-def wait_after(provider, jobid_list, poll_interval, stop_on_failure):
+def wait_after(provider,
+               jobid_list,
+               poll_interval,
+               stop_on_failure,
+               max_poll_interval=None):
   """Print status info as we wait for those jobs.
 
   Blocks until either all of the listed jobs succeed,
@@ -423,6 +483,8 @@ def wait_after(provider, jobid_list, poll_interval, stop_on_failure):
     jobid_list: a list of job IDs (string) to wait for
     poll_interval: integer seconds to wait between iterations
     stop_on_failure: whether to stop waiting if one of the tasks fails.
+    max_poll_interval: if set, the wait between iterations grows from
+      poll_interval up to this many seconds while no task changes status.
 
   Returns:
     Empty list if there was no error,
@@ -439,22 +501,25 @@ def wait_after(provider, jobid_list, poll_interval, stop_on_failure):
   # remove NO_JOB
   job_set = set([j for j in jobid_list if j != NO_JOB])
   error_messages = []
+
+  # A single tracker serves all iterations, so tasks are fetched in full once
+  # and after that only the tasks still running are refreshed.
+  tracker = JobStateTracker(provider, job_set)
+  scheduler = poll_util.PollScheduler(poll_interval, max_poll_interval)
   while job_set and (not error_messages or not stop_on_failure):
     print('Waiting for: %s.' % (', '.join(job_set)))
 
     # Poll until any remaining jobs have completed
-    jobs_left = wait_for_any_job(provider, job_set, poll_interval)
+    jobs_left = wait_for_any_job(provider, job_set, poll_interval, tracker,
+                                 scheduler)
 
     # Calculate which jobs just completed
     jobs_completed = job_set.difference(jobs_left)
 
-    # Get all tasks for the newly completed jobs
-    tasks_completed = provider.lookup_job_tasks(['*'], job_list=jobs_completed)
-
     # We don't want to overwhelm the user with output when there are many
     # tasks per job. So we get a single "dominant" task for each of the
     # completed jobs (one that is representative of the job's fate).
-    dominant_job_tasks = dominant_task_for_jobs(tasks_completed)
+    dominant_job_tasks = tracker.dominant_tasks(jobs_completed)
     if len(dominant_job_tasks) != len(jobs_completed):
       # print info about the jobs we couldn't find
       # (should only occur for "--after" where the job ID is a typo).
@@ -499,7 +564,7 @@ def dominant_task_for_jobs(tasks):
   ret = []
   for job_id in per_job.keys():
     tasks_in_salience_order = sorted(
-        per_job[job_id], key=importance_of_task)
+        per_job[job_id], key=dsub_util.importance_of_task)
     ret.append(tasks_in_salience_order[0])
   return ret
 
@@ -512,25 +577,108 @@ def group_tasks_by_jobid(tasks):
   return ret
 
 
-def importance_of_task(task):
-  """Tuple (importance, end-time). Smaller values are more important."""
-  # The status of a job is going to be determined by the roll-up of its tasks.
-  # A FAILURE or CANCELED task means the job has FAILED.
-  # If none, then any RUNNING task, the job is still RUNNING.
-  # If none, then the job status is SUCCESS.
-  #
-  # Thus the dominant task for each job is one that exemplifies its
-  # status:
-  #
-  # 1- The first (FAILURE or CANCELED) task, or if none
-  # 2- The first RUNNING task, or if none
-  # 3- The first SUCCESS task.
-  importance = {'FAILURE': 0, 'CANCELED': 0, 'RUNNING': 1, 'SUCCESS': 2}
-  return (importance[task.get_field('task-status')],
-          task.get_field('end-time'))
+class JobStateTracker(object):
+  """Tracks the state of the tasks of a set of jobs across polls.
 
+  The first poll looks up all tasks of the jobs. Later polls refresh only the
+  tasks which were running in jobs that have not yet finished, so the tasks of
+  completed jobs are not fetched again.
 
-def wait_for_any_job(provider, jobid_list, poll_interval):
+  For each job, the tracker keeps a count of its running, failed and succeeded
+  tasks.
+  """
+
+  def __init__(self, provider, job_ids):
+    self._provider = provider
+    self._job_ids = set(job_ids)
+    self._tasks = collections.OrderedDict()
+    self._counts = {
+        job_id: collections.Counter() for job_id in self._job_ids
+    }
+    self._polled = False
+
+  @staticmethod
+  def _task_key(task):
+    return (task.get_field('job-id'), task.get_field('task-id'))
+
+  @staticmethod
+  def _task_state(task):
+    status = task.get_field('task-status')
+    if status in ['FAILURE', 'CANCELED']:
+      return 'failed'
+    if status == 'RUNNING':
+      return 'running'
+    return 'succeeded'
+
+  def _update(self, tasks):
+    changed = False
+    for task in tasks:
+      job_id = task.get_field('job-id')
+      if job_id not in self._counts:
+        continue
+      key = self._task_key(task)
+      previous = self._tasks.get(key)
+      if previous:
+        if (previous.get_field('task-status') !=
+            task.get_field('task-status')):
+          changed = True
+        self._counts[job_id][self._task_state(previous)] -= 1
+      else:
+        changed = True
+      self._counts[job_id][self._task_state(task)] += 1
+      self._tasks[key] = task
+    return changed
+
+  def _is_running(self, job_id):
+    counts = self._counts[job_id]
+    return counts['running'] > 0 and counts['failed'] == 0
+
+  def poll(self):
+    """Fetch the current state of the tasks that may still change.
+
+    Returns:
+      True if any task was found or changed status since the previous poll.
+    """
+    if not self._polled:
+      self._polled = True
+      return self._update(
+          self._provider.lookup_job_tasks(
+              ['*'],
+              job_list=sorted(self._job_ids),
+              fields=['job-id', 'task-id', 'task-status', 'end-time']))
+
+    running_tasks = [
+        task for task in self._tasks.values()
+        if self._task_state(task) == 'running' and self._is_running(
+            task.get_field('job-id'))
+    ]
+    return self._update(self._provider.refresh_tasks(running_tasks))
+
+  def counts(self, job_id):
+    """A dict of the job's task counts, keyed by running/failed/succeeded."""
+    counts = self._counts[job_id]
+    return {
+        state: counts[state] for state in ['running', 'failed', 'succeeded']
+    }
+
+  def running_jobs(self):
+    """The set of jobs with a running task and no failed or canceled task."""
+    return set(job_id for job_id in self._job_ids if self._is_running(job_id))
+
+  def dominant_tasks(self, job_ids):
+    """The dominant task of each of the given jobs, from the tracked tasks."""
+    job_ids = set(job_ids)
+    return dominant_task_for_jobs([
+        task for task in self._tasks.values()
+        if task.get_field('job-id') in job_ids
+    ])
+
+
+def wait_for_any_job(provider,
+                     jobid_list,
+                     poll_interval,
+                     tracker=None,
+                     scheduler=None):
   """Waits until any of the listed jobs is not running.
 
   In particular, if any of the jobs sees one of its tasks fail,
@@ -541,27 +689,27 @@ def wait_for_any_job(provider, jobid_list, poll_interval):
     provider: job service provider
     jobid_list: a list of job IDs (string) to wait for
     poll_interval: integer seconds to wait between iterations
+    tracker: a JobStateTracker to poll, shared between calls. If not set, a
+      new tracker for the listed jobs is used.
+    scheduler: a poll_util.PollScheduler for the wait between iterations,
+      shared between calls. If not set, waits poll_interval seconds.
 
   Returns:
     A set of the jobIDs with still at least one running task.
   """
   if not jobid_list:
     return
+  job_set = set(jobid_list)
+  if not tracker:
+    tracker = JobStateTracker(provider, job_set)
+  if not scheduler:
+    scheduler = poll_util.PollScheduler(poll_interval)
   while True:
-    tasks = provider.lookup_job_tasks(['*'], job_list=jobid_list)
-    running_jobs = set([])
-    failed_jobs = set([])
-    for t in tasks:
-      status = t.get_field('task-status')
-      job_id = t.get_field('job-id')
-      if status in ['FAILURE', 'CANCELED']:
-        failed_jobs.add(job_id)
-      if status == 'RUNNING':
-        running_jobs.add(job_id)
-    remaining_jobs = running_jobs.difference(failed_jobs)
-    if failed_jobs or len(remaining_jobs) != len(jobid_list):
+    changed = tracker.poll()
+    remaining_jobs = tracker.running_jobs() & job_set
+    if remaining_jobs != job_set:
       return remaining_jobs
-    SLEEP_FUNCTION(poll_interval)
+    SLEEP_FUNCTION(scheduler.next_interval(changed))
 
 
 def _job_outputs_are_present(job_data):
@@ -620,6 +768,10 @@ def run_main(args):
     raise ValueError('Output skipping (--skip) not supported for --task '
                      'commands.')
 
+  if args.resume and not args.tasks:
+    raise ValueError('Resuming a job (--resume) is only supported for --tasks '
+                     'commands.')
+
   provider_base.check_for_unsupported_flag(args)
 
   if args.command:
@@ -642,7 +794,18 @@ def run_main(args):
 
   # Extract arguments that are global for the batch of jobs to run
   job_resources = get_job_resources(args)
-  job_metadata = get_job_metadata(args, script, provider)
+
+  # When resuming, launch the remaining tasks under the original job-id
+  journal = None
+  if args.resume:
+    journal = journal_util.SubmitJournal.load(args.resume)
+    if journal.tasks != args.tasks['path']:
+      raise ValueError('Job %s was submitted with tasks file %s, not %s' %
+                       (args.resume, journal.tasks, args.tasks['path']))
+    job_metadata = journal.job_metadata
+    job_metadata['script'] = script
+  else:
+    job_metadata = get_job_metadata(args, script, provider)
 
   # Set up job parameters and job data from a tasks file or the command-line
   input_file_param_util = param_util.InputFileParamUtil(
@@ -650,8 +813,11 @@ def run_main(args):
   output_file_param_util = param_util.OutputFileParamUtil(
       DEFAULT_OUTPUT_LOCAL_PATH)
   if args.tasks:
-    all_task_data = param_util.tasks_file_to_job_data(
+    # Task rows are read as they are submitted, rather than all up front.
+    all_task_data = param_util.tasks_file_to_job_data_stream(
         args.tasks, input_file_param_util, output_file_param_util)
+    if journal:
+      all_task_data = journal.unlaunched_tasks(all_task_data)
   else:
     all_task_data = param_util.args_to_job_data(
         args.env, args.label, args.input, args.input_recursive, args.output,
@@ -667,7 +833,7 @@ def run_main(args):
     else:
       print('Waiting for predecessor jobs to complete...')
       error_messages = wait_after(provider, args.after, args.poll_interval,
-                                  True)
+                                  True, args.max_poll_interval)
       if error_messages:
         for msg in error_messages:
           print_error(msg)
@@ -681,8 +847,18 @@ def run_main(args):
       print('Job output already present, skipping new job submission.')
       return {'job-id': NO_JOB}
 
+  # Record each task as it launches so that an interrupted submission can be
+  # resumed with --resume.
+  if args.tasks and not args.dry_run and not journal:
+    journal = journal_util.SubmitJournal.create(job_metadata,
+                                                args.tasks['path'])
+
   # Launch all the job tasks!
-  launched_job = provider.submit_job(job_resources, job_metadata, all_task_data)
+  launched_job = provider.submit_job(
+      job_resources, job_metadata, all_task_data, journal=journal)
+
+  if args.resume and not launched_job.get('task-id'):
+    print('All tasks of job %s had already been launched.' % args.resume)
 
   if not args.dry_run:
     print('Launched job-id: %s' % launched_job['job-id'])
@@ -700,7 +876,8 @@ def run_main(args):
     print('Waiting for job to complete...')
 
     error_messages = wait_after(provider, [job_metadata['job-id']],
-                                args.poll_interval, False)
+                                args.poll_interval, False,
+                                args.max_poll_interval)
     if error_messages:
       for msg in error_messages:
         print_error(msg)
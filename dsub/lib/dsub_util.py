@@ -82,6 +82,24 @@ def tasks_to_job_ids(task_list):
   return set([t.get_field('job-id') for t in task_list])
 
 
+def importance_of_task(task):
+  """Tuple (importance, end-time). Smaller values are more important."""
+  # The status of a job is going to be determined by the roll-up of its tasks.
+  # A FAILURE or CANCELED task means the job has FAILED.
+  # If none, then any RUNNING task, the job is still RUNNING.
+  # If none, then the job status is SUCCESS.
+  #
+  # Thus the dominant task for each job is one that exemplifies its
+  # status:
+  #
+  # 1- The first (FAILURE or CANCELED) task, or if none
+  # 2- The first RUNNING task, or if none
+  # 3- The first SUCCESS task.
+  importance = {'FAILURE': 0, 'CANCELED': 0, 'RUNNING': 1, 'SUCCESS': 2}
+  return (importance[task.get_field('task-status')],
+          task.get_field('end-time'))
+
+
 def _get_storage_service(credentials):
   """Get a storage client using the provided credentials or defaults."""
   if credentials is None:
@@ -130,6 +148,63 @@ def _load_file_from_gcs(gcs_file_path, credentials=None):
   return StringIO(file_handle.getvalue())
 
 
+def _stream_file_from_gcs(gcs_file_path, credentials=None):
+  """Generator yielding the lines of a text file in gcs as it downloads.
+
+  The file is downloaded in chunks and only the current chunk is held in
+  memory, so lines are available before the download completes.
+
+  Args:
+    gcs_file_path: The target file path; should have the 'gs://' prefix.
+    credentials: Optional credential to be used to load the file from gcs.
+
+  Yields:
+    Each line of the file, including its line ending.
+  """
+  gcs_service = _get_storage_service(credentials)
+
+  bucket_name, object_name = gcs_file_path[len('gs://'):].split('/', 1)
+  request = gcs_service.objects().get_media(
+      bucket=bucket_name, object=object_name)
+
+  file_handle = io.BytesIO()
+  downloader = MediaIoBaseDownload(file_handle, request, chunksize=1024 * 1024)
+  partial_line = ''
+  done = False
+  while not done:
+    _, done = _downloader_next_chunk(downloader)
+
+    # Take the chunk just downloaded and empty the buffer for the next one.
+    lines = (partial_line + file_handle.getvalue()).splitlines(True)
+    file_handle.seek(0)
+    file_handle.truncate()
+
+    # The last line may continue in the next chunk.
+    partial_line = lines.pop() if lines and not done else ''
+    for line in lines:
+      yield line
+
+
+def load_file_stream(file_path, credentials=None):
+  """Load a file from either local or gcs as an iterable of lines.
+
+  Unlike load_file, a file in gcs is not held in memory in its entirety.
+
+  Args:
+    file_path: The target file path, which should have the prefix 'gs://' if
+               to be loaded from gcs.
+    credentials: Optional credential to be used to load the file from gcs.
+
+  Returns:
+    A python File object if loading file from local or a generator of lines if
+    loading from gcs.
+  """
+  if file_path.startswith('gs://'):
+    return _stream_file_from_gcs(file_path, credentials)
+  else:
+    return open(file_path, 'r')
+
+
 def load_file(file_path, credentials=None):
   """Load a file from either local or gcs.
 
@@ -0,0 +1,461 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Copy directories to and from Google Cloud Storage without gsutil.
+
+The google provider stages this file into the Docker container of tasks with
+--input-recursive or --output-recursive parameters if the image has Python
+but not gsutil, to avoid installing the Cloud SDK at runtime. It therefore
+runs on its own, with only the Python (2.7 or 3) standard library.
+
+It implements the gsutil command that dsub runs:
+
+  python gcs_transfer.py [-m] rsync -r SOURCE DESTINATION
+
+where one of SOURCE and DESTINATION is a gs:// URL and the other a local
+directory. As with gsutil rsync, files are copied only if they are missing
+or differ (in size or MD5 hash) at the destination, and no files are
+deleted. Files are copied in parallel, and interrupted copies resume where
+they stopped: downloads with range requests, uploads with resumable uploads.
+
+Requests are authorized with the VM service account, from the metadata
+server.
+"""
+
+from __future__ import print_function
+
+import base64
+import hashlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+try:
+  import http.client as httplib  # pylint: disable=g-import-not-at-top
+  import queue  # pylint: disable=g-import-not-at-top
+  from urllib.parse import quote  # pylint: disable=g-import-not-at-top
+except ImportError:
+  import httplib  # pylint: disable=g-import-not-at-top
+  import Queue as queue  # pylint: disable=g-import-not-at-top
+  from urllib import quote  # pylint: disable=g-import-not-at-top
+
+API_HOST = 'www.googleapis.com'
+METADATA_HOST = 'metadata.google.internal'
+_TOKEN_PATH = '/computeMetadata/v1/instance/service-accounts/default/token'
+
+# Number of files to copy at once.
+_THREADS = 8
+
+# Size of the chunks of resumable uploads (a multiple of 256 KiB, as the API
+# requires) and of the reads of downloads.
+_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Requests failing with a transient error are retried, waiting 1, 2, 4...
+# seconds. Downloads and uploads resume from where the last attempt stopped.
+_MAX_ATTEMPTS = 6
+_TRANSIENT_STATUSES = frozenset([408, 429, 500, 502, 503, 504])
+_sleep = time.sleep
+
+# Downloads are written to <path>.dsub-partial, then renamed.
+_PARTIAL_SUFFIX = '.dsub-partial'
+
+
+class TransferError(Exception):
+  """A copy failed."""
+
+
+class _TransientError(TransferError):
+  """A request failed, and may succeed if retried."""
+
+
+def _status_error(status, description, body):
+  error = _TransientError if status in _TRANSIENT_STATUSES else TransferError
+  return error('%s: HTTP %d %s' % (description, status, body[:200]))
+
+
+def _with_retries(function):
+  for attempt in range(_MAX_ATTEMPTS):
+    try:
+      return function()
+    except _TransientError:
+      if attempt == _MAX_ATTEMPTS - 1:
+        raise
+      _sleep(2**attempt)
+
+
+class Http(object):
+  """HTTP requests, on a connection per thread and host."""
+
+  def __init__(self):
+    self._local = threading.local()
+
+  def _connections(self):
+    if not hasattr(self._local, 'connections'):
+      self._local.connections = {}
+    return self._local.connections
+
+  def reset(self):
+    """Closes the connections of the thread, after a failed response."""
+    for connection in self._connections().values():
+      connection.close()
+    self._connections().clear()
+
+  def request(self, host, method, path, body=None, headers=None):
+    """Sends a request; returns the response, to be read by the caller."""
+    connections = self._connections()
+    if host not in connections:
+      if host == METADATA_HOST:
+        connections[host] = httplib.HTTPConnection(host, timeout=60)
+      else:
+        connections[host] = httplib.HTTPSConnection(host, timeout=60)
+    try:
+      connections[host].request(method, path, body, headers or {})
+      return connections[host].getresponse()
+    except (httplib.HTTPException, socket.error) as e:
+      self.reset()
+      raise _TransientError('%s %s: %s' % (method, path, e))
+
+
+class Storage(object):
+  """Calls to the Cloud Storage JSON API."""
+
+  def __init__(self, http):
+    self._http = http
+    self._lock = threading.Lock()
+    self._token = None
+    self._token_expiry = 0
+
+  def _authorization(self):
+    with self._lock:
+      if time.time() > self._token_expiry - 60:
+        response = self._http.request(
+            METADATA_HOST, 'GET', _TOKEN_PATH,
+            headers={'Metadata-Flavor': 'Google'})
+        body = response.read()
+        if response.status != 200:
+          raise _status_error(response.status, 'Access token', body)
+        token = json.loads(body.decode('utf-8'))
+        self._token = token['access_token']
+        self._token_expiry = time.time() + token['expires_in']
+      return 'Bearer ' + self._token
+
+  def call(self, method, path, body=None, headers=None, statuses=(200,)):
+    """Sends a request; returns the response if its status is expected.
+
+    Args:
+      method: HTTP method.
+      path: path (and query) of the request URL.
+      body: request body.
+      headers: request headers, besides the authorization.
+      statuses: statuses of successful responses.
+
+    Returns:
+      The response, to be read by the caller.
+
+    Raises:
+      TransferError: the response had another status.
+    """
+    all_headers = {'Authorization': self._authorization()}
+    all_headers.update(headers or {})
+    response = self._http.request(API_HOST, method, path, body, all_headers)
+    if response.status in statuses:
+      return response
+    raise _status_error(response.status, '%s %s' % (method, path),
+                        response.read())
+
+  def list_objects(self, bucket, prefix):
+    """Returns {object name: (size, MD5 hash or None)} for the prefix."""
+    objects = {}
+    page_token = None
+    while True:
+      path = ('/storage/v1/b/%s/o?prefix=%s&fields=%s' %
+              (quote(bucket, safe=''), quote(prefix, safe=''),
+               'items(name,size,md5Hash),nextPageToken'))
+      if page_token:
+        path += '&pageToken=' + quote(page_token, safe='')
+      page = _with_retries(
+          lambda: json.loads(self.call('GET', path).read().decode('utf-8')))
+      for item in page.get('items', []):
+        objects[item['name']] = (int(item['size']), item.get('md5Hash'))
+      page_token = page.get('nextPageToken')
+      if not page_token:
+        return objects
+
+  def download(self, bucket, name, size, path):
+    """Downloads an object, resuming from <path>.dsub-partial if it exists."""
+    partial = path + _PARTIAL_SUFFIX
+
+    def attempt():
+      offset = 0
+      if os.path.exists(partial):
+        offset = os.path.getsize(partial)
+      if offset > size:
+        os.remove(partial)
+        offset = 0
+      if offset == size:
+        open(partial, 'ab').close()
+        return
+      headers = {}
+      if offset:
+        headers['Range'] = 'bytes=%d-' % offset
+      response = self.call(
+          'GET',
+          '/storage/v1/b/%s/o/%s?alt=media' % (quote(bucket, safe=''),
+                                               quote(name, safe='')),
+          headers=headers,
+          statuses=(200, 206))
+      if response.status == 200:
+        offset = 0
+      try:
+        with open(partial, 'ab' if offset else 'wb') as f:
+          while True:
+            data = response.read(_CHUNK_SIZE)
+            if not data:
+              break
+            f.write(data)
+      except (httplib.HTTPException, socket.error) as e:
+        self._http.reset()
+        raise _TransientError('Download of gs://%s/%s: %s' % (bucket, name, e))
+      if os.path.getsize(partial) < size:
+        raise _TransientError('Download of gs://%s/%s: incomplete' % (bucket,
+                                                                      name))
+
+    _with_retries(attempt)
+    return partial
+
+  def upload(self, path, bucket, name):
+    """Uploads a file, in a resumable upload."""
+    size = os.path.getsize(path)
+    response = _with_retries(lambda: self.call(
+        'POST',
+        '/upload/storage/v1/b/%s/o?uploadType=resumable&name=%s' %
+        (quote(bucket, safe=''), quote(name, safe='')),
+        body=b'',
+        headers={'X-Upload-Content-Length': str(size)}))
+    response.read()
+    location = response.getheader('Location')
+    if not location:
+      raise TransferError('Upload of %s: no upload session URL' % path)
+    session = location.split(API_HOST, 1)[-1]
+
+    offset = 0
+    failures = 0
+    resume = False
+    while True:
+      try:
+        if resume:
+          # Find out how much of the file the last request sent.
+          offset = self._upload_offset(session, size)
+          resume = False
+        if offset is None:
+          return
+        offset = self._put_chunk(session, path, offset, size)
+        failures = 0
+      except _TransientError:
+        failures += 1
+        if failures == _MAX_ATTEMPTS:
+          raise
+        _sleep(2**(failures - 1))
+        resume = True
+
+  def _upload_response(self, response):
+    """Returns None if an upload is done, else the size received so far."""
+    response.read()
+    if response.status != 308:
+      return None
+    received = response.getheader('Range')
+    if not received:
+      return 0
+    return int(received.split('-')[-1]) + 1
+
+  def _upload_offset(self, session, size):
+    return self._upload_response(
+        self.call(
+            'PUT',
+            session,
+            body=b'',
+            headers={'Content-Range': 'bytes */%d' % size},
+            statuses=(200, 201, 308)))
+
+  def _put_chunk(self, session, path, offset, size):
+    """Sends the chunk of the file at offset; returns the next offset."""
+    with open(path, 'rb') as f:
+      f.seek(offset)
+      chunk = f.read(_CHUNK_SIZE)
+    if chunk:
+      content_range = 'bytes %d-%d/%d' % (offset, offset + len(chunk) - 1, size)
+    else:
+      content_range = 'bytes */%d' % size
+    return self._upload_response(
+        self.call(
+            'PUT',
+            session,
+            body=chunk,
+            headers={'Content-Range': content_range},
+            statuses=(200, 201, 308)))
+
+
+def _md5(path):
+  md5 = hashlib.md5()
+  with open(path, 'rb') as f:
+    for data in iter(lambda: f.read(_CHUNK_SIZE), b''):
+      md5.update(data)
+  return base64.b64encode(md5.digest()).decode('ascii')
+
+
+def _is_copy(path, size, md5):
+  """Returns True if the file has the given size and MD5 hash (if known)."""
+  return (os.path.isfile(path) and os.path.getsize(path) == size and
+          (md5 is None or _md5(path) == md5))
+
+
+def _split_url(url):
+  """Returns the bucket and object name prefix of a gs:// "directory" URL."""
+  bucket, _, prefix = url[len('gs://'):].partition('/')
+  if prefix and not prefix.endswith('/'):
+    prefix += '/'
+  return bucket, prefix
+
+
+def _download_job(storage, bucket, name, size, md5, path):
+
+  def job():
+    print('Copying gs://%s/%s' % (bucket, name), file=sys.stderr)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+      try:
+        os.makedirs(directory)
+      except OSError:
+        # Made by another thread.
+        if not os.path.isdir(directory):
+          raise
+    partial = storage.download(bucket, name, size, path)
+    if md5 is not None and _md5(partial) != md5:
+      os.remove(partial)
+      raise TransferError('Download of gs://%s/%s: MD5 hash mismatch' %
+                          (bucket, name))
+    os.rename(partial, path)
+
+  return job
+
+
+def _upload_job(storage, path, bucket, name):
+
+  def job():
+    print('Copying file://%s' % path, file=sys.stderr)
+    storage.upload(path, bucket, name)
+
+  return job
+
+
+def _run_parallel(jobs, threads):
+  """Runs the jobs; returns the errors they raised.
+
+  Any exception of a job is an error, so that a bug or an unexpected response
+  fails the copy rather than the thread of the job.
+  """
+  errors = []
+  work = queue.Queue()
+  for job in jobs:
+    work.put(job)
+
+  def worker():
+    while True:
+      try:
+        job = work.get_nowait()
+      except queue.Empty:
+        return
+      try:
+        job()
+      except Exception as e:  # pylint: disable=broad-except
+        errors.append(e)
+
+  workers = [
+      threading.Thread(target=worker) for _ in range(min(threads, len(jobs)))
+  ]
+  for thread in workers:
+    thread.start()
+  for thread in workers:
+    thread.join()
+  return errors
+
+
+def rsync(storage, source, destination, threads=_THREADS):
+  """Copies the files missing or different at the destination.
+
+  Args:
+    storage: a Storage.
+    source: a gs:// URL or a local directory.
+    destination: a local directory or a gs:// URL.
+    threads: number of files to copy at once.
+
+  Returns:
+    A list of the errors of the copies which failed.
+
+  Raises:
+    TransferError: if the objects cannot be listed, or neither or both of
+      source and destination are gs:// URLs.
+  """
+  if source.startswith('gs://') and not destination.startswith('gs://'):
+    bucket, prefix = _split_url(source)
+    jobs = []
+    for name, (size, md5) in sorted(
+        storage.list_objects(bucket, prefix).items()):
+      if name.endswith('/'):
+        # A "directory" placeholder object.
+        continue
+      path = os.path.join(destination, *name[len(prefix):].split('/'))
+      if not _is_copy(path, size, md5):
+        jobs.append(_download_job(storage, bucket, name, size, md5, path))
+
+  elif destination.startswith('gs://') and not source.startswith('gs://'):
+    bucket, prefix = _split_url(destination)
+    objects = storage.list_objects(bucket, prefix)
+    jobs = []
+    for directory, _, filenames in os.walk(source):
+      for filename in sorted(filenames):
+        path = os.path.join(directory, filename)
+        name = prefix + os.path.relpath(path, source).replace(os.sep, '/')
+        if name not in objects or not _is_copy(path, *objects[name]):
+          jobs.append(_upload_job(storage, path, bucket, name))
+
+  else:
+    raise TransferError('Exactly one of %s and %s must be a gs:// URL' %
+                        (source, destination))
+
+  return _run_parallel(jobs, threads)
+
+
+def main(argv):
+  args = [arg for arg in argv if arg not in ('-m', '-q')]
+  if len(args) != 4 or args[:2] != ['rsync', '-r']:
+    print('Usage: gcs_transfer.py [-m] rsync -r SOURCE DESTINATION',
+          file=sys.stderr)
+    return 2
+  try:
+    errors = rsync(Storage(Http()), args[2], args[3])
+  except TransferError as e:
+    errors = [e]
+  for e in errors:
+    if isinstance(e, (TransferError, EnvironmentError)):
+      print('ERROR: %s' % e, file=sys.stderr)
+    else:
+      print('ERROR: %s: %s' % (type(e).__name__, e), file=sys.stderr)
+  return 1 if errors else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
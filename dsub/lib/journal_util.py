@@ -0,0 +1,179 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Submission journal, recording which tasks of a job have been launched.
+
+A journal is a local, append-only file of JSON lines, one file per job:
+
+  ~/.dsub/journal/<job-id>.jsonl
+
+The first line records the job metadata and the tasks file of the job.
+Each following line records one launched task:
+
+  {"job-id": ..., "job-metadata": {...}, "tasks": "gs://bucket/tasks.tsv"}
+  {"task-id": 1}
+  {"task-id": 2}
+
+If dsub exits part way through submitting a job, "dsub --resume <job-id>"
+uses the journal to submit only the tasks that were not launched.
+"""
+
+import json
+import os
+import threading
+
+DEFAULT_JOURNAL_DIR = os.path.join(
+    os.path.expanduser('~'), '.dsub', 'journal')
+
+# Metadata fields that are needed to launch more tasks under the same job-id.
+# The script is not recorded: it comes from the command-line when resuming.
+_JOB_METADATA_FIELDS = [
+    'job-id', 'job-name', 'user-id', 'dsub-version', 'pipeline-name'
+]
+
+
+def _journal_path(job_id, journal_dir):
+  return os.path.join(journal_dir or DEFAULT_JOURNAL_DIR, '%s.jsonl' % job_id)
+
+
+def _task_id_to_int(task_id):
+  """Convert a task-id as returned by a provider ("task-n" or "n") to n."""
+  task_id = str(task_id)
+  if task_id.startswith('task-'):
+    task_id = task_id[len('task-'):]
+  return int(task_id)
+
+
+class SubmitJournal(object):
+  """Append-only record of the tasks launched for a job.
+
+  The record() method is safe to call from multiple threads.
+  """
+
+  def __init__(self, path, job_metadata, tasks, launched):
+    self._path = path
+    self._job_metadata = job_metadata
+    self._tasks = tasks
+    self._launched = launched
+    self._lock = threading.Lock()
+
+  @classmethod
+  def create(cls, job_metadata, tasks, journal_dir=None):
+    """Start a new journal for the job.
+
+    Args:
+      job_metadata: job parameters such as job-id, user-id.
+      tasks: the path of the tasks file for the job.
+      journal_dir: directory for journal files (default ~/.dsub/journal).
+
+    Returns:
+      A SubmitJournal with no launched tasks.
+
+    Raises:
+      ValueError: if a journal for the job-id already exists.
+    """
+    path = _journal_path(job_metadata['job-id'], journal_dir)
+    if os.path.exists(path):
+      raise ValueError('Journal for job %s already exists: %s' %
+                       (job_metadata['job-id'], path))
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+    metadata = {
+        field: job_metadata[field]
+        for field in _JOB_METADATA_FIELDS
+        if field in job_metadata
+    }
+    with open(path, 'w') as f:
+      f.write(json.dumps({
+          'job-id': job_metadata['job-id'],
+          'job-metadata': metadata,
+          'tasks': tasks,
+      }) + '\n')
+
+    return cls(path, metadata, tasks, set())
+
+  @classmethod
+  def load(cls, job_id, journal_dir=None):
+    """Load the journal of an earlier submission of the job.
+
+    A partially-written final line (dsub exited while writing it) is ignored.
+
+    Args:
+      job_id: the job-id to resume.
+      journal_dir: directory for journal files (default ~/.dsub/journal).
+
+    Returns:
+      A SubmitJournal, with the launched tasks recorded so far.
+
+    Raises:
+      ValueError: if there is no journal for the job-id.
+    """
+    path = _journal_path(job_id, journal_dir)
+    if not os.path.exists(path):
+      raise ValueError('No submission journal found for job %s: %s' % (job_id,
+                                                                      path))
+
+    with open(path, 'r') as f:
+      header = json.loads(f.readline())
+      launched = set()
+      line = ''
+      for line in f:
+        try:
+          record = json.loads(line)
+        except ValueError:
+          continue
+        launched.add(record['task-id'])
+
+    # Terminate a partial final line so that new records start on a new line.
+    if line and not line.endswith('\n'):
+      with open(path, 'a') as f:
+        f.write('\n')
+
+    return cls(path, header['job-metadata'], header['tasks'], launched)
+
+  @property
+  def job_metadata(self):
+    return dict(self._job_metadata)
+
+  @property
+  def tasks(self):
+    return self._tasks
+
+  def is_launched(self, task_id):
+    return task_id in self._launched
+
+  def unlaunched_tasks(self, all_task_data):
+    """Generator yielding the task data of tasks not recorded as launched."""
+    for task_data in all_task_data:
+      if task_data.get('task-id') not in self._launched:
+        yield task_data
+
+  def record(self, task_ids):
+    """Append the task-ids of newly launched tasks to the journal.
+
+    Args:
+      task_ids: list of task-ids as returned by the provider, either n or
+        "task-n". None values (non-task jobs) are ignored.
+    """
+    task_ids = [_task_id_to_int(t) for t in task_ids if t is not None]
+    if not task_ids:
+      return
+
+    lines = ''.join(json.dumps({'task-id': t}) + '\n' for t in task_ids)
+    with self._lock:
+      with open(self._path, 'a') as f:
+        f.write(lines)
+      self._launched.update(task_ids)
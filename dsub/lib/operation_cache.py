@@ -0,0 +1,180 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Local cache of the operations listed by a query, across invocations.
+
+Listing the operations of a project grows slower as the project accumulates
+finished jobs, yet finished operations never change. The cache is a SQLite
+database:
+
+  ~/.dsub/cache/operations.db
+
+which records, for each query, the operations it listed and the newest
+createTime among them (its "high-water mark"). A provider can then list only
+the operations created since the high-water mark, and fetch again only the
+cached operations that were not done. Queries are stored without a createTime
+bound (such as that of "dstat --age", which changes on each call); instead,
+the cache records the lowest bound it was listed with (its "low-water mark").
+
+The cache is an optimization only: if the database cannot be read or written,
+a warning is printed and the cache behaves as if it were empty.
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import sqlite3
+import sys
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.dsub', 'cache')
+
+# Queries not used for this long are dropped from the cache.
+_MAX_QUERY_AGE_SECONDS = 30 * 24 * 60 * 60
+
+# Beyond this many queries, the least recently used are dropped.
+_MAX_QUERIES = 100
+
+# Seconds to wait for another process writing the database.
+_LOCK_TIMEOUT_SECONDS = 30
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS queries (
+         query TEXT PRIMARY KEY,
+         create_time INTEGER,
+         min_create_time INTEGER,
+         last_used INTEGER NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS operations (
+         query TEXT NOT NULL,
+         name TEXT NOT NULL,
+         create_time INTEGER,
+         done INTEGER NOT NULL,
+         data TEXT NOT NULL,
+         PRIMARY KEY (query, name))""",
+]
+
+
+class OperationCache(object):
+  """Operations listed by earlier queries, by query.
+
+  A new database connection is opened for each call, so a cache can be used
+  from multiple threads.
+  """
+
+  def __init__(self, cache_dir=None):
+    self._path = os.path.join(cache_dir or DEFAULT_CACHE_DIR, 'operations.db')
+    self._initialized = False
+
+  def _connect(self):
+    if not self._initialized:
+      directory = os.path.dirname(self._path)
+      if not os.path.isdir(directory):
+        try:
+          os.makedirs(directory)
+        except OSError:
+          # Created concurrently, or an error reported by sqlite3.connect.
+          pass
+
+    conn = sqlite3.connect(self._path, timeout=_LOCK_TIMEOUT_SECONDS)
+    if not self._initialized:
+      with conn:
+        for statement in _SCHEMA:
+          conn.execute(statement)
+      self._initialized = True
+    return conn
+
+  def _warn(self, error):
+    print('Warning: operation cache %s: %s' % (self._path, error),
+          file=sys.stderr)
+
+  def load(self, query):
+    """Returns the cached operations of a query.
+
+    Args:
+      query: a string identifying the query, such as its filter.
+
+    Returns:
+      A tuple of the high-water createTime of the query (seconds since the
+      epoch, or None if it was never stored), its low-water createTime (None
+      if the operations were listed without a createTime bound) and a list of
+      its operations, newest first.
+    """
+    try:
+      conn = self._connect()
+      try:
+        row = conn.execute(
+            'SELECT create_time, min_create_time FROM queries WHERE query = ?',
+            (query,)).fetchone()
+        if not row:
+          return None, None, []
+        ops = conn.execute(
+            'SELECT data FROM operations WHERE query = ? '
+            'ORDER BY create_time DESC', (query,)).fetchall()
+      finally:
+        conn.close()
+    except sqlite3.Error as e:
+      self._warn(e)
+      return None, None, []
+
+    return row[0], row[1], [json.loads(data) for data, in ops]
+
+  def store(self, query, ops, create_time, min_create_time=None):
+    """Adds or replaces operations of a query, and sets its water marks.
+
+    Args:
+      query: a string identifying the query.
+      ops: a list of (name, create_time, done, data) tuples, where data is the
+        JSON-serializable operation.
+      create_time: the high-water createTime of the query, or None.
+      min_create_time: the low-water createTime of the query, or None if its
+        operations were listed without a createTime bound.
+    """
+    now = int(time.time())
+    try:
+      conn = self._connect()
+      try:
+        with conn:
+          conn.execute(
+              'INSERT OR REPLACE INTO queries '
+              '(query, create_time, min_create_time, last_used) '
+              'VALUES (?, ?, ?, ?)', (query, create_time, min_create_time, now))
+          conn.executemany(
+              'INSERT OR REPLACE INTO operations '
+              '(query, name, create_time, done, data) VALUES (?, ?, ?, ?, ?)',
+              [(query, name, op_create_time, 1 if done else 0,
+                json.dumps(data))
+               for name, op_create_time, done, data in ops])
+          self._expire(conn, now - _MAX_QUERY_AGE_SECONDS)
+      finally:
+        conn.close()
+    except sqlite3.Error as e:
+      self._warn(e)
+
+  @staticmethod
+  def _expire(conn, last_used):
+    """Deletes the queries (and their operations) no longer used.
+
+    Queries are deleted if they were not used since last_used, or if they are
+    not among the _MAX_QUERIES most recently used.
+
+    Args:
+      conn: the database connection, in a transaction.
+      last_used: the time (seconds since the epoch) of the oldest use kept.
+    """
+    expired = conn.execute(
+        'SELECT query FROM queries WHERE last_used < ? OR query NOT IN '
+        '(SELECT query FROM queries ORDER BY last_used DESC LIMIT ?)',
+        (last_used, _MAX_QUERIES)).fetchall()
+    conn.executemany('DELETE FROM operations WHERE query = ?', expired)
+    conn.executemany('DELETE FROM queries WHERE query = ?', expired)
@@ -32,6 +32,9 @@ FILE_PROVIDERS = frozenset([P_LOCAL, P_GCS])
 RESERVED_LABELS = frozenset(
     ['job-name', 'job-id', 'user-id', 'task-id', 'dsub-version'])
 
+_UNSUPPORTED_PATH_MESSAGE = ('Unsupported {argname} path ({path}) for '
+                             'provider {provider!r}.')
+
 
 def validate_param_name(name, param_type):
   """Validate that the name follows posix conventions for env variables."""
@@ -629,14 +632,36 @@ def tasks_file_to_job_data(tasks, input_file_param_util,
   Raises:
     ValueError: If no job records were provided
   """
-  job_data = []
+  return list(
+      tasks_file_to_job_data_stream(tasks, input_file_param_util,
+                                    output_file_param_util))
+
+
+def tasks_file_to_job_data_stream(tasks, input_file_param_util,
+                                  output_file_param_util):
+  """Parses task parameters from a TSV, one row at a time.
 
+  The header is read and parsed immediately, so that errors in it are
+  raised before any task is launched. Task rows are read (and a file in GCS
+  downloaded) only as the returned generator is consumed.
+
+  Args:
+    tasks: Dict containing the path to a TSV file and task numbers to run
+    variables, input, and output parameters as column headings. Subsequent
+    lines specify parameter values, one row per job.
+    input_file_param_util: Utility for producing InputFileParam objects.
+    output_file_param_util: Utility for producing OutputFileParam objects.
+
+  Returns:
+    A generator of records, each containing a dictionary of
+    'envs', 'inputs', 'outputs', 'labels' that defines the set of parameters
+    and data for each job. The generator raises ValueError if the file
+    contains no job records.
+  """
   path = tasks['path']
-  task_min = tasks.get('min')
-  task_max = tasks.get('max')
 
   # Load the file and set up a Reader that tokenizes the fields
-  param_file = dsub_util.load_file(path)
+  param_file = dsub_util.load_file_stream(path)
   reader = csv.reader(param_file, delimiter='\t')
 
   # Read the first line and extract the parameters
@@ -644,7 +669,17 @@ def tasks_file_to_job_data(tasks, input_file_param_util,
   job_params = parse_tasks_file_header(header, input_file_param_util,
                                        output_file_param_util)
 
-  # Build a list of records from the parsed input file
+  return _tasks_file_rows_to_job_data(reader, job_params, path,
+                                      tasks.get('min'), tasks.get('max'),
+                                      input_file_param_util,
+                                      output_file_param_util)
+
+
+def _tasks_file_rows_to_job_data(reader, job_params, path, task_min, task_max,
+                                 input_file_param_util, output_file_param_util):
+  """Generator yielding the job data for each row of a tasks file."""
+  job_count = 0
+
   for row in reader:
     # Tasks are numbered starting at 1 and since the first line of the TSV
     # file is a header, the first task appears on line 2.
@@ -652,7 +687,7 @@ def tasks_file_to_job_data(tasks, input_file_param_util,
     if task_min and task_id < task_min:
       continue
     if task_max and task_id > task_max:
-      continue
+      break
 
     if len(row) != len(job_params):
       dsub_util.print_error('Unexpected number of fields %s vs %s: line %s' %
@@ -681,20 +716,19 @@ def tasks_file_to_job_data(tasks, input_file_param_util,
         outputs.append(
             output_file_param_util.make_param(name, row[i], param.recursive))
 
-    job_data.append({
+    job_count += 1
+    yield {
         'task-id': task_id,
         'labels': labels,
         'envs': envs,
         'inputs': inputs,
         'outputs': outputs
-    })
+    }
 
   # Ensure that there are jobs to execute (and not just a header)
-  if not job_data:
+  if not job_count:
     raise ValueError('No tasks added from %s' % path)
 
-  return job_data
-
 
 def parse_pair_args(labels, argclass):
   """Parse flags of key=value pairs and return a list of argclass.
@@ -827,16 +861,50 @@ def validate_submit_args_or_fail(job_resources, all_task_data, provider_name,
   Raises:
     ValueError: if any file providers do not match the whitelists.
   """
-  error_message = ('Unsupported {argname} path ({path}) for '
-                   'provider {provider!r}.')
+  for _ in validated_task_data(job_resources, all_task_data, provider_name,
+                               input_providers, output_providers,
+                               logging_providers):
+    pass
+
+
+def validated_task_data(job_resources, all_task_data, provider_name,
+                        input_providers, output_providers, logging_providers):
+  """Validate arguments passed to submit_job, one task at a time.
+
+  Like validate_submit_args_or_fail, except that each task is validated only
+  as it is consumed from the returned generator. This allows all_task_data to
+  be a generator, such as the one from tasks_file_to_job_data_stream.
+  The job resources are validated immediately.
+
+  Args:
+    job_resources: instance of job_util.JobResources.
+    all_task_data: (iterable of dicts) the task data to be validated.
+    provider_name: (str) the name of the execution provider.
+    input_providers: (string collection) whitelist of file providers for input.
+    output_providers: (string collection) whitelist of providers for output.
+    logging_providers: (string collection) whitelist of providers for logging.
+
+  Returns:
+    A generator of the task data. The generator raises ValueError when it
+    reaches a task whose file providers do not match the whitelists.
+
+  Raises:
+    ValueError: if the logging file provider does not match the whitelist.
+  """
   # Validate logging file provider.
   logging = job_resources.logging
   if logging.file_provider not in logging_providers:
     raise ValueError(
-        error_message.format(
+        _UNSUPPORTED_PATH_MESSAGE.format(
             argname='logging', path=logging.uri, provider=provider_name))
 
-  # Validate input file provider.
+  return _validated_task_data(all_task_data, provider_name, input_providers,
+                              output_providers)
+
+
+def _validated_task_data(all_task_data, provider_name, input_providers,
+                         output_providers):
+  """Generator yielding each task after validating its file providers."""
   for task in all_task_data:
     for argtype, whitelist in [('inputs', input_providers), ('outputs',
                                                              output_providers)]:
@@ -845,9 +913,11 @@ def validate_submit_args_or_fail(job_resources, all_task_data, provider_name,
 
         if fileparam.file_provider not in whitelist:
           raise ValueError(
-              error_message.format(
+              _UNSUPPORTED_PATH_MESSAGE.format(
                   argname=argname, path=fileparam.uri, provider=provider_name))
 
+    yield task
+
 
 def directory_fmt(directory):
   """In ensure that directories end with '/'.
@@ -0,0 +1,73 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Scheduling of the polls made while waiting for jobs."""
+
+import random
+
+# Growth of the poll interval after each poll that saw no change.
+_BACKOFF_FACTOR = 1.5
+
+# Each interval is randomly varied by up to this fraction, so that many
+# processes waiting at the same time do not poll in lock-step.
+_JITTER = 0.1
+
+
+class PollScheduler(object):
+  """Adaptive interval between polls.
+
+  Polling starts at the minimum interval. While polls see no change the
+  interval grows geometrically, up to the maximum interval. A poll that sees a
+  change resets the interval to the minimum.
+
+  With no maximum interval (or one not above the minimum), polls are made
+  every minimum interval, without jitter.
+  """
+
+  def __init__(self, min_interval, max_interval=None, random_function=None):
+    """Create a poll scheduler.
+
+    Args:
+      min_interval: seconds between polls after a change.
+      max_interval: upper bound on the seconds between polls.
+      random_function: function(a, b) returning a random number in [a, b],
+        used for jitter (default random.uniform).
+    """
+    self._min_interval = min_interval
+    self._max_interval = max(min_interval, max_interval or 0)
+    self._random_function = random_function or random.uniform
+    self._interval = None
+
+  @property
+  def adaptive(self):
+    return self._max_interval > self._min_interval
+
+  def next_interval(self, changed):
+    """Return the seconds to wait before the next poll.
+
+    Args:
+      changed: whether the poll just made saw any change.
+
+    Returns:
+      The number of seconds to sleep.
+    """
+    if self._interval is None or changed or not self.adaptive:
+      self._interval = self._min_interval
+    else:
+      self._interval = min(self._interval * _BACKOFF_FACTOR,
+                           self._max_interval)
+
+    if not self.adaptive:
+      return self._interval
+    return max(0, self._interval *
+               (1 + self._random_function(-_JITTER, _JITTER)))
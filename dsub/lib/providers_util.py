@@ -22,6 +22,65 @@ _LOCALIZE_COMMAND_MAP = {
     param_util.P_LOCAL: 'rsync -r',
 }
 
+# Number of copies (of directories or groups of files) to run at once.
+TRANSFER_PARALLELISM = 4
+
+
+def _build_parallel_command(copy_commands):
+  """Return a shell script running the copy commands in the background.
+
+  Up to TRANSFER_PARALLELISM commands run at a time, and a command starts as
+  soon as one of those running finishes. Each is run in a subshell, so a
+  command that fails with "exit 1" fails the script only once the other
+  commands have finished.
+
+  Arguments:
+    copy_commands: a list of shell scripts.
+
+  Returns:
+    a multi-line string with a shell script, empty if there are no commands.
+  """
+  if not copy_commands:
+    return ''
+  started = '\n'.join([
+      'wait_for_copy_slot\n(\n%s\n) &\ncopy_pids+=($!)' % command.strip('\n')
+      for command in copy_commands
+  ])
+  return textwrap.dedent("""\
+      copy_failed=0
+      copy_pids=()
+      # Waits until fewer than {parallelism} of the copies started are running.
+      # wait -n (bash 4.3 and later) returns as soon as a copy finishes; older
+      # shells check every second.
+      wait_for_copy_slot() {{
+        local copy_pid running
+        while (( ${{#copy_pids[@]}} >= {parallelism} )); do
+          running=0
+          for copy_pid in "${{copy_pids[@]}}"; do
+            if kill -0 "${{copy_pid}}" 2> /dev/null; then
+              running=$((running + 1))
+            fi
+          done
+          if (( running < {parallelism} )); then
+            return
+          fi
+          if (( BASH_VERSINFO[0] > 4 ||
+                (BASH_VERSINFO[0] == 4 && BASH_VERSINFO[1] >= 3) )); then
+            wait -n || true
+          else
+            sleep 1
+          fi
+        done
+      }}
+      {started}
+      for copy_pid in "${{copy_pids[@]}}"; do
+        wait "${{copy_pid}}" || copy_failed=1
+      done
+      if ((copy_failed)); then
+        exit 1
+      fi""").format(
+          parallelism=TRANSFER_PARALLELISM, started=started)
+
 
 def build_recursive_localize_env(destination, inputs):
   """Return a multi-line string with export statements for the variables.
@@ -57,14 +116,14 @@ def build_recursive_localize_command(destination, inputs, file_filter):
 
   Returns:
     a multi-line string with a shell script that copies the inputs
-    recursively from GCS.
+    recursively from GCS, TRANSFER_PARALLELISM directories at a time.
   """
   command = _LOCALIZE_COMMAND_MAP[file_filter]
   filtered_inputs = [
       var for var in inputs
       if var.recursive and var.file_provider == file_filter
   ]
-  copy_input_dirs = '\n'.join([
+  return _build_parallel_command([
       textwrap.dedent("""
       mkdir -p {data_mount}/{docker_path}
       for ((i = 0; i < 3; i++)); do
@@ -82,7 +141,6 @@ def build_recursive_localize_command(destination, inputs, file_filter):
           data_mount=destination.rstrip('/'),
           docker_path=var.docker_path) for var in filtered_inputs
   ])
-  return copy_input_dirs
 
 
 def build_recursive_gcs_delocalize_env(source, outputs):
@@ -121,15 +179,15 @@ def build_recursive_delocalize_command(source, outputs, file_filter):
                  matches this file filter.
 
   Returns:
-    a multi-line string with a shell script that copies the inputs
-    recursively to GCS.
+    a multi-line string with a shell script that copies the outputs
+    recursively to GCS, TRANSFER_PARALLELISM directories at a time.
   """
   command = _LOCALIZE_COMMAND_MAP[file_filter]
   filtered_outputs = [
       var for var in outputs
       if var.recursive and var.file_provider == file_filter
   ]
-  return '\n'.join([
+  return _build_parallel_command([
       textwrap.dedent("""
       for ((i = 0; i < 3; i++)); do
         if {command} {data_mount}/{docker_path} {destination_uri}; then
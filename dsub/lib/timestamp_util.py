@@ -0,0 +1,164 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Parsing and local time conversion of timestamps.
+
+dstat converts several timestamps for each task it lists, so these functions
+avoid regular expressions and time zone objects:
+* RFC3339 timestamps are parsed by their fixed layout.
+* The local time zone's offset from UTC is looked up once per 15 minutes of
+  time (time zones only change their offset on such boundaries).
+* Recently converted values are cached, as the tasks of a job share many of
+  their timestamps.
+"""
+
+import calendar
+from datetime import datetime
+import time
+
+# Format of local times for display.
+_DISPLAY_FORMAT = '%04d-%02d-%02d %02d:%02d:%02d'
+
+# Number of recently converted timestamps to keep (in each generation).
+_CACHE_SIZE = 4096
+
+# Granularity of the cache of local time zone offsets.
+_OFFSET_BUCKET_SECONDS = 15 * 60
+
+
+class _LruCache(object):
+  """A dict of limited size, which discards the least recently used keys.
+
+  Keys are kept in two generations. New and recently read keys go into the
+  current generation. When it is full, it becomes the previous generation and
+  the keys that were not read since are discarded. This approximates an LRU
+  cache with plain dict operations, which are safe to use from multiple
+  threads.
+  """
+
+  def __init__(self, max_size):
+    self._max_size = max_size
+    self._current = {}
+    self._previous = {}
+
+  def get(self, key):
+    """Returns the value for the key (as most recently used), or None."""
+    value = self._current.get(key)
+    if value is None:
+      value = self._previous.get(key)
+      if value is not None:
+        self.put(key, value)
+    return value
+
+  def put(self, key, value):
+    if len(self._current) >= self._max_size:
+      self._previous = self._current
+      self._current = {}
+    self._current[key] = value
+
+  def clear(self):
+    self._current = {}
+    self._previous = {}
+
+
+_LOCALIZED_RFC3339 = _LruCache(_CACHE_SIZE)
+_LOCAL_OFFSETS = _LruCache(_CACHE_SIZE)
+
+
+def parse_rfc3339_utc_seconds(datestamp):
+  """Parses an RFC3339 UTC "Zulu" timestamp to seconds since the epoch.
+
+  Timestamps from the Google APIs are sometimes formatted to nanoseconds and
+  sometimes only to seconds. Both are accepted:
+  * 2016-11-14T23:04:55Z
+  * 2016-11-14T23:05:56.010429380Z
+  Sub-second precision is dropped.
+
+  Args:
+    datestamp: a timestamp string.
+
+  Returns:
+    An integer number of seconds since the epoch, or None if the datestamp is
+    not an RFC3339 UTC timestamp.
+  """
+  if (len(datestamp) < 20 or datestamp[-1] != 'Z' or datestamp[4] != '-' or
+      datestamp[7] != '-' or datestamp[10] != 'T' or datestamp[13] != ':' or
+      datestamp[16] != ':'):
+    return None
+
+  # Converting all the digits at once is faster than field by field.
+  digits = (datestamp[0:4] + datestamp[5:7] + datestamp[8:10] +
+            datestamp[11:13] + datestamp[14:16] + datestamp[17:19])
+  if not digits.isdigit():
+    return None
+  value, second = divmod(int(digits), 100)
+  value, minute = divmod(value, 100)
+  value, hour = divmod(value, 100)
+  value, day = divmod(value, 100)
+  year, month = divmod(value, 100)
+
+  try:
+    # Validates the fields (such as the day of the month).
+    datetime(year, month, day, hour, minute, second)
+  except ValueError:
+    return None
+  return calendar.timegm((year, month, day, hour, minute, second))
+
+
+def _local_offset_seconds(seconds):
+  """The local time zone's offset from UTC at the given time."""
+  bucket = seconds // _OFFSET_BUCKET_SECONDS
+  offset = _LOCAL_OFFSETS.get(bucket)
+  if offset is None:
+    start = bucket * _OFFSET_BUCKET_SECONDS
+    offset = calendar.timegm(time.localtime(start)) - start
+    _LOCAL_OFFSETS.put(bucket, offset)
+  return offset
+
+
+def localize_rfc3339(datestamp):
+  """Converts an RFC3339 UTC timestamp to a local time string for display.
+
+  Args:
+    datestamp: a timestamp in RFC3339 UTC "Zulu" format.
+
+  Returns:
+    A datestamp in local time and up to seconds ("YYYY-MM-DD HH:MM:SS"), or
+    the original string if it cannot be parsed.
+  """
+  value = _LOCALIZED_RFC3339.get(datestamp)
+  if value is not None:
+    return value
+
+  seconds = parse_rfc3339_utc_seconds(datestamp)
+  if seconds is None:
+    return datestamp
+
+  value = _DISPLAY_FORMAT % time.gmtime(
+      seconds + _local_offset_seconds(seconds))[:6]
+  _LOCALIZED_RFC3339.put(datestamp, value)
+  return value
+
+
+def utc_seconds_to_local_datetime(seconds):
+  """Converts seconds since the epoch to a naive local datetime.
+
+  Args:
+    seconds: seconds since the epoch, or None.
+
+  Returns:
+    A datetime in local time without tzinfo, or None.
+  """
+  if seconds is None:
+    return None
+  return datetime.fromtimestamp(seconds)
@@ -76,13 +76,21 @@ class JobProvider(object):
     raise NotImplementedError()
 
   @abstractmethod
-  def submit_job(self, job_resources, job_metadata, all_task_data):
+  def submit_job(self,
+                 job_resources,
+                 job_metadata,
+                 all_task_data,
+                 journal=None):
     """Submit the job to be executed.
 
     Args:
       job_resources: resource parameters required by each job.
       job_metadata: job parameters such as job-id, user-id, script.
-      all_task_data: list of parameters to launch each job task.
+      all_task_data: list (or other iterable, such as a generator) of
+        parameters to launch each job task. Providers should consume it only
+        once, so that tasks can be launched as they are read.
+      journal: optional journal_util.SubmitJournal. Providers record each task
+        in the journal as soon as it is launched.
 
     job_resources contains settings related to how many resources to give each
     task. Its fields include: min_cores, min_ram, disk_size, boot_disk_size,
@@ -91,7 +99,7 @@ class JobProvider(object):
     job_metadata is a dictionary. Its fields include: 'script', 'pipeline-name',
     'job-name', 'job-id', 'user-id', 'is_table'.
 
-    task_parameters is a list of dictionaries, one per task to execute.
+    all_task_data is an iterable of dictionaries, one per task to execute.
     Each contains the following fields: 'envs', 'inputs', 'outputs'.
 
     Returns:
@@ -141,7 +149,8 @@ class JobProvider(object):
                        task_list=None,
                        labels=None,
                        create_time=None,
-                       max_tasks=0):
+                       max_tasks=0,
+                       fields=None):
     """Return a list of tasks based on the search criteria.
 
     If any of the filters are empty or "[*]", then no filtering is performed on
@@ -158,6 +167,8 @@ class JobProvider(object):
       labels: a list of LabelParam, each must match the job(s) returned.
       create_time: a UTC value for earliest create time for a task.
       max_tasks: the maximum number of job tasks to return or 0 for no limit.
+      fields: a list of the task fields (see Task.get_field) the caller will
+        read, so that providers can fetch only what is needed. None for all.
 
     Returns:
       A list of Task objects.
@@ -167,6 +178,77 @@ class JobProvider(object):
     """
     raise NotImplementedError()
 
+  def iter_job_tasks(self,
+                     status_list,
+                     user_list=None,
+                     job_list=None,
+                     job_name_list=None,
+                     task_list=None,
+                     labels=None,
+                     create_time=None,
+                     max_tasks=0,
+                     fields=None):
+    """Generator version of lookup_job_tasks.
+
+    This default implementation yields the tasks of lookup_job_tasks.
+    Providers which can return tasks before the lookup is complete should
+    override it.
+
+    Args:
+      status_list: as for lookup_job_tasks.
+      user_list: as for lookup_job_tasks.
+      job_list: as for lookup_job_tasks.
+      job_name_list: as for lookup_job_tasks.
+      task_list: as for lookup_job_tasks.
+      labels: as for lookup_job_tasks.
+      create_time: as for lookup_job_tasks.
+      max_tasks: as for lookup_job_tasks.
+      fields: as for lookup_job_tasks.
+
+    Yields:
+      Task objects.
+    """
+    for task in self.lookup_job_tasks(
+        status_list,
+        user_list=user_list,
+        job_list=job_list,
+        job_name_list=job_name_list,
+        task_list=task_list,
+        labels=labels,
+        create_time=create_time,
+        max_tasks=max_tasks,
+        fields=fields):
+      yield task
+
+  def refresh_tasks(self, tasks):
+    """Return the current state of the given tasks.
+
+    This default implementation looks up the tasks' jobs again and picks the
+    given tasks out of the result. Providers which can fetch tasks directly
+    should override it.
+
+    Args:
+      tasks: a list of Task objects, as returned by lookup_job_tasks.
+
+    Returns:
+      A list of Task objects, in the order of the given tasks. Tasks which can
+      no longer be found are omitted.
+    """
+    if not tasks:
+      return []
+
+    def task_key(task):
+      return (task.get_field('job-id'), task.get_field('task-id'))
+
+    job_ids = sorted(set(task.get_field('job-id') for task in tasks))
+    current = {
+        task_key(task): task
+        for task in self.lookup_job_tasks(['*'], job_list=job_ids)
+    }
+    return [current[task_key(task)]
+            for task in tasks
+            if task_key(task) in current]
+
   @abstractmethod
   def get_tasks_completion_messages(self, tasks):
     """List of the error message of each given task."""
@@ -176,6 +258,9 @@ class JobProvider(object):
 class Task(object):
   """Basic container for task metadata."""
 
+  # Allows subclasses to define __slots__.
+  __slots__ = ()
+
   @abstractmethod
   def raw_task_data(self):
     """Return a provider-specific representation of task data.
@@ -18,33 +18,42 @@ This module implements job creation, listing, and canceling using the
 Google Genomics Pipelines and Operations APIs.
 """
 
-# pylint: disable=g-tzinfo-datetime
+import collections
 from datetime import datetime
+import email.utils
 import itertools
 import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
+import pipes
 import re
 import socket
 import string
 import sys
 import textwrap
+import threading
+import time
 from . import base
 from .._dsub_version import DSUB_VERSION
 
 import apiclient.discovery
 import apiclient.errors
-from dateutil.tz import tzlocal
+import httplib2
 
+from ..lib import gcs_transfer
 from ..lib import param_util
 from ..lib import providers_util
+from ..lib import timestamp_util
 from oauth2client.client import GoogleCredentials
 from oauth2client.client import HttpAccessTokenRefreshError
-import pytz
 import retrying
 
 
 _PROVIDER_NAME = 'google'
 
+SLEEP_FUNCTION = time.sleep  # so we can replace it in tests
+
 # Create file provider whitelist.
 _SUPPORTED_FILE_PROVIDERS = frozenset([param_util.P_GCS])
 _SUPPORTED_LOGGING_PROVIDERS = _SUPPORTED_FILE_PROVIDERS
@@ -98,8 +107,8 @@ DOCKER_COMMAND = textwrap.dedent("""\
   echo "${{_SCRIPT}}" > "{script_path}"
   chmod u+x "{script_path}"
 
-  # Install gsutil if there are recursive copies to do
-  {install_cloud_sdk}
+  # Make gsutil available if there are recursive copies to do
+  {setup_gsutil}
 
   # Set environment variables for inputs with wildcards
   {export_inputs_with_wildcards}
@@ -157,6 +166,44 @@ INSTALL_CLOUD_SDK = textwrap.dedent("""\
   fi
 """)
 
+# Path of the copy of dsub/lib/gcs_transfer.py in the Docker container.
+_GCS_TRANSFER_PATH = '/tmp/dsub_gcs_transfer.py'
+
+# Recursive copies run "gsutil -m rsync -r". If the docker image has Python
+# but not gsutil, that command runs dsub/lib/gcs_transfer.py instead, which
+# is quicker than installing the Cloud SDK (which is left for images without
+# Python).
+SETUP_GSUTIL = textwrap.dedent("""\
+  if ! type gsutil; then
+    if type python3; then
+      readonly DSUB_PYTHON=python3
+    elif type python; then
+      readonly DSUB_PYTHON=python
+    else
+      readonly DSUB_PYTHON=''
+    fi
+    if [[ -n "${{DSUB_PYTHON}}" ]]; then
+      printf '%s\\n' {gcs_transfer_source} > {gcs_transfer_path}
+      gsutil() {{
+        "${{DSUB_PYTHON}}" {gcs_transfer_path} "$@"
+      }}
+    else
+      {install_cloud_sdk}
+    fi
+  fi
+""")
+
+
+def _build_setup_gsutil_command():
+  """Returns SETUP_GSUTIL, with the source of gcs_transfer to stage."""
+  with open(os.path.splitext(gcs_transfer.__file__)[0] + '.py') as f:
+    source = f.read()
+  return SETUP_GSUTIL.format(
+      gcs_transfer_source=pipes.quote(source),
+      gcs_transfer_path=_GCS_TRANSFER_PATH,
+      install_cloud_sdk=INSTALL_CLOUD_SDK.rstrip().replace('\n', '\n    '))
+
+
 # Transient errors for the Google APIs should not cause them to fail.
 # There are a set of HTTP and socket errors which we automatically retry.
 #  429: too frequent polling
@@ -166,6 +213,75 @@ TRANSIENT_HTTP_ERROR_CODES = set([429, 500, 503, 504])
 # Socket error 104 (connection reset) should also be retried
 TRANSIENT_SOCKET_ERROR_CODES = set([104])
 
+# HTTP status code indicating that requests are being rate limited.
+RATE_LIMITED_HTTP_ERROR_CODE = 429
+
+# When submitting tasks concurrently, each worker is handed requests from a
+# bounded window so that we never build (much) more than the pool can send.
+_SUBMIT_WINDOW_PER_WORKER = 4
+
+# Maximum number of calls the Google APIs accept in a single batch request.
+MAX_SUBMIT_BATCH_SIZE = 1000
+
+# Retry policy for the subset of batched calls that fail with transient errors.
+# This mirrors the _Api.execute policy:
+# Maximum 23 attempts.  Wait 1, 2, 4 ... 64, 64, 64... seconds.
+_BATCH_MAX_ATTEMPTS = 23
+_BATCH_MAX_WAIT_SECONDS = 64
+
+# lookup_job_tasks queries the combinations of values of its filter lists.
+# Beyond this many combinations, lists are dropped from the server-side filter
+# (and applied client-side instead) as long as the remaining filter narrows
+# the query to a job, job name, user, or creation time.
+_MAX_LOOKUP_FANOUT = 4
+
+# Job-ids end in the submitter's local time (yymmdd-HHMMSS-ff). When deriving
+# a createTime lower bound from them, allow for any time zone offset.
+_JOB_ID_TIMESTAMP_RE = re.compile(r'--(\d{6}-\d{6})-\d{2}$')
+_JOB_ID_CREATE_TIME_MARGIN_SECONDS = 24 * 60 * 60
+
+# Maximum number of operations.list queries of a lookup to run concurrently.
+_MAX_LOOKUP_THREADS = 8
+
+# Seconds between checks for KeyboardInterrupt while waiting on a prefetched
+# page. Under Python 2, a wait without a timeout cannot be interrupted.
+_PREFETCH_WAIT_SECONDS = 0.1
+
+# With an operation cache, operations created this long before the newest
+# cached operation of a query are listed again, in case they were not yet
+# visible to the previous listing.
+_CACHE_CREATE_TIME_MARGIN_SECONDS = 60
+
+# Operation fields fetched by every lookup that requests only some task fields.
+# They identify dsub operations and give the labels, status and timestamps of
+# each task. Most of an operation is its request, which holds the pipeline
+# (including the docker command) and the script, so it is only fetched for the
+# task fields that need it.
+_LOOKUP_OPERATION_FIELDS = [
+    'name',
+    'done',
+    'error',
+    'metadata/labels',
+    'metadata/createTime',
+    'metadata/endTime',
+    'metadata/events(description,startTime)',
+    'metadata/request/@type',
+]
+
+# Additional operation fields needed for the value of a task field.
+_TASK_FIELD_OPERATION_FIELDS = {
+    'logging': ['metadata/request/pipelineArgs/logging'],
+    'envs': [
+        'metadata/request/pipelineArgs/inputs',
+        'metadata/request/ephemeralPipeline/inputParameters'
+    ],
+    'inputs': [
+        'metadata/request/pipelineArgs/inputs',
+        'metadata/request/ephemeralPipeline/inputParameters'
+    ],
+    'outputs': ['metadata/request/pipelineArgs/outputs'],
+}
+
 # When attempting to cancel an operation that is already completed
 # (succeeded, failed, or canceled), the response will include:
 # "error": {
@@ -295,6 +411,83 @@ class _Label(param_util.LabelParam):
     return ''.join(label_char_transform(c) for c in s)
 
 
+class _ApiBackoff(object):
+  """Hold-off shared by all threads issuing API requests.
+
+  The retrying decorator on _Api.execute backs off each call independently.
+  When many requests are in flight concurrently (such as with parallel task
+  submission), a rate limited (429) response to one of them means they are
+  all going to be rate limited. Record the throttling here so that every
+  thread pauses before issuing its next request.
+  """
+
+  # Hold-off after consecutive rate limited responses: 1, 2, 4 ... 64 seconds.
+  _MAX_HOLD_SECONDS = 64
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._resume_time = 0
+    self._throttle_count = 0
+
+  def wait(self):
+    """Blocks until any hold-off in effect has expired."""
+    while True:
+      with self._lock:
+        delay = self._resume_time - time.time()
+      if delay <= 0:
+        return
+      SLEEP_FUNCTION(delay)
+
+  def throttled(self, retry_after=None):
+    """Records a rate limited response and extends the hold-off.
+
+    Args:
+      retry_after: seconds to wait, as requested by the server in a
+        Retry-After header. The hold-off is at least this long.
+    """
+    with self._lock:
+      hold = min(2**self._throttle_count, self._MAX_HOLD_SECONDS)
+      if retry_after is not None:
+        hold = max(hold, retry_after)
+      self._throttle_count += 1
+      self._resume_time = max(self._resume_time, time.time() + hold)
+
+  def succeeded(self):
+    """Records a successful response, resetting the hold-off growth."""
+    with self._lock:
+      self._throttle_count = 0
+
+
+_API_BACKOFF = _ApiBackoff()
+
+
+def _retry_after_seconds(resp):
+  """Seconds to wait according to the Retry-After header of a response.
+
+  The header is either a number of seconds or an HTTP date.
+
+  Args:
+    resp: an httplib2.Response.
+
+  Returns:
+    The number of seconds to wait, or None if the response has no valid
+    Retry-After header.
+  """
+  value = resp.get('retry-after')
+  if not value:
+    return None
+
+  try:
+    return max(0, int(value))
+  except ValueError:
+    pass
+
+  parsed = email.utils.parsedate_tz(value)
+  if parsed:
+    return max(0, email.utils.mktime_tz(parsed) - time.time())
+  return None
+
+
 def _retry_api_check(exception):
   """Return True if we should retry. False otherwise.
 
@@ -308,6 +501,12 @@ def _retry_api_check(exception):
 
   if isinstance(exception, apiclient.errors.HttpError):
     if exception.resp.status in TRANSIENT_HTTP_ERROR_CODES:
+      # Have all threads hold off for rate limited responses and for any
+      # response where the server tells us how long to wait.
+      retry_after = _retry_after_seconds(exception.resp)
+      if (exception.resp.status == RATE_LIMITED_HTTP_ERROR_CODE or
+          retry_after is not None):
+        _API_BACKOFF.throttled(retry_after)
       return True
 
   if isinstance(exception, socket.error):
@@ -330,8 +529,31 @@ class _Api(object):
       retry_on_exception=_retry_api_check,
       wait_exponential_multiplier=1000,
       wait_exponential_max=64000)
-  def execute(api):
-    return api.execute()
+  def execute(api, http=None):
+    _API_BACKOFF.wait()
+    response = api.execute(http=http)
+    _API_BACKOFF.succeeded()
+    return response
+
+
+class PipelineBatchError(Exception):
+  """A call in a batch of pipeline runs failed.
+
+  Other calls in the batch may have succeeded: their pipelines are running.
+
+  Attributes:
+    error: the apiclient.errors.HttpError of the failed call.
+    operations: a list of the operations launched, in the same order as the
+      pipelines of the batch, with None for pipelines which were not launched.
+  """
+
+  def __init__(self, error, operations):
+    launched = len([op for op in operations if op])
+    super(PipelineBatchError, self).__init__(
+        '%s (%d of %d pipelines of the batch were launched)' %
+        (error, launched, len(operations)))
+    self.error = error
+    self.operations = operations
 
 
 class _Pipelines(object):
@@ -375,7 +597,7 @@ class _Pipelines(object):
     #
     # The docker_command:
     # * writes the script body to a file
-    # * installs gcloud if there are recursive copies to do
+    # * makes gsutil available if there are recursive copies to do
     # * sets environment variables for inputs with wildcards
     # * sets environment variables for recursive input directories
     # * recursively copies input directories
@@ -388,9 +610,9 @@ class _Pipelines(object):
     recursive_input_dirs = [var for var in inputs if var.recursive]
     recursive_output_dirs = [var for var in outputs if var.recursive]
 
-    install_cloud_sdk = ''
+    setup_gsutil = ''
     if recursive_input_dirs or recursive_output_dirs:
-      install_cloud_sdk = INSTALL_CLOUD_SDK
+      setup_gsutil = _build_setup_gsutil_command()
 
     export_input_dirs = ''
     copy_input_dirs = ''
@@ -429,7 +651,7 @@ class _Pipelines(object):
     return DOCKER_COMMAND.format(
         mk_runtime_dirs=MK_RUNTIME_DIRS_COMMAND,
         script_path='%s/%s' % (SCRIPT_DIR, script_name),
-        install_cloud_sdk=install_cloud_sdk,
+        setup_gsutil=setup_gsutil,
         export_inputs_with_wildcards=export_inputs_with_wildcards,
         export_input_dirs=export_input_dirs,
         copy_input_dirs=copy_input_dirs,
@@ -471,39 +693,8 @@ class _Pipelines(object):
     docker_command = cls._build_pipeline_docker_command(script_name, inputs,
                                                         outputs)
 
-    # Pipelines inputParameters can be both simple name/value pairs which get
-    # set as environment variables, as well as input file paths which the
-    # Pipelines controller will automatically localize to the Pipeline VM.
-
-    # In the ephemeralPipeline object, the inputParameters are only defined;
-    # the values are passed in the pipelineArgs.
-
-    # Pipelines outputParameters are only output file paths, which the
-    # Pipelines controller can automatically de-localize after the docker
-    # command completes.
-
-    # The Pipelines API does not support recursive copy of file parameters,
-    # so it is implemented within the dsub-generated pipeline.
-    # Any inputs or outputs marked as "recursive" are completely omitted here;
-    # their environment variables will be set in the docker command, and
-    # recursive copy code will be generated there as well.
-
-    input_envs = [{
-        'name': SCRIPT_VARNAME
-    }] + [{
-        'name': env.name
-    } for env in envs]
-
-    input_files = [
-        cls._build_pipeline_input_file_param(var.name, var.docker_path)
-        for var in inputs if not var.recursive
-    ]
-
-    # Outputs are an array of file parameters
-    output_files = [
-        cls._build_pipeline_file_param(var.name, var.docker_path)
-        for var in outputs if not var.recursive
-    ]
+    input_parameters, output_parameters = cls.build_pipeline_parameters(
+        envs, inputs, outputs)
 
     # The ephemeralPipeline provides the template for the pipeline.
     # pyformat: disable
@@ -530,8 +721,8 @@ class _Pipelines(object):
                 }],
             },
 
-            'inputParameters': input_envs + input_files,
-            'outputParameters': output_files,
+            'inputParameters': input_parameters,
+            'outputParameters': output_parameters,
 
             'docker': {
                 'imageName': image,
@@ -541,6 +732,57 @@ class _Pipelines(object):
     }
     # pyformat: enable
 
+  @classmethod
+  def build_pipeline_parameters(cls, envs, inputs, outputs):
+    """Builds the inputParameters and outputParameters of a pipeline.
+
+    Args:
+      envs: list of EnvParam objects specifying environment variables to set
+        within each job.
+      inputs: list of FileParam objects specifying input variables to set
+        within each job.
+      outputs: list of FileParam objects specifying output variables to set
+        within each job.
+
+    Returns:
+      A tuple of the list of inputParameters and the list of outputParameters.
+    """
+    # Pipelines inputParameters can be both simple name/value pairs which get
+    # set as environment variables, as well as input file paths which the
+    # Pipelines controller will automatically localize to the Pipeline VM.
+
+    # In the ephemeralPipeline object, the inputParameters are only defined;
+    # the values are passed in the pipelineArgs.
+
+    # Pipelines outputParameters are only output file paths, which the
+    # Pipelines controller can automatically de-localize after the docker
+    # command completes.
+
+    # The Pipelines API does not support recursive copy of file parameters,
+    # so it is implemented within the dsub-generated pipeline.
+    # Any inputs or outputs marked as "recursive" are completely omitted here;
+    # their environment variables will be set in the docker command, and
+    # recursive copy code will be generated there as well.
+
+    input_envs = [{
+        'name': SCRIPT_VARNAME
+    }] + [{
+        'name': env.name
+    } for env in envs]
+
+    input_files = [
+        cls._build_pipeline_input_file_param(var.name, var.docker_path)
+        for var in inputs if not var.recursive
+    ]
+
+    # Outputs are an array of file parameters
+    output_files = [
+        cls._build_pipeline_file_param(var.name, var.docker_path)
+        for var in outputs if not var.recursive
+    ]
+
+    return input_envs + input_files, output_files
+
   @classmethod
   def build_pipeline_args(cls, project, script, task_data, preemptible,
                           logging_uri, scopes, keep_alive):
@@ -616,13 +858,75 @@ class _Pipelines(object):
     return args
 
   @staticmethod
-  def run_pipeline(service, pipeline):
-    return _Api.execute(service.pipelines().run(body=pipeline))
+  def run_pipeline(service, pipeline, http=None):
+    return _Api.execute(service.pipelines().run(body=pipeline), http=http)
+
+  @staticmethod
+  def run_pipelines(service, pipelines, http=None):
+    """Runs a list of pipelines with a batch HTTP request.
+
+    Each pipeline is a separate call within the batch and can fail on its own.
+    Calls that fail with a transient error are resubmitted (in a new batch)
+    with exponential backoff; calls that succeeded are not resubmitted.
+
+    Args:
+      service: Google Genomics API service object.
+      pipelines: a list of pipeline requests.
+      http: an optional httplib2.Http object with which to send the batch.
+
+    Returns:
+      A list of operations, in the same order as the pipelines.
+
+    Raises:
+      PipelineBatchError: if any call fails with a non-transient error or
+        still fails with a transient error after all retry attempts. The
+        error carries the operations of the calls that succeeded.
+    """
+    operations = [None] * len(pipelines)
+    pending = range(len(pipelines))
+
+    for attempt in range(_BATCH_MAX_ATTEMPTS):
+      if attempt:
+        SLEEP_FUNCTION(min(2**(attempt - 1), _BATCH_MAX_WAIT_SECONDS))
+
+      # The callback gets a "request_id" which is the index of the pipeline.
+      failed = []
+
+      def handle_run(request_id, response, exception):
+        """Callback for the run response."""
+        if exception:
+          failed.append((int(request_id), exception))
+        else:
+          operations[int(request_id)] = response
+
+      batch = service.new_batch_http_request(callback=handle_run)
+      for index in pending:
+        batch.add(
+            service.pipelines().run(body=pipelines[index]),
+            request_id=str(index))
+      _Api.execute(batch, http=http)
+
+      if not failed:
+        return operations
+
+      for _, exception in failed:
+        if not _retry_api_check(exception):
+          raise PipelineBatchError(exception, operations)
+
+      pending = sorted(index for index, _ in failed)
+
+    raise PipelineBatchError(failed[0][1], operations)
 
 
 class _Operations(object):
   """Utilty methods for querying and canceling pipeline operations."""
 
+  # Threads which prefetch the pages of operations.list queries, shared by
+  # all queries (one page is in flight per query, and at most
+  # _MAX_LOOKUP_THREADS queries run at once). Created on first use.
+  _prefetch_pool = None
+  _prefetch_pool_lock = threading.Lock()
+
   @staticmethod
   def get_filter(project,
                  status=None,
@@ -710,52 +1014,152 @@ class _Operations(object):
 
     return True
 
+  @staticmethod
+  def get_fields(task_fields):
+    """Return a partial response field mask for operations.list().
+
+    Args:
+      task_fields: list of the task fields (as for GoogleOperation.get_field)
+        that will be read from the operations, or None for all fields.
+
+    Returns:
+      A field mask string, or None to fetch complete operations.
+    """
+    if task_fields is None:
+      return None
+
+    operation_fields = list(_LOOKUP_OPERATION_FIELDS)
+    for task_field in task_fields:
+      for operation_field in _TASK_FIELD_OPERATION_FIELDS.get(task_field, []):
+        if operation_field not in operation_fields:
+          operation_fields.append(operation_field)
+
+    return 'nextPageToken,operations(%s)' % ','.join(operation_fields)
+
   @classmethod
-  def list(cls, service, ops_filter, max_ops=0):
+  def list(cls,
+           service,
+           ops_filter,
+           max_ops=0,
+           predicate=None,
+           http=None,
+           fields=None):
     """Gets the list of operations for the specified filter.
 
     Args:
       service: Google Genomics API service object
       ops_filter: string filter of operations to return
       max_ops: maximum number of operations to return (0 indicates no maximum)
+      predicate: optional function of a GoogleOperation; only operations for
+        which it returns True are returned (and count towards max_ops).
+      http: an optional httplib2.Http object with which to send requests.
+      fields: an optional partial response field mask, from get_fields().
 
     Returns:
       A list of operations matching the filter criteria.
     """
+    return list(
+        cls.iter_list(service, ops_filter, max_ops, predicate, http, fields))
 
-    operations = []
-    page_token = None
-    page_size = None
+  @classmethod
+  def iter_list(cls,
+                service,
+                ops_filter,
+                max_ops=0,
+                predicate=None,
+                http=None,
+                fields=None):
+    """Generator of the operations for the specified filter.
+
+    Each page is requested, in a background thread, as soon as its page token
+    is known. So the next page is fetched while the operations of the current
+    page are checked and yielded. At most one request is in flight at a time,
+    and none once the generator is done, even if closed early. The background
+    threads are shared by all listings, so the Http object (which is not
+    thread-safe) must not be used by the caller while the listing runs.
 
-    while not max_ops or len(operations) < max_ops:
-      if max_ops:
-        # If a maximum number of operations is requested, limit the requested
-        # pageSize to the documented default (256) or less if we can.
-        page_size = min(max_ops - len(operations), 256)
+    Args:
+      service: Google Genomics API service object
+      ops_filter: string filter of operations to return
+      max_ops: maximum number of operations to return (0 indicates no maximum)
+      predicate: optional function of a GoogleOperation; only operations for
+        which it returns True are returned (and count towards max_ops).
+      http: an optional httplib2.Http object with which to send requests.
+      fields: an optional partial response field mask, from get_fields().
 
+    Yields:
+      GoogleOperations matching the filter criteria.
+    """
+
+    def page_size(count):
+      # If a maximum number of operations is requested, limit the requested
+      # pageSize to the documented default (256) or less if we can.
+      # Operations will be filtered client-side, so don't limit it then.
+      if not max_ops:
+        return None
+      return 256 if predicate else min(max_ops - count, 256)
+
+    def fetch_page(page_token, size):
       api = service.operations().list(
           name='operations',
           filter=ops_filter,
           pageToken=page_token,
-          pageSize=page_size)
-      response = _Api.execute(api)
+          pageSize=size,
+          fields=fields)
+      return _Api.execute(api, http=http)
+
+    pool = cls._get_prefetch_pool()
+    count = 0
+    pending = pool.apply_async(fetch_page, (None, page_size(count)))
+    try:
+      while pending:
+        response = cls._wait_for_page(pending)
+        pending = None
+
+        ops = response.get('operations', [])
+        page_token = response.get('nextPageToken')
+
+        # Prefetch the next page, unless this page may be enough for max_ops.
+        if page_token and (not max_ops or predicate or
+                           count + len(ops) < max_ops):
+          pending = pool.apply_async(fetch_page,
+                                     (page_token, page_size(count + len(ops))))
 
-      ops = response['operations'] if 'operations' in response else None
-      if ops:
         for op in ops:
-          if cls.is_dsub_operation(op):
-            operations.append(op)
-
-      # Exit if there are no more operations
-      if 'nextPageToken' not in response or not response['nextPageToken']:
-        break
+          if not cls.is_dsub_operation(op):
+            continue
+          operation = GoogleOperation(op)
+          if predicate and not predicate(operation):
+            continue
+
+          yield operation
+          count += 1
+          if max_ops and count >= max_ops:
+            return
+
+        if page_token and not pending:
+          pending = pool.apply_async(fetch_page, (page_token, page_size(count)))
+    finally:
+      # Wait out a prefetch the consumer no longer needs, so that its request
+      # does not share the Http object with the caller's next request.
+      while pending and not pending.ready():
+        pending.wait(_PREFETCH_WAIT_SECONDS)
 
-      page_token = response['nextPageToken']
-
-    if max_ops and len(operations) > max_ops:
-      del operations[max_ops:]
+  @classmethod
+  def _get_prefetch_pool(cls):
+    with cls._prefetch_pool_lock:
+      if not cls._prefetch_pool:
+        cls._prefetch_pool = ThreadPool(_MAX_LOOKUP_THREADS)
+      return cls._prefetch_pool
 
-    return [GoogleOperation(o) for o in operations]
+  @staticmethod
+  def _wait_for_page(pending):
+    """Returns the result of a page request, waiting interruptibly."""
+    while True:
+      try:
+        return pending.get(_PREFETCH_WAIT_SECONDS)
+      except multiprocessing.TimeoutError:
+        pass
 
   @classmethod
   def _cancel_batch(cls, service, ops):
@@ -857,19 +1261,301 @@ class _Operations(object):
 
     return canceled_ops, error_messages
 
+  @classmethod
+  def get(cls, service, ops, http=None):
+    """Gets the current state of operations, in batches.
+
+    Args:
+      service: Google Genomics API service object.
+      ops: A list of GoogleOperations to get.
+      http: an optional httplib2.Http object with which to send requests.
+
+    Returns:
+      A list of GoogleOperations, in the same order. If an operation could not
+      be fetched, the given one is returned in its place.
+    """
+    max_batch = 256
+    current = list(ops)
+
+    def handle_get(request_id, response, exception):
+      """Callback for the get response."""
+      if exception:
+        _print_error('Error getting %s: %s' % (
+            current[int(request_id)].get_operation_full_job_id(), exception))
+      else:
+        current[int(request_id)] = GoogleOperation(response)
+
+    for first_op in range(0, len(ops), max_batch):
+      batch = service.new_batch_http_request(callback=handle_get)
+      for index in range(first_op, min(first_op + max_batch, len(ops))):
+        batch.add(
+            service.operations().get(name=ops[index].get_field('internal-id')),
+            request_id=str(index))
+      _Api.execute(batch, http=http)
+
+    return current
+
+
+def _job_id_create_time(job_id):
+  """Returns a lower bound for the createTime of a dsub job, or None.
+
+  Args:
+    job_id: a job-id of the form <job-name>--<user-id>--<yymmdd-HHMMSS-ff>.
+
+  Returns:
+    Seconds since the epoch, earlier than any task of the job could have been
+    created, or None if the job-id does not end in a dsub timestamp.
+  """
+  match = _JOB_ID_TIMESTAMP_RE.search(job_id)
+  if not match:
+    return None
+  try:
+    submitted = datetime.strptime(match.group(1), '%y%m%d-%H%M%S')
+  except ValueError:
+    return None
+  return int(time.mktime(
+      submitted.timetuple())) - _JOB_ID_CREATE_TIME_MARGIN_SECONDS
+
+
+def _operation_create_seconds(op):
+  """Returns the createTime of a GoogleOperation in seconds, or None."""
+  create_time = op.raw_task_data()['metadata'].get('createTime')
+  return timestamp_util.parse_rfc3339_utc_seconds(
+      create_time) if create_time else None
+
+
+class _LookupPlan(object):
+  """Plan for the operations.list queries of a lookup_job_tasks call.
+
+  The operations.list filter has no OR, so a lookup over lists of values
+  needs one query per combination of values. When there are many
+  combinations, it is cheaper to drop the longest lists from the server-side
+  filter and match the values client-side: one broad query over-fetches less
+  than many narrow queries cost in round trips. A list is only dropped if the
+  remaining filter still narrows the query to a job, job name, user, or
+  creation time, so that a lookup never scans all operations of a project.
+
+  When job-ids are dropped, the earliest time embedded in them bounds the
+  createTime of the query. With server_status False, statuses are always
+  matched client-side (the status of a cached operation may have changed).
+
+  Attributes:
+    dimensions: an OrderedDict of server-side filter lists, by field name.
+    client_filters: a dict of field name to the set of values which
+      operations must match client-side.
+    create_time: the createTime lower bound for the queries.
+  """
+
+  # Fields which narrow a query, in the order in which they are dropped to
+  # reduce fan-out if all else is equal. Status and task-id alone don't.
+  _NARROWING_FIELDS = ['user-id', 'job-name', 'job-id']
+
+  def __init__(self, status_list, user_list, job_list, job_name_list,
+               task_list, create_time, max_fanout=_MAX_LOOKUP_FANOUT,
+               server_status=True):
+    self.dimensions = collections.OrderedDict([
+        ('status', self._unique(status_list)),
+        ('job-id', self._unique(job_list)),
+        ('job-name', self._unique(job_name_list)),
+        ('user-id', self._unique(user_list)),
+        ('task-id', self._unique(task_list)),
+    ])
+    self.client_filters = {}
+    self.create_time = create_time
+
+    if not server_status and self.dimensions['status'] != ['*']:
+      self.client_filters['status'] = set(self.dimensions['status'])
+      self.dimensions['status'] = ['*']
+
+    while self.fanout() > max_fanout:
+      if not self._collapse_one():
+        break
+
+  @staticmethod
+  def _unique(values):
+    """Returns the values, without duplicates, in their original order."""
+    if '*' in values:
+      return ['*']
+    seen = set()
+    return [v for v in values if not (v in seen or seen.add(v))]
+
+  def fanout(self):
+    """Returns the number of server-side queries for the plan."""
+    count = 1
+    for values in self.dimensions.values():
+      count *= len(values)
+    return count
+
+  def _create_time_without(self, field):
+    """Returns the createTime bound if the field were dropped."""
+    if field != 'job-id':
+      return self.create_time
+
+    bounds = [_job_id_create_time(job_id) for job_id in self.dimensions[field]]
+    if None in bounds:
+      return self.create_time
+    return max(self.create_time or 0, min(bounds)) or None
+
+  def _is_narrow_without(self, field, create_time):
+    if create_time:
+      return True
+    return any(self.dimensions[name] != ['*']
+               for name in self._NARROWING_FIELDS
+               if name != field)
+
+  def _collapse_one(self):
+    """Drops the longest list which can be dropped from the server filter.
+
+    Returns:
+      True if a list was dropped.
+    """
+    candidates = [
+        field for field in self.dimensions if len(self.dimensions[field]) > 1
+    ]
+    candidates.sort(key=lambda field: len(self.dimensions[field]),
+                    reverse=True)
+    for field in candidates:
+      create_time = self._create_time_without(field)
+      if self._is_narrow_without(field, create_time):
+        self.client_filters[field] = set(self.dimensions[field])
+        self.dimensions[field] = ['*']
+        self.create_time = create_time
+        return True
+    return False
+
+  def queries(self):
+    """Yields a dict of get_filter arguments for each server-side query."""
+    for values in itertools.product(*self.dimensions.values()):
+      yield dict(zip(self.dimensions.keys(), values))
+
+  def predicate(self):
+    """Returns a function matching operations client-side, or None."""
+    if not self.client_filters:
+      return None
+
+    client_filters = self.client_filters.items()
+
+    def matches(op):
+      for field, values in client_filters:
+        value = op.get_field('task-status' if field == 'status' else field)
+        if value not in values:
+          return False
+      return True
+
+    return matches
+
+
+class _PipelineTemplates(object):
+  """Memoized parts of the pipeline requests for the tasks of a job.
+
+  All tasks of a job share resources, image, script, and job labels. The
+  docker command, the bulk of the ephemeralPipeline, varies by task only
+  with recursive parameters, inputs with wildcards, and output directories.
+
+  An ephemeralPipeline template is built for the first task with a given
+  docker command; other such tasks get a copy of it in which only the
+  (cheap) inputParameters and outputParameters are built for the task.
+  The resources and docker sections are shared and must not be modified.
+  """
+
+  # Bound memory use for jobs whose tasks all differ.
+  _MAX_ENTRIES = 1024
+
+  def __init__(self, project, job_resources, script_name, pipeline_name,
+               job_labels):
+    self._project = project
+    self._job_resources = job_resources
+    self._script_name = script_name
+    self._pipeline_name = pipeline_name
+    self._templates = {}
+    self.job_labels = job_labels
+
+  @staticmethod
+  def _docker_command_key(inputs, outputs):
+    return (tuple(var for var in inputs if var.recursive),
+            tuple((var.name, var.docker_path)
+                  for var in inputs
+                  if not var.recursive and
+                  '*' in os.path.basename(var.docker_path)),
+            tuple(var.docker_path if var.recursive else
+                  os.path.dirname(var.docker_path) for var in outputs),
+            tuple(var for var in outputs if var.recursive))
+
+  def get(self, envs, inputs, outputs):
+    """Returns the ephemeralPipeline for a task of the job.
+
+    Args:
+      envs: list of EnvParam objects for the task.
+      inputs: list of FileParam objects for the task.
+      outputs: list of FileParam objects for the task.
+
+    Returns:
+      A dictionary with one entry under the key ephemeralPipeline, as
+      returned by _Pipelines.build_pipeline.
+    """
+    key = self._docker_command_key(inputs, outputs)
+    template = self._templates.get(key)
+    if template is None:
+      if len(self._templates) >= self._MAX_ENTRIES:
+        self._templates.clear()
+
+      job_resources = self._job_resources
+      pipeline = _Pipelines.build_pipeline(
+          project=self._project,
+          min_cores=job_resources.min_cores,
+          min_ram=job_resources.min_ram,
+          disk_size=job_resources.disk_size,
+          boot_disk_size=job_resources.boot_disk_size,
+          preemptible=job_resources.preemptible,
+          image=job_resources.image,
+          zones=job_resources.zones,
+          script_name=self._script_name,
+          envs=envs,
+          inputs=inputs,
+          outputs=outputs,
+          pipeline_name=self._pipeline_name)
+      self._templates[key] = pipeline['ephemeralPipeline']
+      return pipeline
+
+    input_parameters, output_parameters = _Pipelines.build_pipeline_parameters(
+        envs, inputs, outputs)
+    ephemeral_pipeline = dict(template)
+    ephemeral_pipeline['inputParameters'] = input_parameters
+    ephemeral_pipeline['outputParameters'] = output_parameters
+    return {'ephemeralPipeline': ephemeral_pipeline}
+
 
 class GoogleJobProvider(base.JobProvider):
   """Interface to dsub and related tools for managing Google cloud jobs."""
 
-  def __init__(self, verbose, dry_run, project, zones=None, credentials=None):
+  def __init__(self,
+               verbose,
+               dry_run,
+               project,
+               zones=None,
+               credentials=None,
+               submit_parallelism=1,
+               submit_batch_size=1,
+               operation_cache=None):
     self._verbose = verbose
     self._dry_run = dry_run
 
     self._project = project
     self._zones = zones
+    self._submit_parallelism = max(1, submit_parallelism)
+    self._submit_batch_size = min(
+        max(1, submit_batch_size), MAX_SUBMIT_BATCH_SIZE)
+    # An operation_cache.OperationCache for lookups, or None.
+    self._operation_cache = operation_cache
 
+    if not credentials:
+      credentials = GoogleCredentials.get_application_default()
+    self._credentials = credentials
     self._service = self._setup_service(credentials)
 
+    # Authorized Http objects for worker threads (see _thread_http).
+    self._thread_local = threading.local()
+
   # Exponential backoff retrying API discovery.
   # Maximum 23 retries.  Wait 1, 2, 4 ... 64, 64, 64... seconds.
   @classmethod
@@ -940,40 +1626,53 @@ class GoogleJobProvider(base.JobProvider):
         'dsub-version': version,
     }
 
-  def _build_pipeline_labels(self, task_metadata):
-    labels = [
-        _Label(name, task_metadata[name])
-        for name in ['job-name', 'job-id', 'user-id', 'dsub-version']
-    ]
+  def _build_pipeline_labels(self, task_metadata, job_labels=None):
+    if job_labels is None:
+      job_labels = [
+          _Label(name, task_metadata[name])
+          for name in ['job-name', 'job-id', 'user-id', 'dsub-version']
+      ]
+    labels = list(job_labels)
 
     if task_metadata.get('task-id') is not None:
       labels.append(_Label('task-id', 'task-%d' % task_metadata.get('task-id')))
 
     return labels
 
-  def _build_pipeline_request(self, job_resources, task_metadata, task_data):
+  def _build_pipeline_request(self,
+                              job_resources,
+                              task_metadata,
+                              task_data,
+                              templates=None):
     """Returns a Pipeline objects for the job."""
 
     script = task_metadata['script']
-    task_data['labels'].extend(self._build_pipeline_labels(task_metadata))
+    task_data['labels'].extend(
+        self._build_pipeline_labels(task_metadata, templates and
+                                    templates.job_labels))
 
     # Build the ephemeralPipeline for this job.
     # The ephemeralPipeline definition changes for each job because file
     # parameters localCopy.path changes based on the remote_uri.
-    pipeline = _Pipelines.build_pipeline(
-        project=self._project,
-        min_cores=job_resources.min_cores,
-        min_ram=job_resources.min_ram,
-        disk_size=job_resources.disk_size,
-        boot_disk_size=job_resources.boot_disk_size,
-        preemptible=job_resources.preemptible,
-        image=job_resources.image,
-        zones=job_resources.zones,
-        script_name=script.name,
-        envs=task_data['envs'],
-        inputs=task_data['inputs'],
-        outputs=task_data['outputs'],
-        pipeline_name=task_metadata['pipeline-name'])
+    # Most of it is shared by the tasks of a job, so use the templates.
+    if templates:
+      pipeline = templates.get(task_data['envs'], task_data['inputs'],
+                               task_data['outputs'])
+    else:
+      pipeline = _Pipelines.build_pipeline(
+          project=self._project,
+          min_cores=job_resources.min_cores,
+          min_ram=job_resources.min_ram,
+          disk_size=job_resources.disk_size,
+          boot_disk_size=job_resources.boot_disk_size,
+          preemptible=job_resources.preemptible,
+          image=job_resources.image,
+          zones=job_resources.zones,
+          script_name=script.name,
+          envs=task_data['envs'],
+          inputs=task_data['inputs'],
+          outputs=task_data['outputs'],
+          pipeline_name=task_metadata['pipeline-name'])
 
     # Build the pipelineArgs for this job.
     logging_uri = providers_util.format_logging_uri(job_resources.logging.uri,
@@ -986,20 +1685,138 @@ class GoogleJobProvider(base.JobProvider):
 
     return pipeline
 
-  def _submit_pipeline(self, request):
-    operation = _Pipelines.run_pipeline(self._service, request)
+  def _build_pipeline_requests(self, job_resources, job_metadata,
+                               all_task_data):
+    """Yields a pipeline request for each task of the job."""
+    templates = _PipelineTemplates(
+        self._project, job_resources, job_metadata['script'].name,
+        job_metadata['pipeline-name'],
+        self._build_pipeline_labels(job_metadata))
+    for task_data in all_task_data:
+      task_metadata = providers_util.get_task_metadata(job_metadata,
+                                                       task_data.get('task-id'))
+      yield self._build_pipeline_request(job_resources, task_metadata,
+                                         task_data, templates)
+
+  def _thread_http(self):
+    """Returns an authorized Http object for use by the calling thread.
+
+    The service object's Http is not thread-safe, so each worker thread
+    issues its requests through its own connection.
+
+    Returns:
+      An httplib2.Http object authorized with the provider credentials.
+    """
+    http = getattr(self._thread_local, 'http', None)
+    if not http:
+      http = self._credentials.authorize(httplib2.Http())
+      self._thread_local.http = http
+    return http
+
+  def _submit_pipeline(self, request, http=None):
+    operation = _Pipelines.run_pipeline(self._service, request, http=http)
     if self._verbose:
       print 'Launched operation %s' % operation['name']
 
     return GoogleOperation(operation).get_field('task-id')
 
-  def submit_job(self, job_resources, job_metadata, all_task_data):
+  def _submit_pipeline_batch(self, requests, http=None):
+    try:
+      operations = _Pipelines.run_pipelines(self._service, requests, http=http)
+    except PipelineBatchError as e:
+      # The pipelines launched before the failure are running.
+      for operation in e.operations:
+        if operation:
+          print 'Launched operation %s' % operation['name']
+      raise
+
+    tasks = []
+    for operation in operations:
+      if self._verbose:
+        print 'Launched operation %s' % operation['name']
+      tasks.append(GoogleOperation(operation).get_field('task-id'))
+    return tasks
+
+  def _submit_pipeline_group(self, requests, http=None):
+    """Submits a list of requests, as a single batch if batching is enabled."""
+    if self._submit_batch_size > 1:
+      return self._submit_pipeline_batch(requests, http=http)
+    return [self._submit_pipeline(request, http=http) for request in requests]
+
+  def _submit_pipelines(self, requests, journal=None):
+    """Submits pipeline requests, yielding the task-id of each in order.
+
+    Requests are sent in groups of the submit batch size, each group as a
+    single batch HTTP request. If submit parallelism is greater than 1, groups
+    are sent concurrently from a pool of worker threads. Task-ids are still
+    yielded in the order the requests were produced.
+
+    Args:
+      requests: an iterable of pipeline requests.
+      journal: optional journal_util.SubmitJournal in which to record each
+        group of tasks as soon as it is launched.
+
+    Yields:
+      The task-id (or None) of each launched operation.
+    """
+
+    def submit_group(group, http=None):
+      try:
+        tasks = self._submit_pipeline_group(group, http=http)
+      except PipelineBatchError as e:
+        # Record the tasks the batch launched before it failed, so that they
+        # are not launched again on --resume.
+        if journal:
+          journal.record([
+              GoogleOperation(operation).get_field('task-id')
+              for operation in e.operations
+              if operation
+          ])
+        raise
+      if journal:
+        journal.record(tasks)
+      return tasks
+
+    def submit_group_from_worker(group):
+      return submit_group(group, http=self._thread_http())
+
+    requests = iter(requests)
+    groups = iter(
+        lambda: list(itertools.islice(requests, self._submit_batch_size)), [])
+
+    if self._submit_parallelism == 1:
+      for group in groups:
+        for task in submit_group(group):
+          yield task
+      return
+
+    # Only build as many requests at a time as the workers can consume soon.
+    window_size = self._submit_parallelism * _SUBMIT_WINDOW_PER_WORKER
+    pool = ThreadPool(self._submit_parallelism)
+    try:
+      while True:
+        window = list(itertools.islice(groups, window_size))
+        if not window:
+          break
+        for tasks in pool.imap(submit_group_from_worker, window):
+          for task in tasks:
+            yield task
+    finally:
+      pool.close()
+      pool.join()
+
+  def submit_job(self,
+                 job_resources,
+                 job_metadata,
+                 all_task_data,
+                 journal=None):
     """Submit the job (or tasks) to be executed.
 
     Args:
       job_resources: resource parameters required by each job.
       job_metadata: job parameters such as job-id, user-id, script
       all_task_data: list of task arguments
+      journal: optional journal_util.SubmitJournal to record launched tasks
 
     Returns:
       A dictionary containing the 'user-id', 'job-id', and 'task-id' list.
@@ -1008,8 +1825,9 @@ class GoogleJobProvider(base.JobProvider):
     Raises:
       ValueError: if job resources or task data contain illegal values.
     """
-    # Validate task data and resources.
-    param_util.validate_submit_args_or_fail(
+    # Validate resources now and each task as it is consumed. all_task_data
+    # may be a generator, in which case it can be consumed only once.
+    all_task_data = param_util.validated_task_data(
         job_resources,
         all_task_data,
         provider_name=_PROVIDER_NAME,
@@ -1018,25 +1836,17 @@ class GoogleJobProvider(base.JobProvider):
         logging_providers=_SUPPORTED_LOGGING_PROVIDERS)
 
     # Prepare and submit jobs.
-    launched_tasks = []
-    requests = []
-    for task_data in all_task_data:
-      task_metadata = providers_util.get_task_metadata(job_metadata,
-                                                       task_data.get('task-id'))
-
-      request = self._build_pipeline_request(job_resources, task_metadata,
-                                             task_data)
+    requests = self._build_pipeline_requests(job_resources, job_metadata,
+                                             all_task_data)
 
-      if self._dry_run:
-        requests.append(request)
-      else:
-        task = self._submit_pipeline(request)
-        if task:
-          launched_tasks.append(task)
-
-    # If this is a dry-run, emit all the pipeline request objects
+    launched_tasks = []
     if self._dry_run:
-      print json.dumps(requests, indent=2, sort_keys=True)
+      # If this is a dry-run, emit all the pipeline request objects
+      print json.dumps(list(requests), indent=2, sort_keys=True)
+    else:
+      launched_tasks = [
+          task for task in self._submit_pipelines(requests, journal) if task
+      ]
 
     return {
         'job-id': job_metadata['job-id'],
@@ -1052,7 +1862,8 @@ class GoogleJobProvider(base.JobProvider):
                        task_list=None,
                        labels=None,
                        create_time=None,
-                       max_tasks=0):
+                       max_tasks=0,
+                       fields=None):
     """Return a list of operations based on the input criteria.
 
     If any of the filters are empty or ["*"], then no filtering is performed on
@@ -1070,6 +1881,9 @@ class GoogleJobProvider(base.JobProvider):
         match the task being fetched.
       create_time: a UTC value for earliest create time for a task.
       max_tasks: the maximum number of job tasks to return or 0 for no limit.
+      fields: a list of the task fields that will be read from the tasks. Only
+        the parts of the operations needed for them are fetched. If None,
+        complete operations are fetched.
 
     Raises:
       ValueError: if both a job id list and a job name list are provided
@@ -1077,12 +1891,30 @@ class GoogleJobProvider(base.JobProvider):
     Returns:
       A list of Genomics API Operations objects.
     """
+    return list(
+        self.iter_job_tasks(status_list, user_list, job_list, job_name_list,
+                            task_list, labels, create_time, max_tasks, fields))
+
+  def iter_job_tasks(self,
+                     status_list,
+                     user_list=None,
+                     job_list=None,
+                     job_name_list=None,
+                     task_list=None,
+                     labels=None,
+                     create_time=None,
+                     max_tasks=0,
+                     fields=None):
+    """Generator version of lookup_job_tasks.
+
+    With a single operations.list query, tasks are yielded as their pages
+    arrive, before the listing is complete.
+    """
 
     # Server-side, we can filter on status, job_id, user_id, task_id, but there
     # is no OR filter (only AND), and so we can't handle lists server side.
-    # In practice we don't expect combinations of user lists and job lists.
-    # For now, do the most brain-dead thing and if we find a common use-case
-    # that performs poorly, we can re-evaluate.
+    # The _LookupPlan decides which lists to query value-by-value and which
+    # to match client-side in fewer, broader queries.
 
     status_list = status_list if status_list else ['*']
     user_list = user_list if user_list else ['*']
@@ -1102,29 +1934,187 @@ class GoogleJobProvider(base.JobProvider):
     # AND filter rule arguments.
     labels = labels if labels else []
 
-    tasks = []
-    for status, job_id, job_name, user_id, task_id in itertools.product(
-        status_list, job_list, job_name_list, user_list, task_list):
-      ops_filter = _Operations.get_filter(
-          self._project,
-          status=status,
-          user_id=user_id,
-          job_id=job_id,
-          job_name=job_name,
-          labels=labels,
-          task_id=task_id,
-          create_time=create_time)
-
-      ops = _Operations.list(self._service, ops_filter, max_tasks)
-
-      if ops:
-        tasks.extend(ops)
-
-      if max_tasks and len(tasks) > max_tasks:
-        del tasks[max_tasks:]
-        return tasks
+    plan = _LookupPlan(
+        status_list,
+        user_list,
+        job_list,
+        job_name_list,
+        task_list,
+        create_time,
+        server_status=not self._operation_cache)
+    predicate = plan.predicate()
+
+    # The operation cache applies the createTime bound itself, so that its
+    # queries do not change with the bound of "dstat --age".
+    ops_filters = [
+        _Operations.get_filter(
+            self._project,
+            status=query['status'],
+            user_id=query['user-id'],
+            job_id=query['job-id'],
+            job_name=query['job-name'],
+            labels=labels,
+            task_id=query['task-id'],
+            create_time=None if self._operation_cache else plan.create_time)
+        for query in plan.queries()
+    ]
 
-    return tasks
+    seen = set()
+    for ops in self._list_operations(ops_filters, max_tasks, predicate,
+                                     _Operations.get_fields(fields),
+                                     plan.create_time):
+      for op in ops:
+        if op.get_field('internal-id') not in seen:
+          seen.add(op.get_field('internal-id'))
+          yield op
+
+          if max_tasks and len(seen) >= max_tasks:
+            return
+
+  def _list_operations(self,
+                       ops_filters,
+                       max_tasks,
+                       predicate,
+                       fields=None,
+                       create_time=None):
+    """Yields the list of operations for each filter, in order.
+
+    If there are multiple filters, the queries are run concurrently (each
+    worker thread with its own connection). Results are still yielded in the
+    order of the filters. Queries not yet started when the consumer stops
+    iterating are not run.
+
+    Args:
+      ops_filters: list of string filters of operations.
+      max_tasks: maximum number of operations per filter (0 for no limit).
+      predicate: function to filter operations client-side, or None.
+      fields: partial response field mask, or None.
+      create_time: the createTime lower bound applied by the operation cache
+        (the filters of other listings include it), or None.
+
+    Yields:
+      An iterable of GoogleOperations for each filter. With a single filter
+      (and no operation cache), it is a generator over the pages of
+      operations as they are fetched.
+    """
+    if len(ops_filters) == 1 and not self._operation_cache:
+      # The pages are fetched in background threads, with an Http object of
+      # the listing's own.
+      yield _Operations.iter_list(
+          self._service,
+          ops_filters[0],
+          max_tasks,
+          predicate,
+          self._credentials.authorize(httplib2.Http()),
+          fields=fields)
+      return
+
+    def list_from_worker(ops_filter):
+      if self._operation_cache:
+        return self._list_cached_operations(ops_filter, max_tasks, predicate,
+                                            self._thread_http(), fields,
+                                            create_time)
+      return _Operations.list(self._service, ops_filter, max_tasks, predicate,
+                              self._thread_http(), fields)
+
+    pool = ThreadPool(min(len(ops_filters), _MAX_LOOKUP_THREADS))
+    try:
+      for ops in pool.imap(list_from_worker, ops_filters):
+        yield ops
+    finally:
+      pool.terminate()
+      pool.join()
+
+  def _list_cached_operations(self,
+                              ops_filter,
+                              max_tasks,
+                              predicate,
+                              http=None,
+                              fields=None,
+                              create_time=None):
+    """Lists operations, fetching only new or running ones from the server.
+
+    The operations of earlier listings with the same filter and field mask
+    are read from the operation cache. Only operations created since the
+    newest of them are listed from the server, and cached operations that
+    were not done are fetched again by name. All operations matching the
+    filter are cached; the predicate and max_tasks apply to those returned.
+
+    The createTime bound is applied to the cached operations, client-side. If
+    the cache was listed with a later bound (its low-water mark) than this
+    one, the operations since this bound are listed from the server again.
+
+    Args:
+      ops_filter: string filter of operations.
+      max_tasks: maximum number of operations to return (0 for no limit).
+      predicate: function to filter operations client-side, or None.
+      http: an optional httplib2.Http object with which to send requests.
+      fields: partial response field mask, or None.
+      create_time: the createTime lower bound (seconds since the epoch) of
+        the operations to return, or None.
+
+    Returns:
+      A list of GoogleOperations, newest first.
+    """
+    query = '%s|%s' % (ops_filter, fields or '')
+    high_water, low_water, cached = self._operation_cache.load(query)
+
+    covered = high_water is not None and (
+        low_water is None or (create_time is not None and
+                              create_time >= low_water))
+    server_filter = ops_filter
+    if covered:
+      server_filter += ' AND createTime >= %d' % (
+          high_water - _CACHE_CREATE_TIME_MARGIN_SECONDS)
+    else:
+      low_water = create_time
+      if create_time is not None:
+        server_filter += ' AND createTime >= %d' % create_time
+    listed = _Operations.list(self._service, server_filter, http=http,
+                              fields=fields)
+
+    listed_names = set(op.get_field('internal-id') for op in listed)
+    cached = [
+        GoogleOperation(op) for op in cached if op['name'] not in listed_names
+    ]
+    if create_time is not None:
+      # Operations before the bound are neither refreshed nor returned (those
+      # listed since the high-water mark may also be before it).
+      cached = [op for op in cached if self._created_since(op, create_time)]
+    done = [op for op in cached if op.raw_task_data()['done']]
+    refreshed = _Operations.get(
+        self._service, [op for op in cached if not op.raw_task_data()['done']],
+        http=http)
+
+    create_times = [
+        _operation_create_seconds(op) for op in listed
+    ] + [high_water]
+    create_times = [t for t in create_times if t is not None]
+    high_water = max(create_times) if create_times else None
+
+    changed = listed + refreshed
+    self._operation_cache.store(query, [
+        (op.get_field('internal-id'), _operation_create_seconds(op),
+         op.raw_task_data()['done'], op.raw_task_data()) for op in changed
+    ], high_water, low_water)
+
+    ops = sorted(
+        changed + done,
+        key=lambda op: _operation_create_seconds(op) or 0,
+        reverse=True)
+    if create_time is not None:
+      ops = [op for op in ops if self._created_since(op, create_time)]
+    if predicate:
+      ops = [op for op in ops if predicate(op)]
+    return ops[:max_tasks] if max_tasks else ops
+
+  @staticmethod
+  def _created_since(op, create_time):
+    return (_operation_create_seconds(op) or 0) >= create_time
+
+  def refresh_tasks(self, tasks):
+    # Get each operation by name, rather than listing operations again.
+    return _Operations.get(self._service, tasks)
 
   def delete_jobs(self,
                   user_list,
@@ -1169,10 +2159,39 @@ class GoogleJobProvider(base.JobProvider):
 
 
 class GoogleOperation(base.Task):
-  """Task wrapper around a Pipelines API operation object."""
+  """Task wrapper around a Pipelines API operation object.
+
+  Field values are computed on first use and memoized: dstat formats several
+  fields of each operation, some of which share the same parsing work.
+  """
+
+  __slots__ = ['_op', '_fields', '_datestamps']
+
+  # Field name to the method computing its (unmemoized) value.
+  _FIELD_GETTERS = {
+      'internal-id': '_get_internal_id',
+      'job-name': '_get_job_name',
+      'job-id': '_get_job_id',
+      'task-id': '_get_task_id',
+      'user-id': '_get_user_id',
+      'task-status': 'operation_status',
+      'status': 'operation_status',
+      'logging': '_get_logging',
+      'envs': '_get_envs',
+      'labels': '_get_labels',
+      'inputs': '_get_inputs',
+      'outputs': '_get_outputs',
+      'create-time': '_get_create_time',
+      'end-time': '_get_end_time',
+      'status-message': '_get_status_message',
+      'status-detail': '_get_status_message',
+      'last-update': '_get_last_update',
+  }
 
   def __init__(self, operation_data):
     self._op = operation_data
+    self._fields = {}
+    self._datestamps = {}
     # Sanity check for operation_status().
     unused_status = self.operation_status()
 
@@ -1192,53 +2211,75 @@ class GoogleOperation(base.Task):
     Raises:
       ValueError: if the field label is not supported by the operation
     """
-
-    metadata = self._op.get('metadata')
-
-    if field == 'internal-id':
-      value = self._op['name']
-    elif field == 'job-name':
-      value = metadata['labels'].get('job-name')
-    elif field == 'job-id':
-      value = metadata['labels'].get('job-id')
-    elif field == 'task-id':
-      value = metadata['labels'].get('task-id')
-    elif field == 'user-id':
-      value = metadata['labels'].get('user-id')
-    elif field == 'task-status':
-      value = self.operation_status()
-    elif field == 'logging':
-      value = metadata['request']['pipelineArgs']['logging']['gcsPath']
-    elif field == 'envs':
-      value = self._get_operation_input_field_values(metadata, False)
-    elif field == 'labels':
-      # Reserved labels are filtered from dsub task output.
-      value = {k: v for k, v in metadata['labels'].items()
-               if k not in param_util.RESERVED_LABELS}
-    elif field == 'inputs':
-      value = self._get_operation_input_field_values(metadata, True)
-    elif field == 'outputs':
-      value = metadata['request']['pipelineArgs']['outputs']
-    elif field == 'create-time':
-      value = self._localize_datestamp(metadata['createTime'])
-    elif field == 'end-time':
-      if 'endTime' in metadata:
-        value = self._localize_datestamp(metadata['endTime'])
-      else:
-        value = None
-    elif field == 'status':
-      value = self.operation_status()
-    elif field in ['status-message', 'status-detail']:
-      status, last_update = self.operation_status_message()
-      value = status
-    elif field == 'last-update':
-      status, last_update = self.operation_status_message()
-      value = last_update
-    else:
-      raise ValueError('Unsupported display field: "%s"' % field)
+    try:
+      value = self._fields[field]
+    except KeyError:
+      getter = self._FIELD_GETTERS.get(field)
+      if not getter:
+        raise ValueError('Unsupported display field: "%s"' % field)
+      value = getattr(self, getter)()
+      self._fields[field] = value
 
     return value if value else default
 
+  def _get_internal_id(self):
+    return self._op['name']
+
+  def _get_job_name(self):
+    return self._op['metadata']['labels'].get('job-name')
+
+  def _get_job_id(self):
+    return self._op['metadata']['labels'].get('job-id')
+
+  def _get_task_id(self):
+    return self._op['metadata']['labels'].get('task-id')
+
+  def _get_user_id(self):
+    return self._op['metadata']['labels'].get('user-id')
+
+  def _get_logging(self):
+    return self._op['metadata']['request']['pipelineArgs']['logging']['gcsPath']
+
+  def _get_envs(self):
+    return self._get_operation_input_field_values(self._op['metadata'], False)
+
+  def _get_labels(self):
+    # Reserved labels are filtered from dsub task output.
+    return {k: v for k, v in self._op['metadata']['labels'].items()
+            if k not in param_util.RESERVED_LABELS}
+
+  def _get_inputs(self):
+    return self._get_operation_input_field_values(self._op['metadata'], True)
+
+  def _get_outputs(self):
+    return self._op['metadata']['request']['pipelineArgs']['outputs']
+
+  def _get_create_time(self):
+    return self._localized(self._op['metadata']['createTime'])
+
+  def _get_end_time(self):
+    metadata = self._op['metadata']
+    if 'endTime' in metadata:
+      return self._localized(metadata['endTime'])
+    return None
+
+  def _get_status_message(self):
+    status, unused_last_update = self.operation_status_message()
+    return status
+
+  def _get_last_update(self):
+    unused_status, last_update = self.operation_status_message()
+    return last_update
+
+  def _localized(self, datestamp):
+    """_localize_datestamp, memoized as operations repeat their datestamps."""
+    try:
+      return self._datestamps[datestamp]
+    except KeyError:
+      value = self._localize_datestamp(datestamp)
+      self._datestamps[datestamp] = value
+      return value
+
   def operation_status(self):
     """Returns the status of this operation.
 
@@ -1283,7 +2324,7 @@ class GoogleOperation(base.Task):
       else:
         msg = 'Success'
 
-    return (msg, self._localize_datestamp(ds))
+    return (msg, self._localized(ds))
 
   def get_operation_full_job_id(self):
     """Returns the job-id or job-id.task-id for the operation."""
@@ -1305,23 +2346,7 @@ class GoogleOperation(base.Task):
       A datestamp in local time and up to seconds, or the original string if it
       cannot be properly parsed.
     """
-
-    # The timestamp from the Google Operations are all in RFC3339 format, but
-    # they are sometimes formatted to nanoseconds and sometimes only seconds.
-    # Parse both:
-    # * 2016-11-14T23:04:55Z
-    # * 2016-11-14T23:05:56.010429380Z
-    # And any sub-second precision in-between.
-
-    m = re.match(r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2}).*Z',
-                 datestamp)
-    if not m:
-      return datestamp
-
-    # Create a UTC datestamp from parsed components
-    g = [int(val) for val in m.groups()]
-    dt = datetime(g[0], g[1], g[2], g[3], g[4], g[5], tzinfo=pytz.utc)
-    return dt.astimezone(tzlocal()).strftime('%Y-%m-%d %H:%M:%S')
+    return timestamp_util.localize_rfc3339(datestamp)
 
   @classmethod
   def _get_operation_input_field_values(cls, metadata, file_input):
@@ -21,8 +21,9 @@ environment. The local provider should simulate the runtime environment such
 that going from local development to scaled-up execution only involves changing
 `dsub` command-line parameters.
 
-The local provider is not intended for submitting large numbers of concurrent
-tasks to a local queue for execution.
+Tasks are queued until the host has the capacity to run them (see
+"Scheduling" below), so large numbers of tasks can be submitted, but the local
+provider is not intended to replace a compute cluster.
 
 ## Execution environment
 
@@ -46,14 +47,31 @@ Thus using the local runner requires:
 * Sufficient disk space required by submitted tasks.
 * Sufficient memory required by submitted tasks.
 
-Note that the local runner supports the `--tasks` parameter. All tasks
-submitted will run concurrently.
+Note that the local runner supports the `--tasks` parameter.
+
+## Scheduling
+
+Each task reserves --min-cores cores and --min-ram GB of RAM on the host. A
+task only starts when its reservation fits in the host capacity left by the
+running tasks (a task is always started if no other task is running), and
+when fewer than --max-concurrent-tasks tasks are running if that is set.
+Until then, the task is reported as RUNNING with a "Queued" status message.
+
+## Input cache
+
+With --input-cache-size, --input files are copied once into a cache shared
+by all tasks on the host, and tasks get copies of the cached copies (see
+_LOCALIZE_INPUT).
 """
 
 from collections import namedtuple
+from collections import OrderedDict
 from datetime import datetime
-from datetime import timedelta
+import fcntl
+import json
+import multiprocessing
 import os
+import pipes
 import signal
 import subprocess
 import tempfile
@@ -64,6 +82,7 @@ from .._dsub_version import DSUB_VERSION
 from ..lib import dsub_util
 from ..lib import param_util
 from ..lib import providers_util
+from ..lib import timestamp_util
 import yaml
 
 # The local runner allocates space on the host under
@@ -80,6 +99,17 @@ import yaml
 #    FAILURE, etc.)
 #    status_message.txt: File for the runner script to write log messages
 #    task.pid: Process ID file for Docker container
+#    meta.json: Task metadata for dstat (meta.yaml in earlier versions of dsub)
+#
+# The provider root also holds index.jsonl, an index of the tasks and their
+# status (see _TaskIndex), so that lookups only read the matching tasks. State
+# shared by the tasks on the host is kept in the .dsub directory, which is not
+# a job directory:
+#
+#    scheduler: the host capacity reserved by running tasks (see
+#    _WAIT_FOR_CAPACITY)
+#    images: the resolved task images (see _RESOLVE_IMAGE)
+#    inputs: the input file cache (see _LOCALIZE_INPUT)
 #
 # From task directory, the data directory is made available to the Docker
 # container as /mnt/data. Inside the data directory, the local provider sets up:
@@ -98,6 +128,9 @@ _PROVIDER_NAME = 'local'
 
 DATA_SUBDIR = 'data'
 
+# Directory of the provider root for the state shared by tasks.
+STATE_DIR = '.dsub'
+
 SCRIPT_DIR = 'script'
 WORKING_DIR = 'workingdir'
 
@@ -109,13 +142,541 @@ _SUPPORTED_LOGGING_PROVIDERS = _SUPPORTED_FILE_PROVIDERS
 _SUPPORTED_INPUT_PROVIDERS = _SUPPORTED_FILE_PROVIDERS
 _SUPPORTED_OUTPUT_PROVIDERS = _SUPPORTED_FILE_PROVIDERS
 
+# Statuses a task never leaves (RUNNING tasks may also turn out CANCELED).
+_TERMINAL_STATUSES = frozenset(['SUCCESS', 'FAILURE', 'CANCELED'])
+
+SCHEDULER_SUBDIR = 'scheduler'
+
+# Runner script function which records the task status, for dstat: in the
+# status.txt file of the task and in the task index (see _TaskIndex). The
+# string is raw so that bash, not Python, unescapes the quotes of the JSON
+# line; otherwise the status is written unquoted and the line is skipped.
+_SET_STATUS = textwrap.dedent(r"""\
+  set_status() {
+    local status="$1"
+    echo "${status}" > status.txt
+    (
+      flock 4 2> /dev/null || true
+      echo "{${INDEX_KEY}, \"status\": \"${status}\"}" >> "${INDEX_FILE}"
+    ) 4>> "${INDEX_FILE}.lock"
+  }
+""")
+
+# Runner script function which waits until the task fits on the host.
+#
+# Each started task holds a lock on its reservation file, "<name>.task" in
+# SCHEDULER_DIR, which records the cores and MB of RAM it reserved. The lock
+# is released when the runner script exits, however it exits; reservations
+# which are not locked are left by killed tasks and are removed. Reservations
+# are counted and made under the scheduler.lock lock.
+_WAIT_FOR_CAPACITY = textwrap.dedent("""\
+  # Succeeds if the task fits alongside tasks with the given reservations.
+  task_fits() {
+    local tasks="$1"
+    local cores="$2"
+    local ram_mb="$3"
+    if (( tasks == 0 )); then
+      return 0
+    fi
+    if (( MAX_CONCURRENT_TASKS > 0 && tasks >= MAX_CONCURRENT_TASKS )); then
+      return 1
+    fi
+    if (( HOST_CORES > 0 && cores + TASK_CORES > HOST_CORES )); then
+      return 1
+    fi
+    if (( HOST_RAM_MB > 0 && ram_mb + TASK_RAM_MB > HOST_RAM_MB )); then
+      return 1
+    fi
+    return 0
+  }
+
+  wait_for_capacity() {
+    if ! command -v flock > /dev/null; then
+      log_info "flock not found; starting without waiting for host capacity."
+      return
+    fi
+    mkdir -p "${SCHEDULER_DIR}"
+    while true; do
+      if [[ -f die ]]; then
+        set_status "CANCELED"
+        log_info "Job is canceled while queued."
+        cleanup
+        trap EXIT
+        echo "Canceled, exiting." > status_message.txt
+        exit 1
+      fi
+
+      exec 8> "${SCHEDULER_DIR}/scheduler.lock"
+      flock 8
+      local tasks=0
+      local cores=0
+      local ram_mb=0
+      local reservation task_cores task_ram_mb
+      for reservation in "${SCHEDULER_DIR}"/*.task; do
+        if [[ ! -e "${reservation}" ]]; then
+          continue
+        fi
+        if flock --nonblock "${reservation}" true; then
+          rm -f "${reservation}"
+          continue
+        fi
+        read task_cores task_ram_mb < "${reservation}"
+        tasks=$((tasks + 1))
+        cores=$((cores + task_cores))
+        ram_mb=$((ram_mb + task_ram_mb))
+      done
+
+      if task_fits "${tasks}" "${cores}" "${ram_mb}"; then
+        exec 9> "${SCHEDULER_DIR}/${NAME}.task"
+        echo "${TASK_CORES} ${TASK_RAM_MB}" >&9
+        flock 9
+        exec 8>&-
+        return
+      fi
+      exec 8>&-
+      sleep "${SCHEDULER_POLL_SECONDS}"
+    done
+  }
+""")
+
+IMAGE_SUBDIR = 'images'
+
+# Runner script functions which resolve the image of the task. Results are
+# recorded in IMAGE_CACHE_DIR, for the other tasks on the host:
+# * <image>.tag: the job which last resolved the image name, and the image ID
+#   it resolved to. The other tasks of the job use the same image, without
+#   pulling or inspecting it again. Written under the <image>.lock lock.
+# * <image ID>.user: the "uid:gid" the image runs as. Running a container to
+#   find out costs as much as a short task. An image updated under the same
+#   name has a new ID.
+_RESOLVE_IMAGE = textwrap.dedent("""\
+  image_id() {
+    docker inspect --format '{{.Id}}' "${IMAGE}" 2> /dev/null || true
+  }
+
+  fetch_image() {
+    local image="$1"
+
+    for ((attempt=0; attempt < 3; attempt++)); do
+      log_info "Using gcloud to fetch ${image}."
+      if gcloud docker -- pull "${image}"; then
+        return
+      fi
+      log_info "Sleeping 30s before the next attempt."
+      sleep 30s
+    done
+
+    log_error "FAILED to fetch ${image}"
+    exit 1
+  }
+
+  fetch_image_if_necessary() {
+    local image="$1"
+
+    # Remove everything from the first / on
+    local prefix="${image%%/*}"
+
+    # Images named by digest never change.
+    if [[ "${image}" == *@sha256:* ]] && [[ -n "$(image_id)" ]]; then
+      return
+    fi
+
+    # Check that the prefix is gcr.io or <location>.gcr.io
+    if [[ "${prefix}" == "gcr.io" ]] ||
+       [[ "${prefix}" == *.gcr.io ]]; then
+      fetch_image "${image}"
+    fi
+  }
+
+  # Sets IMAGE_ID (empty if the image is not on the host yet). The first task
+  # of a job pulls the image if necessary; the other tasks wait for it.
+  resolve_image() {
+    local name="${IMAGE//[^a-zA-Z0-9._-]/_}"
+    local record="${IMAGE_CACHE_DIR}/${name}.tag"
+    mkdir -p "${IMAGE_CACHE_DIR}"
+    if command -v flock > /dev/null; then
+      exec 7> "${IMAGE_CACHE_DIR}/${name}.lock"
+      flock 7
+    fi
+
+    IMAGE_ID=''
+    local job_id image image_id
+    if [[ -s "${record}" ]]; then
+      read job_id image image_id < "${record}"
+      if [[ "${job_id}" == "${JOB_ID}" ]] && [[ "${image}" == "${IMAGE}" ]]; then
+        IMAGE_ID="${image_id}"
+      fi
+    fi
+
+    if [[ -z "${IMAGE_ID}" ]]; then
+      fetch_image_if_necessary "${IMAGE}"
+      IMAGE_ID="$(image_id)"
+      if [[ -n "${IMAGE_ID}" ]]; then
+        echo "${JOB_ID} ${IMAGE} ${IMAGE_ID}" > "${record}.$$"
+        mv "${record}.$$" "${record}"
+      fi
+    fi
+    exec 7>&-
+  }
+
+  # Prints the "uid:gid" the image runs as.
+  get_docker_user() {
+    local image_id="${IMAGE_ID}"
+    local cache_file="${IMAGE_CACHE_DIR}/${image_id//[^a-zA-Z0-9]/_}.user"
+    if [[ -n "${image_id}" ]] && [[ -s "${cache_file}" ]]; then
+      cat "${cache_file}"
+      return
+    fi
+
+    local usergroup
+    usergroup="$(docker run \\
+      --rm \\
+      --name "${NAME}-get-docker-userid" \\
+      "${IMAGE}" \\
+      bash -c 'echo "$(id -u):$(id -g)"' 2>> stderr.txt)"
+
+    # If the image was pulled by "docker run", its ID is known now.
+    if [[ -z "${image_id}" ]]; then
+      image_id="$(image_id)"
+      cache_file="${IMAGE_CACHE_DIR}/${image_id//[^a-zA-Z0-9]/_}.user"
+    fi
+    if [[ -n "${image_id}" ]] && [[ -n "${usergroup}" ]]; then
+      mkdir -p "${IMAGE_CACHE_DIR}"
+      echo "${usergroup}" > "${cache_file}.$$"
+      mv "${cache_file}.$$" "${cache_file}"
+    fi
+    echo "${usergroup}"
+  }
+""")
+
+# Runner script functions which run file copies in the background,
+# TRANSFER_PARALLELISM at a time: start_transfer <command> <args>... starts
+# a copy (retried once if it fails) as soon as fewer copies are running, and
+# wait_transfers waits for the copies started, failing if any failed.
+_TRANSFER = textwrap.dedent("""\
+  TRANSFER_PIDS=()
+
+  # Waits until fewer than TRANSFER_PARALLELISM of the copies started are
+  # running. wait -n (bash 4.3 and later) returns as soon as a copy finishes;
+  # older shells check every second.
+  wait_for_transfer_slot() {
+    local pid running
+    while (( ${#TRANSFER_PIDS[@]} >= TRANSFER_PARALLELISM )); do
+      running=0
+      for pid in "${TRANSFER_PIDS[@]}"; do
+        if kill -0 "${pid}" 2> /dev/null; then
+          running=$((running + 1))
+        fi
+      done
+      if (( running < TRANSFER_PARALLELISM )); then
+        return
+      fi
+      if (( BASH_VERSINFO[0] > 4 ||
+            (BASH_VERSINFO[0] == 4 && BASH_VERSINFO[1] >= 3) )); then
+        wait -n || true
+      else
+        sleep 1
+      fi
+    done
+  }
+
+  start_transfer() {
+    wait_for_transfer_slot
+    {
+      if ! "$@"; then
+        log_info "Copy failed, retrying: $*"
+        "$@"
+      fi
+    } &
+    TRANSFER_PIDS+=($!)
+  }
+
+  wait_transfers() {
+    local pid failed=0
+    if (( ${#TRANSFER_PIDS[@]} > 0 )); then
+      for pid in "${TRANSFER_PIDS[@]}"; do
+        wait "${pid}" || failed=1
+      done
+    fi
+    TRANSFER_PIDS=()
+    return "${failed}"
+  }
+
+  # copy_files <destination directory> <source>...
+  copy_files() {
+    local destination="$1"
+    shift
+    printf '%s\\n' "$@" | gsutil -m -q cp -I "${destination}"
+  }
+""")
+
+INPUT_CACHE_SUBDIR = 'inputs'
+
+# Runner script function which copies an input file (not a wildcard) to the
+# task data directory: localize_input <file provider> <source> <target>.
+#
+# With an input cache (INPUT_CACHE_MAX_MB > 0), the file is first copied into
+# INPUT_CACHE_DIR, once, under the SHA-1 of a key to its content:
+# * a GCS object: its MD5 hash and size or, for composite objects (which have
+#   no MD5 hash), its URL and generation,
+# * a local file: its path, size and modification time.
+# The task gets a copy of the cached copy, which shares its blocks where the
+# file system supports it (cp --reflink), but never the cached copy itself:
+# task containers, which may run as root or be given the file by chown, could
+# otherwise modify it for later tasks. The <entry>.used file is touched
+# whenever a task uses an entry; once the cache grows beyond
+# INPUT_CACHE_MAX_MB, the least recently used entries are removed. Without
+# flock or sha1sum, the file is copied as it is without a cache.
+_LOCALIZE_INPUT = textwrap.dedent(r"""\
+  input_cache_key() {
+    local file_provider="$1"
+    local source="$2"
+    local stat
+    if [[ "${file_provider}" == "google-cloud-storage" ]]; then
+      stat="$(gsutil -q stat "${source}" 2> /dev/null)" || return 0
+      local md5 size generation
+      md5="$(awk -F': *' '/Hash \(md5\)/ { print $2 }' <<< "${stat}")"
+      size="$(awk -F': *' '/Content-Length/ { print $2 }' <<< "${stat}")"
+      generation="$(awk -F': *' '/Generation/ { print $2 }' <<< "${stat}")"
+      if [[ -n "${md5}" ]]; then
+        echo "md5 ${md5} ${size}"
+      elif [[ -n "${generation}" ]]; then
+        echo "gs ${source} ${generation}"
+      fi
+    else
+      stat="$(stat -c '%s %Y' "${source}" 2> /dev/null)" || return 0
+      echo "file ${source} ${stat}"
+    fi
+  }
+
+  evict_inputs() {
+    exec 6> "${INPUT_CACHE_DIR}/cache.lock"
+    flock 6
+    local size_mb="$(du -sm "${INPUT_CACHE_DIR}" | cut -f1)"
+    local used entry
+    for used in $(ls -tr "${INPUT_CACHE_DIR}" | grep '\.used$' || true); do
+      if (( size_mb <= INPUT_CACHE_MAX_MB )); then
+        break
+      fi
+      entry="${INPUT_CACHE_DIR}/${used%.used}"
+      # Entries being copied are locked. The lock file goes too, under the
+      # lock: localize_input locks again if its lock file was removed.
+      if flock --nonblock "${entry}.lock" \
+          rm -f "${entry}" "${entry}.used" "${entry}.lock"; then
+        size_mb="$(du -sm "${INPUT_CACHE_DIR}" | cut -f1)"
+      fi
+    done
+    exec 6>&-
+  }
+
+  localize_input() {
+    local file_provider="$1"
+    local source="$2"
+    local target="$3"
+    local key=''
+    if (( INPUT_CACHE_MAX_MB > 0 )) && command -v flock > /dev/null &&
+       command -v sha1sum > /dev/null; then
+      key="$(input_cache_key "${file_provider}" "${source}")"
+    fi
+    if [[ -z "${key}" ]]; then
+      gsutil -q cp "${source}" "${target}"
+      return
+    fi
+
+    mkdir -p "${INPUT_CACHE_DIR}"
+    local entry
+    entry="${INPUT_CACHE_DIR}/$(echo "${key}" | sha1sum | cut -d' ' -f1)"
+    # Lock again if evict_inputs removed the lock file before it was locked.
+    while true; do
+      exec 7> "${entry}.lock"
+      flock 7
+      if [[ /dev/fd/7 -ef "${entry}.lock" ]]; then
+        break
+      fi
+    done
+    if [[ ! -f "${entry}" ]]; then
+      gsutil -q cp "${source}" "${entry}.tmp"
+      chmod a-w "${entry}.tmp"
+      mv -f "${entry}.tmp" "${entry}"
+    fi
+    touch "${entry}.used"
+    cp --reflink=auto "${entry}" "${target}" 2> /dev/null ||
+      cp "${entry}" "${target}"
+    chmod u+w "${target}"
+    exec 7>&-
+    evict_inputs
+  }
+""")
+
+# Command (for sh -c) of the task container of images which run as root. It
+# runs the user script, then gives the data it wrote to the host user, and
+# exits with the status of the user script.
+_RUN_AND_CHOWN = textwrap.dedent("""\
+  readonly RUN_AND_CHOWN='
+    "$1"
+    status=$?
+    chown -R "$2" "$3"
+    exit "${status}"'
+""")
+
+# Seconds between checks of a queued task for host capacity.
+_SCHEDULER_POLL_SECONDS = 5
+
+# Minimum number of superseded lines in the task index before it is compacted.
+_INDEX_COMPACT_MIN_LINES = 1000
+
+
+def _host_capacity():
+  """Returns the CPU cores and MB of RAM of the host, or 0 if unknown."""
+  try:
+    cores = multiprocessing.cpu_count()
+  except NotImplementedError:
+    cores = 0
+  try:
+    ram_mb = (os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') //
+              (1024 * 1024))
+  except (ValueError, OSError, AttributeError):
+    ram_mb = 0
+  return cores, ram_mb
+
+
+class _TaskIndex(object):
+  """Append-only index of the tasks in the provider root, with their status.
+
+  The index is a file of JSON lines. dsub appends one line for each task it
+  submits, with the fields that lookups filter on, and the runner script (or
+  ddel) appends a line whenever it writes the status of a task:
+
+    {"job-id": ..., "task-id": "1", "job-name": ..., "create-time": ...,
+     "labels": {...}, "status": "RUNNING"}
+    {"job-id": ..., "task-id": "1", "status": "SUCCESS"}
+
+  Lines are short and appended in a single write, so concurrent writers do
+  not interleave. A partially-written line (a writer was killed) is ignored.
+  Task directories remain the source of truth for everything else.
+
+  Once most lines of the index are superseded by later ones, the index is
+  compacted to one line per task, dropping the tasks of deleted job
+  directories. Writers hold the index.jsonl.lock lock, so that no line is
+  appended to the index while it is being replaced.
+  """
+
+  def __init__(self, provider_root):
+    self._root = provider_root
+    self._path = os.path.join(provider_root, 'index.jsonl')
+
+  @property
+  def path(self):
+    return self._path
+
+  @staticmethod
+  def task_key(job_id, task_id):
+    """Returns the JSON members identifying a task, without braces."""
+    return json.dumps({
+        'job-id': job_id,
+        'task-id': None if task_id is None else str(task_id)
+    }, sort_keys=True)[1:-1]
+
+  def _lock(self):
+    """Returns the open lock file of the index, once it is locked."""
+    lock = open(self._path + '.lock', 'a')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+  def _append(self, record):
+    with self._lock():
+      with open(self._path, 'a') as f:
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+
+  def add_task(self, task_metadata, create_time, labels):
+    task_id = task_metadata.get('task-id')
+    self._append({
+        'job-id': task_metadata.get('job-id'),
+        'task-id': None if task_id is None else str(task_id),
+        'job-name': task_metadata.get('job-name'),
+        'create-time': create_time,
+        'labels': labels,
+        'status': 'QUEUED',
+    })
+
+  def set_status(self, job_id, task_id, status):
+    self._append({
+        'job-id': job_id,
+        'task-id': None if task_id is None else str(task_id),
+        'status': status,
+    })
+
+  def load(self):
+    """Returns an OrderedDict of (job-id, task-id) to the task's fields.
+
+    Tasks are in the order they were submitted. Status lines for tasks that
+    were not submitted with an index are ignored.
+    """
+    tasks, lines = self._read()
+    if self._should_compact(tasks, lines):
+      self._compact()
+    return tasks
+
+  def _read(self):
+    """Returns the tasks of the index, and its number of lines."""
+    tasks = OrderedDict()
+    lines = 0
+    try:
+      f = open(self._path, 'r')
+    except IOError:
+      return tasks, lines
+
+    with f:
+      for line in f:
+        lines += 1
+        try:
+          record = json.loads(line)
+        except ValueError:
+          continue
+        key = (record['job-id'], record['task-id'])
+        if 'create-time' in record:
+          tasks[key] = record
+        elif key in tasks:
+          tasks[key]['status'] = record['status']
+    return tasks, lines
+
+  @staticmethod
+  def _should_compact(tasks, lines):
+    superseded = lines - len(tasks)
+    return superseded >= _INDEX_COMPACT_MIN_LINES and superseded > len(tasks)
+
+  def _compact(self):
+    """Rewrites the index with one line per task of an existing job."""
+    try:
+      with self._lock():
+        # Read again: the index may have changed (or been compacted).
+        tasks, lines = self._read()
+        if not self._should_compact(tasks, lines):
+          return
+        job_dirs = set(os.listdir(self._root))
+        with open(self._path + '.tmp', 'w') as f:
+          for record in tasks.itervalues():
+            if record['job-id'] in job_dirs:
+              f.write(json.dumps(record, sort_keys=True) + '\n')
+        os.rename(self._path + '.tmp', self._path)
+    except (IOError, OSError):
+      # The index is left as it is, for a later lookup to compact.
+      pass
+
 
 class LocalJobProvider(base.JobProvider):
   """Docker jobs running locally (i.e. on the caller's computer)."""
 
-  def __init__(self):
+  def __init__(self, max_concurrent_tasks=0, input_cache_size=0):
     self._operations = []
     self.provider_root_cache = None
+    # Maximum number of tasks to run at once (0 for no limit beyond the host
+    # capacity).
+    self._max_concurrent_tasks = max_concurrent_tasks
+    # Size limit (in GB) of the host cache of input files (0 for no cache).
+    self._input_cache_size = input_cache_size
+    # Task metadata file path to (mtime, metadata), see _read_task_metadata.
+    self._task_metadata_cache = {}
 
   def prepare_job_metadata(self, script, job_name, user_id):
     job_name_value = job_name or os.path.basename(script)
@@ -129,11 +690,16 @@ class LocalJobProvider(base.JobProvider):
         'dsub-version': DSUB_VERSION,
     }
 
-  def submit_job(self, job_resources, job_metadata, all_task_data):
+  def submit_job(self,
+                 job_resources,
+                 job_metadata,
+                 all_task_data,
+                 journal=None):
     create_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
 
-    # Validate inputs.
-    param_util.validate_submit_args_or_fail(
+    # Validate resources now and each task as it is consumed. all_task_data
+    # may be a generator, in which case it can be consumed only once.
+    all_task_data = param_util.validated_task_data(
         job_resources,
         all_task_data,
         provider_name=_PROVIDER_NAME,
@@ -166,6 +732,8 @@ class LocalJobProvider(base.JobProvider):
                                   task_data)
       if task_metadata.get('task-id') is not None:
         launched_tasks.append(str(task_metadata.get('task-id')))
+        if journal:
+          journal.record([task_metadata.get('task-id')])
 
     return {
         'job-id': job_metadata.get('job-id'),
@@ -184,6 +752,7 @@ class LocalJobProvider(base.JobProvider):
       set -o nounset
 
       readonly VOLUMES=({volumes})
+      readonly JOB_ID='{job_id}'
       readonly NAME='{name}'
       readonly IMAGE='{image}'
       # Absolute path to the user's script file inside Docker.
@@ -202,6 +771,24 @@ class LocalJobProvider(base.JobProvider):
       readonly TASK_DIR="$(dirname $0)"
       # User to run as (by default)
       readonly MY_UID='{uid}'
+      # Scheduling: host capacity and the reservation of this task.
+      readonly SCHEDULER_DIR='{scheduler_dir}'
+      readonly SCHEDULER_POLL_SECONDS='{scheduler_poll_seconds}'
+      readonly MAX_CONCURRENT_TASKS='{max_concurrent_tasks}'
+      readonly HOST_CORES='{host_cores}'
+      readonly HOST_RAM_MB='{host_ram_mb}'
+      readonly TASK_CORES='{task_cores}'
+      readonly TASK_RAM_MB='{task_ram_mb}'
+      # Number of file copies to run at once.
+      readonly TRANSFER_PARALLELISM='{transfer_parallelism}'
+      # Input cache of the provider, and its size limit (0 for no cache).
+      readonly INPUT_CACHE_DIR='{input_cache_dir}'
+      readonly INPUT_CACHE_MAX_MB='{input_cache_max_mb}'
+      # Image IDs and users of the images run by the provider.
+      readonly IMAGE_CACHE_DIR='{image_cache_dir}'
+      # Task index of the provider, and the JSON members naming this task.
+      readonly INDEX_FILE='{index_file}'
+      readonly INDEX_KEY={index_key}
       # Set environment variables for recursive input directories
       {export_input_dirs}
       # Set environment variables for recursive output directories
@@ -240,16 +827,19 @@ class LocalJobProvider(base.JobProvider):
         # Not putting it in status_message because we don't want that to be the
         # last line in case of error.
         echo "cleaning up ${DATA_DIR}"
-        # Clean up files written from inside Docker
-        2>&1 docker run \\
-         --name "${NAME}-cleanup" \\
-         --workdir "${DATA_MOUNT_POINT}/${WORKING_DIR}" \\
-         "${VOLUMES[@]}" \\
-         --env-file "${ENV_FILE}" \\
-         "${IMAGE}" \\
-         rm -rf "${DATA_MOUNT_POINT}/*" | tee -a log.txt
-        # Clean up files staged from outside Docker
-        rm -rf "${DATA_DIR}" || echo "sorry, unable to delete ${DATA_DIR}."
+        # Files written from inside Docker are normally owned by the host user
+        # by now. If not (the task failed or was canceled first), delete them
+        # from inside Docker.
+        if ! rm -rf "${DATA_DIR}" 2> /dev/null; then
+          2>&1 docker run \\
+           --rm \\
+           --user 0 \\
+           "${VOLUMES[@]}" \\
+           "${IMAGE}" \\
+           sh -c 'rm -rf "$1"/*' rm_data "${DATA_MOUNT_POINT}" | tee -a log.txt
+          # Clean up files staged from outside Docker
+          rm -rf "${DATA_DIR}" || echo "sorry, unable to delete ${DATA_DIR}."
+        fi
       }
 
       log_info() {
@@ -271,7 +861,7 @@ class LocalJobProvider(base.JobProvider):
         local code="$2"
         local message="${3:-Error}"
         if [[ $code != "0" ]]; then
-          echo "FAILURE" > status.txt
+          set_status "FAILURE"
           log_error "${message} on or near line ${parent_lineno}; exiting with status ${code}"
         fi
         cleanup
@@ -286,43 +876,6 @@ class LocalJobProvider(base.JobProvider):
       # exit so we know if it fires it means there's a problem.
       trap 'error ${LINENO} $? "Exit (undefined variable or kill?)"' EXIT
 
-      fetch_image() {
-        local image="$1"
-
-        for ((attempt=0; attempt < 3; attempt++)); do
-          log_info "Using gcloud to fetch ${image}."
-          if gcloud docker -- pull "${image}"; then
-            return
-          fi
-          log_info "Sleeping 30s before the next attempt."
-          sleep 30s
-        done
-
-        log_error "FAILED to fetch ${image}"
-        exit 1
-      }
-
-      fetch_image_if_necessary() {
-        local image="$1"
-
-        # Remove everything from the first / on
-        local prefix="${image%%/*}"
-
-        # Check that the prefix is gcr.io or <location>.gcr.io
-        if [[ "${prefix}" == "gcr.io" ]] ||
-           [[ "${prefix}" == *.gcr.io ]]; then
-          fetch_image "${image}"
-        fi
-      }
-
-      get_docker_user() {
-        # Get the userid and groupid the Docker image is set to run as.
-        docker run \\
-          --name "${NAME}-get-docker-userid" \\
-          "${IMAGE}" \\
-          bash -c 'echo "$(id -u):$(id -g)"' 2>> stderr.txt
-      }
-
       docker_recursive_chown() {
         # Calls, in Docker: chown -R $1 $2
         local usergroup="$1"
@@ -342,7 +895,7 @@ class LocalJobProvider(base.JobProvider):
         if [[ -f die ]]; then
           log_info "Job is canceled, stopping Docker container ${NAME}."
           docker stop "${NAME}"
-          echo "CANCELED" > status.txt
+          set_status "CANCELED"
           log_info "Delocalize logs and cleanup"
           cleanup
           trap EXIT
@@ -354,18 +907,25 @@ class LocalJobProvider(base.JobProvider):
 
       # Beginning main execution
 
-      # Copy inputs
+      # Wait for host capacity
       cd "${TASK_DIR}"
-      echo "RUNNING" > status.txt
+      set_status "QUEUED"
+      log_info "Queued, waiting for host capacity."
+      wait_for_capacity
+
+      # Copy inputs
+      set_status "RUNNING"
       log_info "Localizing inputs."
       localize_data
 
-      # Handle gcr.io images
-      fetch_image_if_necessary "${IMAGE}"
+      # Resolve the image, pulling gcr.io images
+      resolve_image
 
       log_info "Checking image userid."
       DOCKER_USERGROUP="$(get_docker_user)"
-      if [[ "${DOCKER_USERGROUP}" != "0:0" ]]; then
+      HOST_USERGROUP="$(id -u):$(id -g)"
+      if [[ "${DOCKER_USERGROUP}" != "0:0" ]] &&
+         [[ "${DOCKER_USERGROUP}" != "${HOST_USERGROUP}" ]]; then
         log_info "Ensuring docker user (${DOCKER_USERGROUP} can access ${DATA_MOUNT_POINT}."
         docker_recursive_chown "${DOCKER_USERGROUP}" "${DATA_MOUNT_POINT}"
       fi
@@ -375,6 +935,14 @@ class LocalJobProvider(base.JobProvider):
       # Disable ERR trap, we want to copy the logs even if Docker fails.
       trap ERR
       log_info "Running Docker image."
+      if [[ "${DOCKER_USERGROUP}" == "0:0" ]]; then
+        # The script runs as root, so the same container can then give the
+        # data it wrote to the host user.
+        COMMAND=(sh -c "${RUN_AND_CHOWN}" run_and_chown
+                 "${SCRIPT_FILE}" "${HOST_USERGROUP}" "${DATA_MOUNT_POINT}")
+      else
+        COMMAND=("${SCRIPT_FILE}")
+      fi
       docker run \\
          --detach \\
          --name "${NAME}" \\
@@ -382,7 +950,7 @@ class LocalJobProvider(base.JobProvider):
          "${VOLUMES[@]}" \\
          --env-file "${ENV_FILE}" \\
          "${IMAGE}" \\
-         "${SCRIPT_FILE}"
+         "${COMMAND[@]}"
       exit_if_canceled
       DOCKER_EXITCODE=$(docker wait "${NAME}")
       log_info "Docker exit code ${DOCKER_EXITCODE}."
@@ -394,18 +962,19 @@ class LocalJobProvider(base.JobProvider):
       trap 'error ${LINENO} $? Error' ERR
 
       # Prepare data for delocalization.
-      HOST_USERGROUP="$(id -u):$(id -g)"
       log_info "Ensure host user (${HOST_USERGROUP}) owns Docker-written data"
-      # Disable ERR trap, we want to copy the logs even if Docker fails.
-      trap ERR
-      docker_recursive_chown "${HOST_USERGROUP}" "${DATA_MOUNT_POINT}"
-      DOCKER_EXITCODE_2=$?
-      # Re-enable trap
-      trap 'error ${LINENO} $? Error' ERR
-      if [[ "${DOCKER_EXITCODE_2}" != 0 ]]; then
-        # Ensure we report failure at the end of the execution
-        FAILURE_MESSAGE="chown failed, Docker returned ${DOCKER_EXITCODE_2}."
-        log_error "${FAILURE_MESSAGE}"
+      if [[ -n "$(find "${DATA_DIR}" \\( ! -user "$(id -u)" -o ! -group "$(id -g)" \\) -print -quit)" ]]; then
+        # Disable ERR trap, we want to copy the logs even if Docker fails.
+        trap ERR
+        docker_recursive_chown "${HOST_USERGROUP}" "${DATA_MOUNT_POINT}"
+        DOCKER_EXITCODE_2=$?
+        # Re-enable trap
+        trap 'error ${LINENO} $? Error' ERR
+        if [[ "${DOCKER_EXITCODE_2}" != 0 ]]; then
+          # Ensure we report failure at the end of the execution
+          FAILURE_MESSAGE="chown failed, Docker returned ${DOCKER_EXITCODE_2}."
+          log_error "${FAILURE_MESSAGE}"
+        fi
       fi
 
       log_info "Copying outputs."
@@ -419,10 +988,10 @@ class LocalJobProvider(base.JobProvider):
       log_info "Delocalize logs and cleanup."
       cleanup
       if [[ -z "${FAILURE_MESSAGE}" ]]; then
-        echo "SUCCESS" > status.txt
+        set_status "SUCCESS"
         log_info "Done"
       else
-        echo "FAILURE" > status.txt
+        set_status "FAILURE"
         # we want this to be the last line in the log, for dstat to work right.
         log_error "${FAILURE_MESSAGE}"
         exit 1
@@ -432,9 +1001,11 @@ class LocalJobProvider(base.JobProvider):
     # Build the local runner script
     volumes = ('-v ' + task_dir + '/' + DATA_SUBDIR + '/'
                ':' + DATA_MOUNT_POINT)
+    host_cores, host_ram_mb = _host_capacity()
 
     script = script_header.format(
         volumes=volumes,
+        job_id=task_metadata.get('job-id'),
         name=LocalTask.format_docker_name(
             task_metadata.get('job-id'), task_metadata.get('task-id')),
         image=job_resources.image,
@@ -442,6 +1013,21 @@ class LocalJobProvider(base.JobProvider):
         task_metadata['script'].name,
         env_file=task_dir + '/' + 'docker.env',
         uid=os.getuid(),
+        scheduler_dir=self._state_directory(SCHEDULER_SUBDIR),
+        scheduler_poll_seconds=_SCHEDULER_POLL_SECONDS,
+        max_concurrent_tasks=self._max_concurrent_tasks,
+        host_cores=host_cores,
+        host_ram_mb=host_ram_mb,
+        task_cores=job_resources.min_cores or 0,
+        task_ram_mb=int((job_resources.min_ram or 0) * 1024),
+        transfer_parallelism=providers_util.TRANSFER_PARALLELISM,
+        input_cache_dir=self._state_directory(INPUT_CACHE_SUBDIR),
+        input_cache_max_mb=int(self._input_cache_size * 1024),
+        image_cache_dir=self._state_directory(IMAGE_SUBDIR),
+        index_file=self._task_index().path,
+        index_key=pipes.quote(
+            _TaskIndex.task_key(
+                task_metadata.get('job-id'), task_metadata.get('task-id'))),
         data_mount_point=DATA_MOUNT_POINT,
         data_dir=task_dir + '/' + DATA_SUBDIR,
         date_format='+%Y/%m/%d %H:%M:%S',
@@ -458,7 +1044,11 @@ class LocalJobProvider(base.JobProvider):
         delocalize_command=self._delocalize_outputs_commands(
             task_dir, task_data),
         delocalize_logs_command=self._delocalize_logging_command(
-            job_resources.logging.file_provider, task_metadata),) + script_body
+            job_resources.logging.file_provider,
+            task_metadata),) + (
+                _SET_STATUS + _WAIT_FOR_CAPACITY + _TRANSFER + _LOCALIZE_INPUT +
+                _RESOLVE_IMAGE +
+                _RUN_AND_CHOWN + script_body)
 
     # Write the local runner script
     script_fname = task_dir + '/runner.sh'
@@ -517,35 +1107,38 @@ class LocalJobProvider(base.JobProvider):
       with open(os.path.join(task_dir, 'die'), 'wt') as f:
         f.write('Operation canceled at %s\n' % today)
 
-      # Next, kill Docker if it's running.
+      # Next, kill Docker if it's running. A queued task has not started
+      # Docker; its runner script exits when it sees the "die" file.
       docker_name = task.get_docker_name_for_task()
+      if self._read_status_file(task_dir) != 'QUEUED':
+        try:
+          subprocess.check_output(['docker', 'kill', docker_name])
+        except subprocess.CalledProcessError as cpe:
+          cancel_errors += [
+              'Unable to cancel %s: docker error %s:\n%s' %
+              (docker_name, cpe.returncode, cpe.output)
+          ]
+          continue
 
-      try:
-        subprocess.check_output(['docker', 'kill', docker_name])
-      except subprocess.CalledProcessError as cpe:
-        cancel_errors += [
-            'Unable to cancel %s: docker error %s:\n%s' %
-            (docker_name, cpe.returncode, cpe.output)
-        ]
-        continue
-
-      # The script should have quit in response. If it hasn't, kill it.
-      pid = task.get_field('pid', 0)
-      if pid <= 0:
-        cancel_errors += ['Unable to cancel %s: missing pid.' % docker_name]
-        continue
-      try:
-        os.kill(pid, signal.SIGTERM)
-      except OSError as err:
-        cancel_errors += [
-            'Error while canceling %s: kill(%s) failed (%s).' % (docker_name,
-                                                                 pid, str(err))
-        ]
+        # The script should have quit in response. If it hasn't, kill it.
+        pid = task.get_field('pid', 0)
+        if pid <= 0:
+          cancel_errors += ['Unable to cancel %s: missing pid.' % docker_name]
+          continue
+        try:
+          os.kill(pid, signal.SIGTERM)
+        except OSError as err:
+          cancel_errors += [
+              'Error while canceling %s: kill(%s) failed (%s).' %
+              (docker_name, pid, str(err))
+          ]
       canceled += [task]
 
       # Mark the job as 'CANCELED' for the benefit of dstat
       with open(os.path.join(task_dir, 'status.txt'), 'wt') as f:
         f.write('CANCELED\n')
+      self._task_index().set_status(
+          task.get_field('job-id'), task.get_field('task-id'), 'CANCELED')
       today = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
       msg = 'Operation canceled at %s\n' % today
       with open(os.path.join(task_dir, 'status_message.txt'), 'wt') as f:
@@ -558,19 +1151,7 @@ class LocalJobProvider(base.JobProvider):
   @classmethod
   def _utc_int_to_local_datetime(cls, utc_int):
     """Convert the integer UTC time value into a local datetime."""
-    if utc_int is None:
-      return None
-
-    # Convert from a UTC integer (seconds since the epoch) to a UTC datetime
-    datetime_utc = datetime.utcfromtimestamp(0) + timedelta(seconds=utc_int)
-
-    # Get the offset from UTC to local
-    timestamp = time.mktime(datetime_utc.timetuple())
-    offset = datetime.fromtimestamp(timestamp) - datetime.utcfromtimestamp(
-        timestamp)
-
-    # Convert from a UTC datetime to a local datetime
-    return datetime_utc + offset
+    return timestamp_util.utc_seconds_to_local_datetime(utc_int)
 
   def lookup_job_tasks(self,
                        status_list,
@@ -580,7 +1161,8 @@ class LocalJobProvider(base.JobProvider):
                        task_list=None,
                        labels=None,
                        create_time=None,
-                       max_tasks=0):
+                       max_tasks=0,
+                       fields=None):
     # 'OR' filtering arguments.
     status_list = None if status_list == ['*'] else status_list
     user_list = None if user_list == ['*'] else user_list
@@ -607,50 +1189,97 @@ class LocalJobProvider(base.JobProvider):
     else:
       user_list = approved_users
 
+    def matches(status, job_name, task_labels, task_create_time):
+      if status_list and status not in status_list:
+        return False
+      if job_name_list and job_name not in job_name_list:
+        return False
+      # If labels are defined, all labels must match.
+      if labels and not all(
+          [k in task_labels and task_labels[k] == v for k, v in labels]):
+        return False
+      # Check that the job is not too old.
+      if create_time_local:
+        task_create_time = datetime.strptime(task_create_time,
+                                             '%Y-%m-%d %H:%M:%S.%f')
+        if task_create_time < create_time_local:
+          return False
+      return True
+
     ret = []
-    if not job_list:
-      # Default to every job we know about.
-      job_list = os.listdir(self._provider_root())
-    for j in job_list:
+    for j, task_id in self._candidate_tasks(job_list, task_list, matches):
       for u in user_list:
-        path = self._provider_root() + '/' + j
-        if not os.path.isdir(path):
+        task = self._get_task_from_task_dir(j, u, task_id)
+        if not matches(
+            task.get_field('status'), task.get_field('job-name'),
+            task.get_field('labels'), task.get_field('create-time')):
           continue
-        for task_id in os.listdir(path):
-          if task_id == 'task':
-            task_id = None
-          if task_list and task_id not in task_list:
-            continue
-
-          task = self._get_task_from_task_dir(j, u, task_id)
-          status = task.get_field('status')
-          if status_list and status not in status_list:
-            continue
-
-          job_name = task.get_field('job-name')
-          if job_name_list and job_name not in job_name_list:
-            continue
-
-          # If labels are defined, all labels must match.
-          task_labels = task.get_field('labels')
-          labels_match = all(
-              [k in task_labels and task_labels[k] == v for k, v in labels])
-          if labels and not labels_match:
-            continue
-          # Check that the job is not too old.
-          if create_time_local:
-            task_create_time = datetime.strptime(task.get_field('create-time'),
-                                                 '%Y-%m-%d %H:%M:%S.%f')
-            if task_create_time < create_time_local:
-              continue
-
-          ret.append(task)
-
-          if max_tasks > 0 and len(ret) > max_tasks:
-            break
+
+        ret.append(task)
+        if max_tasks > 0 and len(ret) >= max_tasks:
+          return ret
 
     return ret
 
+  def _candidate_tasks(self, job_list, task_list, matches):
+    """Yields the (job-id, task-id) of tasks which may match a lookup.
+
+    Tasks in the task index are filtered on their indexed fields. A task
+    indexed as RUNNING may since have been killed, so it is a candidate as
+    either RUNNING or CANCELED. Job directories which are not in the index
+    (such as those of earlier versions of dsub) are listed.
+
+    Args:
+      job_list: job-ids to look up, or None for all jobs.
+      task_list: task-ids to look up, or None for all tasks.
+      matches: function of status, job name, labels, and create-time,
+        returning whether a task matches the other filters of the lookup.
+    """
+    root = self._provider_root()
+    if not os.path.isdir(root):
+      return
+    job_dirs = set(os.listdir(root)) - set([STATE_DIR])
+    if job_list:
+      job_dirs &= set(job_list)
+
+    index = self._task_index().load()
+    indexed_jobs = set()
+    for (job_id, task_id), record in index.iteritems():
+      indexed_jobs.add(job_id)
+      if job_id not in job_dirs:
+        continue
+      if task_list and task_id not in task_list:
+        continue
+      statuses = [record['status']]
+      if record['status'] not in _TERMINAL_STATUSES:
+        statuses = ['RUNNING', 'CANCELED']
+      if not any(
+          matches(status, record['job-name'], record['labels'],
+                  record['create-time']) for status in statuses):
+        continue
+      yield job_id, task_id
+
+    for job_id in sorted(job_dirs - indexed_jobs):
+      path = os.path.join(root, job_id)
+      if not os.path.isdir(path):
+        continue
+      for task_id in os.listdir(path):
+        if not os.path.isdir(os.path.join(path, task_id)):
+          continue
+        if task_id == 'task':
+          task_id = None
+        if task_list and task_id not in task_list:
+          continue
+        yield job_id, task_id
+
+  def refresh_tasks(self, tasks):
+    # Read each task's directory again, rather than listing all jobs.
+    return [
+        self._get_task_from_task_dir(
+            task.get_field('job-id'), task.get_field('user-id'),
+            task.get_field('task-id')) for task in tasks
+    ]
+
   def get_tasks_completion_messages(self, tasks):
     return [task.get_field('status-message') for task in tasks]
 
@@ -659,7 +1288,7 @@ class LocalJobProvider(base.JobProvider):
   def _write_task_metadata(self, task_metadata, task_data, create_time):
     """Write a file with the data needed for dstat."""
 
-    # Build up a dict to dump a YAML file with relevant task details:
+    # Build up a dict to dump a JSON file with relevant task details:
     #   job-id: <id>
     #   task-id: <id>
     #   job-name: <name>
@@ -690,8 +1319,54 @@ class LocalJobProvider(base.JobProvider):
 
     task_dir = self._task_directory(
         task_metadata.get('job-id'), task_metadata.get('task-id'))
-    with open(task_dir + '/meta.yaml', 'wt') as f:
-      f.write(yaml.dump(data))
+    with open(task_dir + '/meta.json', 'wt') as f:
+      f.write(json.dumps(data))
+
+    self._task_index().add_task(task_metadata, create_time, data['labels'])
+
+  @staticmethod
+  def _read_status_file(path):
+    """Returns the status written by the runner script, or None."""
+    try:
+      with open(os.path.join(path, 'status.txt'), 'r') as f:
+        return f.readline().strip()
+    except IOError:
+      return None
+
+  def _read_task_metadata(self, path):
+    """Returns the metadata written by _write_task_metadata, and its mtime.
+
+    Task metadata never changes once written, so parsed metadata is cached
+    for as long as the modification time of its file is unchanged. Tasks of
+    earlier versions of dsub have a meta.yaml file instead of meta.json.
+
+    Args:
+      path: the task directory.
+
+    Returns:
+      A tuple of the metadata dict and the modification time of its file.
+
+    Raises:
+      IOError: if the task has no metadata file (yet).
+    """
+    for filename, parse in [('meta.json', json.loads), ('meta.yaml',
+                                                        yaml.load)]:
+      meta_path = os.path.join(path, filename)
+      try:
+        mtime = os.path.getmtime(meta_path)
+      except OSError:
+        continue
+
+      cached = self._task_metadata_cache.get(meta_path)
+      if cached and cached[0] == mtime:
+        return cached[1], mtime
+
+      with open(meta_path, 'r') as f:
+        meta = parse(f.read())
+      self._task_metadata_cache[meta_path] = (mtime, meta)
+      return meta, mtime
+
+    raise IOError('No task metadata found in %s' % path)
 
   def _get_task_from_task_dir(self, job_id, user_id, task_id):
     """Return a Task object with this task's info."""
@@ -707,14 +1382,14 @@ class LocalJobProvider(base.JobProvider):
         status = f.readline().strip()
       with open(path + '/status_message.txt', 'r') as f:
         status_message = ''.join(f.readlines())
-      with open(path + '/meta.yaml', 'r') as f:
-        meta = yaml.load('\n'.join(f.readlines()))
-      last_update = max([
+      meta, meta_mtime = self._read_task_metadata(path)
+      last_update = max([meta_mtime] + [
           os.path.getmtime(path + filename)
-          for filename in ['/status.txt', '/status_message.txt', '/meta.yaml']
+          for filename in ['/status.txt', '/status_message.txt']
       ])
-      create_time = meta.get('create-time',
-                             os.path.getmtime(path + '/task.pid'))
+      create_time = meta.get('create-time')
+      if create_time is None:
+        create_time = os.path.getmtime(path + '/task.pid')
     except IOError:
       # Files are not there yet.
       # RUNNING is a misnomer, but there is no PENDING status.
@@ -733,6 +1408,11 @@ class LocalJobProvider(base.JobProvider):
         # pid file not there, let's say it's still pending.
         pass
 
+    if status == 'QUEUED':
+      # Tasks waiting for host capacity are RUNNING (as are the pending tasks
+      # of other providers); their status message says they are queued.
+      status = 'RUNNING'
+
     if status == 'RUNNING':
       # Double-check running jobs, because it may have been killed but unable to
       # update status (kill -9).
@@ -766,11 +1446,17 @@ class LocalJobProvider(base.JobProvider):
         user_id=user_id,
         pid=pid)
 
+  def _task_index(self):
+    return _TaskIndex(self._provider_root())
+
   def _provider_root(self):
     if not self.provider_root_cache:
       self.provider_root_cache = tempfile.gettempdir() + '/dsub-local'
     return self.provider_root_cache
 
+  def _state_directory(self, name):
+    return os.path.join(self._provider_root(), STATE_DIR, name)
+
   def _delocalize_logging_command(self, file_provider, task_metadata):
     """Returns a command to delocalize logs.
 
@@ -878,22 +1564,51 @@ class LocalJobProvider(base.JobProvider):
     else:
       return local_file_path
 
+  def _copy_files_commands(self, copies):
+    """Returns commands starting copies of files, grouped by destination.
+
+    Args:
+      copies: a list of (source, destination directory) pairs.
+
+    Returns:
+      A list of start_transfer commands, one per destination directory, each
+      copying its files with a single "gsutil -m cp -I".
+    """
+    sources = OrderedDict()
+    for source, destination in copies:
+      sources.setdefault(destination, []).append(source)
+    return [
+        'start_transfer copy_files "%s" %s' %
+        (destination, ' '.join('"%s"' % source for source in group))
+        for destination, group in sources.iteritems()
+    ]
+
   def _localize_inputs_command(self, task_dir, task_data):
     """Returns a command that will stage inputs."""
     ins = task_data.get('inputs', [])
     commands = []
+    copies = []
     for i in ins:
       if i.recursive:
         continue
       gcs_file_path = i.value
       local_file_path = task_dir + '/' + DATA_SUBDIR + '/' + i.docker_path
       commands.append('mkdir -p "%s"' % os.path.dirname(local_file_path))
-      commands.append('gsutil -q cp "%s" "%s"' %
-                      (gcs_file_path,
-                       self._get_input_target_path(local_file_path)))
+      target_path = self._get_input_target_path(local_file_path)
+      if target_path == local_file_path and self._input_cache_size:
+        commands.append('start_transfer localize_input "%s" "%s" "%s"' %
+                        (i.file_provider, gcs_file_path, target_path))
+      else:
+        # Wildcards are copied as they are.
+        copies.append((gcs_file_path, os.path.dirname(local_file_path) + '/'))
 
+    commands.extend(self._copy_files_commands(copies))
     commands.append(
         textwrap.dedent("""\
+    if ! wait_transfers; then
+      log_error "Localization failed."
+      exit 1
+    fi
     if ! recursive_localize_data; then
       log_error "Recursive localization failed."
       exit 1
@@ -931,19 +1646,25 @@ class LocalJobProvider(base.JobProvider):
     """Copy outputs from local disk to GCS."""
     outs = task_data.get('outputs', [])
     commands = []
+    copies = []
     for o in outs:
       if o.recursive:
         continue
       dest_path = o.uri.path
       local_path = task_dir + '/' + DATA_SUBDIR + '/' + o.docker_path
       if o.file_provider == param_util.P_GCS:
-        commands.append('gsutil -q cp "%s" "%s"' % (local_path, dest_path))
+        copies.append((local_path, dest_path))
       if o.file_provider == param_util.P_LOCAL:
         commands.append('mkdir -p "%s"' % dest_path)
         commands.append('cp %s %s' % (local_path, dest_path))
 
+    commands.extend(self._copy_files_commands(copies))
     commands.append(
         textwrap.dedent("""\
+    if ! wait_transfers; then
+      log_error "Delocalization failed."
+      exit 1
+    fi
     if ! recursive_delocalize_data; then
       log_error "Recursive delocalization failed."
       exit 1
@@ -17,6 +17,7 @@
 from . import google
 from . import local
 from . import test_fails
+from ..lib import operation_cache
 
 
 def get_provider(args):
@@ -25,11 +26,20 @@ def get_provider(args):
   provider = getattr(args, 'provider', 'google')
 
   if provider == 'google':
+    cache = None
+    if getattr(args, 'cache', False):
+      cache = operation_cache.OperationCache()
     return google.GoogleJobProvider(
         getattr(args, 'verbose', False),
-        getattr(args, 'dry_run', False), args.project)
+        getattr(args, 'dry_run', False),
+        args.project,
+        submit_parallelism=getattr(args, 'submit_parallelism', 1),
+        submit_batch_size=getattr(args, 'submit_batch_size', 1),
+        operation_cache=cache)
   elif provider == 'local':
-    return local.LocalJobProvider()
+    return local.LocalJobProvider(
+        max_concurrent_tasks=getattr(args, 'max_concurrent_tasks', 0),
+        input_cache_size=getattr(args, 'input_cache_size', 0))
   elif provider == 'test-fails':
     return test_fails.FailsJobProvider()
   else:
@@ -25,7 +25,8 @@ class StubJobProvider(base.JobProvider):
   # 1) Methods that are supposed to do something. Use mocks
   #    if you need to check that they are called.
 
-  def submit_job(self, job_resources, job_metadata, all_job_data):
+  def submit_job(self, job_resources, job_metadata, all_job_data,
+                 journal=None):
     pass
 
   def delete_jobs(self,
@@ -76,7 +77,8 @@ class StubJobProvider(base.JobProvider):
                        task_list=None,
                        labels=None,
                        create_time=None,
-                       max_tasks=0):
+                       max_tasks=0,
+                       fields=None):
     """Return a list of operations based on the input criteria.
 
     If any of the filters are empty or "[*]", then no filtering is performed on
@@ -90,6 +92,7 @@ class StubJobProvider(base.JobProvider):
       task_list: a list of specific tasks within the specified job(s) to return.
       create_time: a UTC value for earliest create time for a job.
       max_tasks: the maximum number of job tasks to return or 0 for no limit.
+      fields: unused, the stub tasks are always complete.
 
     Returns:
       A list of Genomics API Operations objects.
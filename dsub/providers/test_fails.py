@@ -30,8 +30,10 @@ class FailsJobProvider(base.JobProvider):
   def __init__(self):
     self._operations = []
 
-  def submit_job(self, job_resources, job_metadata, all_job_data):
-    del job_resources, job_metadata, all_job_data  # we fail unconditionally
+  def submit_job(self, job_resources, job_metadata, all_job_data,
+                 journal=None):
+    # we fail unconditionally
+    del job_resources, job_metadata, all_job_data, journal
     raise FailsException("fails provider made submit_job fail")
 
   def delete_jobs(self, user_list, job_list, task_list, create_time=None):
@@ -43,8 +45,10 @@ class FailsJobProvider(base.JobProvider):
                        user_list=None,
                        job_list=None,
                        task_list=None,
-                       max_tasks=0):
-    del status_list, user_list, job_list, task_list, max_tasks  # never any jobs
+                       max_tasks=0,
+                       fields=None):
+    # never any jobs
+    del status_list, user_list, job_list, task_list, max_tasks, fields
     raise FailsException("fails provider made lookup_job_tasks fail")
 
   def get_tasks_completion_messages(self, tasks):
@@ -0,0 +1,101 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark local provider lookups of finished tasks, as dstat makes them.
+
+The tasks are written to a temporary provider root. Reports the time to look
+up all tasks:
+* with meta.yaml files (as written by earlier versions of dsub),
+* with meta.json files,
+* with meta.json files, polling again with the same provider (as dstat --wait
+  does), so that task metadata is read from the cache.
+
+Usage:
+  python -m test.benchmarks.benchmark_local_lookup [--tasks N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from dsub.lib import param_util
+from dsub.providers import local
+import yaml
+
+
+def _write_tasks(root, count, legacy):
+  """Writes the files of count finished tasks of a job."""
+  prov = local.LocalJobProvider()
+  prov.provider_root_cache = root
+  envs = [param_util.EnvParam('VAR%d' % i, 'value-%d' % i) for i in range(10)]
+  inputs = [
+      param_util.EnvParam('INPUT%d' % i, 'gs://bucket/path/input-%d.bam' % i)
+      for i in range(5)
+  ]
+  for task_id in range(1, count + 1):
+    task_dir = prov._task_directory('job--me--170101-120000-00', task_id)
+    os.makedirs(task_dir)
+    for filename, text in [('status.txt', 'SUCCESS\n'),
+                           ('status_message.txt', 'I: Done\n'),
+                           ('task.pid', '0\n')]:
+      with open(os.path.join(task_dir, filename), 'w') as f:
+        f.write(text)
+    prov._write_task_metadata({
+        'job-id': 'job--me--170101-120000-00',
+        'task-id': task_id,
+        'job-name': 'job',
+        'logging': 'gs://bucket/logs/',
+    }, {'envs': envs, 'inputs': inputs}, '2017-01-01 12:00:00.000000')
+
+    if legacy:
+      with open(os.path.join(task_dir, 'meta.json'), 'r') as f:
+        data = yaml.safe_load(f)
+      os.remove(os.path.join(task_dir, 'meta.json'))
+      with open(os.path.join(task_dir, 'meta.yaml'), 'w') as f:
+        f.write(yaml.dump(data))
+
+
+def _lookup_seconds(prov):
+  start = time.time()
+  prov.lookup_job_tasks(['*'])
+  return time.time() - start
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--tasks', type=int, default=2000)
+  args = parser.parse_args()
+
+  print('Tasks: %d' % args.tasks)
+  print('Seconds per lookup:')
+  for legacy in [True, False]:
+    root = tempfile.mkdtemp()
+    try:
+      _write_tasks(root, args.tasks, legacy)
+      prov = local.LocalJobProvider()
+      prov.provider_root_cache = root
+      if legacy:
+        print('  meta.yaml:           %8.3f' % _lookup_seconds(prov))
+      else:
+        print('  meta.json:           %8.3f' % _lookup_seconds(prov))
+        print('  meta.json (cached):  %8.3f' % _lookup_seconds(prov))
+    finally:
+      shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,124 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark building google provider pipeline requests for a --tasks job.
+
+Compares building each task's ephemeralPipeline from scratch with sharing
+memoized templates, as a dry run of a job would.
+
+Usage:
+  python -m test.benchmarks.benchmark_pipeline_templates [--tasks N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from dsub.lib import job_util
+from dsub.lib import param_util
+from dsub.providers import google
+
+
+class _Credentials(object):
+
+  def authorize(self, http):
+    return http
+
+
+class _OfflineGoogleJobProvider(google.GoogleJobProvider):
+
+  @classmethod
+  def _setup_service(cls, credentials=None):
+    return None
+
+
+def _make_task_data(task_count):
+  """Generator of task data like that of a typical tasks file.
+
+  Each task has an env, an input file, and an output file (written to a
+  shared directory), plus a recursive output directory per task.
+
+  Args:
+    task_count: number of tasks.
+
+  Yields:
+    task data dictionaries.
+  """
+  input_util = param_util.InputFileParamUtil('input')
+  output_util = param_util.OutputFileParamUtil('output')
+  for task_id in range(1, task_count + 1):
+    yield {
+        'task-id': task_id,
+        'labels': [],
+        'envs': [param_util.EnvParam('SAMPLE_ID', 'sample-%d' % task_id)],
+        'inputs': [
+            input_util.make_param('BAM', 'gs://in/sample-%d.bam' % task_id,
+                                  False)
+        ],
+        'outputs': [
+            output_util.make_param('VCF', 'gs://out/vcf/*.vcf', False),
+            output_util.make_param('STATS', 'gs://out/stats/', True)
+        ],
+    }
+
+
+def _time_requests(prov, job_resources, job_metadata, task_count,
+                   use_templates):
+  start = time.time()
+  if use_templates:
+    for _ in prov._build_pipeline_requests(job_resources, job_metadata,
+                                           _make_task_data(task_count)):
+      pass
+  else:
+    for task_data in _make_task_data(task_count):
+      task_metadata = dict(job_metadata, **{'task-id': task_data['task-id']})
+      prov._build_pipeline_request(job_resources, task_metadata, task_data)
+  return time.time() - start
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--tasks', type=int, default=100000)
+  args = parser.parse_args()
+
+  prov = _OfflineGoogleJobProvider(
+      False, True, 'my-project', credentials=_Credentials())
+  job_resources = job_util.JobResources(
+      logging=param_util.build_logging_param('gs://bucket/logs/'),
+      zones=['us-*'],
+      image='ubuntu:14.04',
+      scopes=['https://www.googleapis.com/auth/bigquery'])
+  job_metadata = prov.prepare_job_metadata('script.sh', None, 'me')
+  job_metadata['script'] = job_util.Script('script.sh', 'echo "${SAMPLE_ID}"')
+
+  # Time building the task data alone, which both approaches include.
+  start = time.time()
+  for _ in _make_task_data(args.tasks):
+    pass
+  baseline = time.time() - start
+
+  direct = _time_requests(prov, job_resources, job_metadata, args.tasks, False)
+  templates = _time_requests(prov, job_resources, job_metadata, args.tasks,
+                             True)
+
+  print('Tasks: %d' % args.tasks)
+  print('Task data only:        %8.2fs' % baseline)
+  print('Per-task pipelines:    %8.2fs' % direct)
+  print('Shared templates:      %8.2fs' % templates)
+  print('Speedup (excluding task data): %.1fx' % ((direct - baseline) / max(
+      templates - baseline, 1e-6)))
+
+
+if __name__ == '__main__':
+  main()
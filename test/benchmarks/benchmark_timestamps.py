@@ -0,0 +1,83 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark localizing RFC3339 timestamps, as dstat does for each task.
+
+Reports the cost per million timestamps of:
+* a regular expression and dateutil's tzlocal() (the earlier implementation),
+* timestamp_util with distinct timestamps (every lookup misses the cache),
+* timestamp_util with timestamps shared by tasks (as for the tasks of a job).
+
+Usage:
+  python -m test.benchmarks.benchmark_timestamps [--timestamps N]
+"""
+
+from __future__ import print_function
+
+import argparse
+from datetime import datetime
+import re
+import time
+
+from dateutil.tz import tzlocal
+from dsub.lib import timestamp_util
+import pytz
+
+
+def _regex_localize(datestamp):
+  m = re.match(r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2}).*Z',
+               datestamp)
+  if not m:
+    return datestamp
+  g = [int(val) for val in m.groups()]
+  dt = datetime(g[0], g[1], g[2], g[3], g[4], g[5], tzinfo=pytz.utc)
+  return dt.astimezone(tzlocal()).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _make_timestamps(count, distinct):
+  """A list of count timestamps, with the given number of distinct values."""
+  start = 1500000000
+  return [
+      time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(start + i % distinct)) +
+      '.%09dZ' % (i % distinct) for i in range(count)
+  ]
+
+
+def _seconds_per_million(localize, timestamps):
+  timestamp_util._LOCALIZED_RFC3339.clear()
+  start = time.time()
+  for datestamp in timestamps:
+    localize(datestamp)
+  return (time.time() - start) * 1000000 / len(timestamps)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--timestamps', type=int, default=200000)
+  args = parser.parse_args()
+
+  distinct = _make_timestamps(args.timestamps, args.timestamps)
+  shared = _make_timestamps(args.timestamps, 1000)
+
+  print('Timestamps: %d' % args.timestamps)
+  print('Seconds per million timestamps:')
+  print('  regex and tzlocal():        %8.2f' % _seconds_per_million(
+      _regex_localize, distinct))
+  print('  timestamp_util (distinct):  %8.2f' % _seconds_per_million(
+      timestamp_util.localize_rfc3339, distinct))
+  print('  timestamp_util (shared):    %8.2f' % _seconds_per_million(
+      timestamp_util.localize_rfc3339, shared))
+
+
+if __name__ == '__main__':
+  main()
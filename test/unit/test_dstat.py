@@ -0,0 +1,255 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for dstat."""
+
+import json
+import StringIO
+import sys
+import unittest
+
+from dsub.commands import dstat as dstat_command
+from dsub.providers import stub
+import fake_time
+import yaml
+
+
+def establish_chronology(chronology):
+  dstat_command.SLEEP_FUNCTION = fake_time.FakeTime(chronology).sleep
+
+
+def _op(task_id, status, message):
+  return {
+      'job-id': 'job-1',
+      'job-name': 'job',
+      'task-id': task_id,
+      'status': (status, '123'),
+      'status-message': message,
+  }
+
+
+class RecordingStubJobProvider(stub.StubJobProvider):
+
+  def __init__(self):
+    super(RecordingStubJobProvider, self).__init__()
+    self.refreshed = []
+
+  def refresh_tasks(self, tasks):
+    self.refreshed.append([task.get_field('task-id') for task in tasks])
+    return super(RecordingStubJobProvider, self).refresh_tasks(tasks)
+
+
+class TestDstatIncremental(unittest.TestCase):
+
+  def chronology(self):
+    self.prov.set_operations([
+        _op('1', 'RUNNING', 'Pending'),
+        _op('2', 'RUNNING', 'Pending'),
+        _op('3', 'SUCCESS', 'Success'),
+    ])
+    yield 1
+    self.prov.set_operations([
+        _op('1', 'RUNNING', 'Running'),
+        _op('2', 'RUNNING', 'Pending'),
+        _op('3', 'SUCCESS', 'Success'),
+    ])
+    yield 1
+    self.prov.set_operations([
+        _op('1', 'SUCCESS', 'Success'),
+        _op('2', 'RUNNING', 'Pending'),
+        _op('3', 'SUCCESS', 'Success'),
+    ])
+    yield 1
+    self.prov.set_operations([
+        _op('1', 'SUCCESS', 'Success'),
+        _op('2', 'FAILURE', 'Failed'),
+        _op('3', 'SUCCESS', 'Success'),
+    ])
+    yield 1
+
+  def poll(self, incremental):
+    self.prov = RecordingStubJobProvider()
+    establish_chronology(self.chronology())
+    return [[(row['task-id'], row['status-message'])
+             for row in event]
+            for event in dstat_command.dstat_job_producer(
+                self.prov, ['*'], poll_interval=1, incremental=incremental)]
+
+  def test_full_polls(self):
+    events = self.poll(False)
+    self.assertEqual(4, len(events))
+    self.assertEqual(3, len(events[-1]))
+    self.assertEqual([], self.prov.refreshed)
+
+  def test_incremental_polls(self):
+    events = self.poll(True)
+    self.assertEqual([
+        [('1', 'Pending'), ('2', 'Pending'), ('3', 'Success')],
+        [('1', 'Running')],
+        [('1', 'Success')],
+        [('2', 'Failed')],
+    ], events)
+    self.assertEqual([['1', '2'], ['1', '2'], ['2']], self.prov.refreshed)
+
+
+class FieldsStubJobProvider(stub.StubJobProvider):
+
+  def __init__(self):
+    super(FieldsStubJobProvider, self).__init__()
+    self.fields = []
+
+  def lookup_job_tasks(self, *args, **kwargs):
+    self.fields.append(kwargs.get('fields'))
+    return super(FieldsStubJobProvider, self).lookup_job_tasks(*args, **kwargs)
+
+
+class TestDstatFields(unittest.TestCase):
+
+  def lookup_fields(self, full_output, raw_format):
+    prov = FieldsStubJobProvider()
+    prov.set_operations([_op('1', 'SUCCESS', 'Success')])
+    list(dstat_command.dstat_job_producer(
+        prov, ['*'], full_output=full_output, raw_format=raw_format))
+    return prov.fields[0]
+
+  def test_short_fields(self):
+    fields = self.lookup_fields(False, False)
+    self.assertIn('status-message', fields)
+    self.assertNotIn('inputs', fields)
+
+  def test_full_fields(self):
+    self.assertIn('inputs', self.lookup_fields(True, False))
+
+  def test_raw_format_fetches_all(self):
+    self.assertIsNone(self.lookup_fields(True, True))
+
+
+class TestDstatStream(unittest.TestCase):
+
+  def setUp(self):
+    self.prov = stub.StubJobProvider()
+    self.prov.set_operations([
+        _op('1', 'RUNNING', 'Pending'),
+        _op('2', 'FAILURE', 'x' * 50),
+    ])
+
+  def stream_output(self, formatter):
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+      for rows in dstat_command.dstat_job_producer(
+          self.prov, ['*'], stream=True):
+        formatter.print_rows(formatter.prepare_output(row) for row in rows)
+      return sys.stdout.getvalue()
+    finally:
+      sys.stdout = stdout
+
+  def test_stream_yields_iterators(self):
+    events = list(
+        dstat_command.dstat_job_producer(self.prov, ['*'], stream=True))
+    self.assertEqual(1, len(events))
+    self.assertNotIsInstance(events[0], list)
+
+  def test_ndjson(self):
+    lines = self.stream_output(
+        dstat_command.NdjsonOutput(False)).splitlines()
+    self.assertEqual(['1', '2'], [json.loads(line)['task-id'] for line in lines])
+
+  def test_yaml_documents(self):
+    docs = list(
+        yaml.safe_load_all(
+            self.stream_output(dstat_command.YamlStreamOutput(False))))
+    self.assertEqual(['1', '2'], [doc['task-id'] for doc in docs])
+
+  def test_fixed_width_text(self):
+    lines = self.stream_output(
+        dstat_command.FixedWidthTextOutput(False)).splitlines()
+    self.assertEqual(5, len(lines))
+    self.assertTrue(lines[0].startswith('Job Name'))
+    self.assertEqual('', lines[-1])
+    # Columns line up, and the long status is trimmed to its column.
+    status_column = lines[0].index('Status')
+    self.assertEqual('Pending', lines[2][status_column:].split()[0])
+    self.assertIn('x' * 27 + '...', lines[3])
+    self.assertNotIn('x' * 28, lines[3])
+
+  def test_fixed_width_text_columns(self):
+    # The first task has no task-id, which is optional in rows.
+    self.prov.set_operations([
+        _op(None, 'RUNNING', 'Pending'),
+        _op('2', 'FAILURE', 'Caf\xc3\xa9 \xff'),
+    ])
+    lines = self.stream_output(
+        dstat_command.FixedWidthTextOutput(False)).splitlines()
+    self.assertEqual(['Job', 'Name', 'Task', 'Status', 'Last', 'Update'],
+                     lines[0].split())
+    task_column = lines[0].index('Task')
+    self.assertEqual('2', lines[3][task_column:].split()[0])
+    self.assertIn(u'Caf\xe9 \ufffd', lines[3].decode('utf-8'))
+
+
+class TestDstatSummary(unittest.TestCase):
+
+  def test_summary(self):
+    prov = FieldsStubJobProvider()
+    ops = [
+        _op('1', 'SUCCESS', 'Success'),
+        _op('2', 'RUNNING', 'Running'),
+        _op('3', 'FAILURE', 'Failed'),
+        _op('4', 'SUCCESS', 'Success'),
+    ]
+    ops.append(dict(_op('1', 'RUNNING', 'Running'), **{'job-id': 'job-2'}))
+    prov.set_operations(ops)
+
+    events = list(
+        dstat_command.dstat_job_producer(prov, ['*'], summary=True))
+    self.assertEqual([[{
+        'job-id': 'job-1',
+        'job-name': 'job',
+        'status': 'FAILURE',
+        'tasks': 4,
+        'running': 1,
+        'success': 2,
+        'failure': 1,
+        'canceled': 0,
+    }, {
+        'job-id': 'job-2',
+        'job-name': 'job',
+        'status': 'RUNNING',
+        'tasks': 1,
+        'running': 1,
+        'success': 0,
+        'failure': 0,
+        'canceled': 0,
+    }]], events)
+    self.assertNotIn('status-message', prov.fields[0])
+
+  def test_text_summary_columns(self):
+    row = dstat_command.TextOutput(False).prepare_summary_output({
+        'job-id': 'job-1',
+        'job-name': 'job',
+        'status': 'SUCCESS',
+        'tasks': 1,
+        'running': 0,
+        'success': 1,
+        'failure': 0,
+        'canceled': 0,
+    })
+    self.assertEqual([
+        'Job ID', 'Job Name', 'Status', 'Tasks', 'Running', 'Succeeded',
+        'Failed', 'Canceled'
+    ], row.keys())
+
+
+if __name__ == '__main__':
+  unittest.main()
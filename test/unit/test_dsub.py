@@ -216,6 +216,112 @@ class TestWaitAfterBatch(unittest.TestCase):
     self.assertEqual(ret, [['failed to frob']])
 
 
+class RecordingStubJobProvider(stub.StubJobProvider):
+
+  def __init__(self):
+    super(RecordingStubJobProvider, self).__init__()
+    self.lookups = 0
+    self.refreshed = []
+
+  def lookup_job_tasks(self, *args, **kwargs):
+    self.lookups += 1
+    return super(RecordingStubJobProvider, self).lookup_job_tasks(
+        *args, **kwargs)
+
+  def refresh_tasks(self, tasks):
+    self.refreshed.append(
+        sorted((t.get_field('job-id'), t.get_field('task-id')) for t in tasks))
+    return super(RecordingStubJobProvider, self).refresh_tasks(tasks)
+
+
+class TestJobStateTracker(unittest.TestCase):
+
+  def set_statuses(self, statuses):
+    self.prov.set_operations([{
+        'job-id': job_id,
+        'task-id': task_id,
+        'status': (status, '123')
+    } for job_id, task_id, status in statuses])
+
+  def progressive_chronology(self):
+    self.set_statuses([('job-1', 'task-1', 'RUNNING'),
+                       ('job-1', 'task-2', 'SUCCESS'),
+                       ('job-2', 'task-1', 'RUNNING'),
+                       ('job-2', 'task-2', 'RUNNING')])
+    yield 1
+    self.set_statuses([('job-1', 'task-1', 'RUNNING'),
+                       ('job-1', 'task-2', 'SUCCESS'),
+                       ('job-2', 'task-1', 'FAILURE'),
+                       ('job-2', 'task-2', 'RUNNING')])
+    yield 1
+    self.set_statuses([('job-1', 'task-1', 'SUCCESS'),
+                       ('job-1', 'task-2', 'SUCCESS'),
+                       ('job-2', 'task-1', 'FAILURE'),
+                       ('job-2', 'task-2', 'RUNNING')])
+    yield 1
+
+  def test_refreshes_only_running_tasks(self):
+    self.prov = RecordingStubJobProvider()
+    establish_chronology(self.progressive_chronology())
+    ret = dsub_command.wait_after(self.prov, ['job-1', 'job-2'], 1, False)
+
+    self.assertEqual(1, len(ret))
+    self.assertEqual(1, self.prov.lookups - len(self.prov.refreshed))
+    # Once job-2 has a failed task, its running task is no longer refreshed.
+    self.assertEqual([
+        [('job-1', 'task-1'), ('job-2', 'task-1'), ('job-2', 'task-2')],
+        [('job-1', 'task-1')],
+        [('job-1', 'task-1')],
+    ], self.prov.refreshed)
+
+  def test_counts(self):
+    self.prov = stub.StubJobProvider()
+    self.set_statuses([('job-1', 'task-1', 'RUNNING'),
+                       ('job-1', 'task-2', 'SUCCESS'),
+                       ('job-1', 'task-3', 'CANCELED')])
+    tracker = dsub_command.JobStateTracker(self.prov, ['job-1'])
+    tracker.poll()
+    self.assertEqual({
+        'running': 1,
+        'failed': 1,
+        'succeeded': 1
+    }, tracker.counts('job-1'))
+    self.assertEqual(set(), tracker.running_jobs())
+    self.assertEqual(
+        'task-3', tracker.dominant_tasks(['job-1'])[0].get_field('task-id'))
+
+
+class TestWaitAfterBackoff(unittest.TestCase):
+
+  def slow_chronology(self):
+    self.prov.set_operations([{
+        'job-id': 'job-1',
+        'task-id': 'task-1',
+        'status': ('RUNNING', '123')
+    }])
+    yield 60
+    self.prov.set_operations([{
+        'job-id': 'job-1',
+        'task-id': 'task-1',
+        'status': ('SUCCESS', '123')
+    }])
+    yield 100
+
+  def polls(self, max_poll_interval):
+    self.prov = RecordingStubJobProvider()
+    establish_chronology(self.slow_chronology())
+    ret = dsub_command.wait_after(
+        self.prov, ['job-1'], 1, True, max_poll_interval=max_poll_interval)
+    self.assertEqual([], ret)
+    return self.prov.lookups
+
+  def test_fixed_interval(self):
+    self.assertEqual(61, self.polls(None))
+
+  def test_backoff_polls_less(self):
+    self.assertLess(self.polls(10), 15)
+
+
 class TestDominantTask(unittest.TestCase):
 
   def test_earliest_failure(self):
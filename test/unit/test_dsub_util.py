@@ -20,12 +20,51 @@ import unittest
 from dsub.lib import dsub_util
 
 
+class FakeDownloader(object):
+  """Writes a fixed list of chunks, one per next_chunk call."""
+
+  def __init__(self, fd, request, chunksize):
+    del request, chunksize  # unused
+    self._fd = fd
+    self._chunks = list(FakeDownloader.chunks)
+
+  def next_chunk(self):
+    self._fd.write(self._chunks.pop(0))
+    return None, not self._chunks
+
+
+class FakeStorageService(object):
+
+  def objects(self):
+    return self
+
+  def get_media(self, bucket, object):  # pylint: disable=redefined-builtin
+    return (bucket, object)
+
+
 class TestDsubUtil(unittest.TestCase):
 
   def testLoadFile(self):
     tsv_file = 'test/testdata/params_tasks.tsv'
     self.assertTrue(dsub_util.load_file(tsv_file))
 
+  def testLoadFileStream(self):
+    tsv_file = 'test/testdata/params_tasks.tsv'
+    with open(tsv_file) as f:
+      expected = f.readlines()
+    self.assertEqual(expected, list(dsub_util.load_file_stream(tsv_file)))
+
+  def testStreamFileFromGcs(self):
+    saved = (dsub_util._get_storage_service, dsub_util.MediaIoBaseDownload)
+    dsub_util._get_storage_service = lambda credentials: FakeStorageService()
+    dsub_util.MediaIoBaseDownload = FakeDownloader
+    FakeDownloader.chunks = ['a\tb\n1\t', '2\n3', '\t4\n', '5\t6']
+    try:
+      lines = list(dsub_util.load_file_stream('gs://bucket/tasks.tsv'))
+    finally:
+      dsub_util._get_storage_service, dsub_util.MediaIoBaseDownload = saved
+    self.assertEqual(['a\tb\n', '1\t2\n', '3\t4\n', '5\t6'], lines)
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,304 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for dsub.lib.gcs_transfer, against a fake Cloud Storage API."""
+
+import base64
+import hashlib
+import json
+import os
+import shutil
+import socket
+import StringIO
+import sys
+import tempfile
+import threading
+import unittest
+import urllib
+import urlparse
+
+from dsub.lib import gcs_transfer
+
+
+class FakeResponse(object):
+
+  def __init__(self, status, body='', headers=None, fail_after=None):
+    self.status = status
+    self._body = StringIO.StringIO(body)
+    self._headers = headers or {}
+    # Number of bytes to return before the connection is reset.
+    self._fail_after = fail_after
+
+  def getheader(self, name):
+    return self._headers.get(name)
+
+  def read(self, size=-1):
+    if self._fail_after is not None:
+      if self._fail_after == 0:
+        raise socket.error(104, 'Connection reset by peer')
+      size = self._fail_after if size < 0 else min(size, self._fail_after)
+      data = self._body.read(size)
+      self._fail_after -= len(data)
+      return data
+    return self._body.read(size)
+
+
+class FakeHttp(object):
+  """Serves the API calls made by gcs_transfer from in-memory buckets."""
+
+  def __init__(self):
+    self.objects = {}
+    self.uploads = {}
+    self.requests = []
+    # (method, path prefix, failure) of requests to fail once. The failure
+    # is ('status', HTTP status), or ('reset', bytes) for a connection reset
+    # after the given number of bytes of the response (at once for uploads).
+    self.failures = []
+    self._lock = threading.Lock()
+
+  def reset(self):
+    pass
+
+  def add_object(self, bucket, name, data):
+    self.objects[(bucket, name)] = data
+
+  def _fail(self, method, path):
+    for failure in self.failures:
+      if failure[0] == method and path.startswith(failure[1]):
+        self.failures.remove(failure)
+        return failure[2]
+    return (None, None)
+
+  def request(self, host, method, path, body=None, headers=None):
+    with self._lock:
+      return self._request(host, method, path, body, headers or {})
+
+  def _request(self, host, method, path, body, headers):
+    if host == gcs_transfer.METADATA_HOST:
+      assert headers['Metadata-Flavor'] == 'Google'
+      return FakeResponse(200,
+                          json.dumps({
+                              'access_token': 'token',
+                              'expires_in': 3600
+                          }))
+    assert headers['Authorization'] == 'Bearer token'
+    self.requests.append((method, path))
+    failure, value = self._fail(method, path)
+    if failure == 'status':
+      return FakeResponse(value, 'Backend Error')
+
+    url = urlparse.urlparse(path)
+    query = dict(urlparse.parse_qsl(url.query))
+    parts = [urllib.unquote(part) for part in url.path.split('/')]
+    if method == 'GET' and query.get('alt') == 'media':
+      data = self.objects[(parts[4], parts[6])]
+      start = int(headers.get('Range', 'bytes=0-')[len('bytes='):-1])
+      return FakeResponse(206 if start else 200, data[start:],
+                          fail_after=value)
+    if method == 'GET':
+      items = [{
+          'name': name,
+          'size': str(len(data)),
+          'md5Hash': base64.b64encode(hashlib.md5(data).digest())
+      } for (bucket, name), data in sorted(self.objects.items())
+               if bucket == parts[4] and name.startswith(query['prefix'])]
+      # One item per page.
+      start = int(query.get('pageToken', 0))
+      page = {'items': items[start:start + 1]}
+      if start + 1 < len(items):
+        page['nextPageToken'] = str(start + 1)
+      return FakeResponse(200, json.dumps(page))
+    if method == 'POST':
+      upload_id = str(len(self.uploads))
+      self.uploads[upload_id] = (parts[5], query['name'], '')
+      return FakeResponse(
+          200,
+          headers={
+              'Location':
+                  'https://%s/upload?upload_id=%s' % (gcs_transfer.API_HOST,
+                                                      upload_id)
+          })
+    if method == 'PUT':
+      bucket, name, received = self.uploads[query['upload_id']]
+      content_range = headers['Content-Range'][len('bytes '):]
+      span, size = content_range.split('/')
+      if span != '*':
+        start = int(span.split('-')[0])
+        assert start == len(received)
+        received += body
+        if failure == 'reset':
+          # The chunk was received, but not the response.
+          self.uploads[query['upload_id']] = (bucket, name, received)
+          raise gcs_transfer._TransientError('Connection reset')
+      self.uploads[query['upload_id']] = (bucket, name, received)
+      if len(received) == int(size):
+        self.objects[(bucket, name)] = received
+        return FakeResponse(200, '{}')
+      headers = {'Range': 'bytes=0-%d' % (len(received) - 1)}
+      return FakeResponse(308, headers=headers if received else None)
+    raise AssertionError('Unexpected request: %s %s' % (method, path))
+
+
+class TestRsync(unittest.TestCase):
+
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.http = FakeHttp()
+    self.storage = gcs_transfer.Storage(self.http)
+    self.sleep = gcs_transfer._sleep
+    gcs_transfer._sleep = lambda seconds: None
+    self.stderr = sys.stderr
+    sys.stderr = StringIO.StringIO()
+
+  def tearDown(self):
+    gcs_transfer._sleep = self.sleep
+    sys.stderr = self.stderr
+    shutil.rmtree(self.root)
+
+  def write_file(self, relative_path, data):
+    path = os.path.join(self.root, relative_path)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+      f.write(data)
+
+  def read_file(self, relative_path):
+    with open(os.path.join(self.root, relative_path)) as f:
+      return f.read()
+
+  def rsync(self, source, destination):
+    if not source.startswith('gs://'):
+      source = os.path.join(self.root, source)
+    if not destination.startswith('gs://'):
+      destination = os.path.join(self.root, destination)
+    return gcs_transfer.rsync(self.storage, source, destination, threads=2)
+
+  def media_requests(self):
+    return [
+        path.split('?')[0] for method, path in self.http.requests
+        if method == 'GET' and path.endswith('alt=media')
+    ]
+
+  def test_download(self):
+    self.http.add_object('bucket', 'dir/a.txt', 'a')
+    self.http.add_object('bucket', 'dir/sub/b.txt', 'b')
+    self.http.add_object('bucket', 'dir/sub/', '')
+    self.http.add_object('bucket', 'other/c.txt', 'c')
+    self.http.add_object('other', 'dir/d.txt', 'd')
+    self.write_file('local/sub/b.txt', 'b')
+
+    self.assertEqual([], self.rsync('gs://bucket/dir', 'local'))
+    self.assertEqual('a', self.read_file('local/a.txt'))
+    self.assertEqual(['a.txt', 'sub'], sorted(os.listdir(self.root + '/local')))
+    self.assertEqual(['/storage/v1/b/bucket/o/dir%2Fa.txt'],
+                     self.media_requests())
+
+  def test_download_resumed(self):
+    data = 'x' * (3 * 1024)
+    self.http.add_object('bucket', 'dir/a.txt', data)
+    self.http.failures = [
+        ('GET', '/storage/v1/b/bucket/o/dir%2Fa.txt', ('reset', 1024)),
+        ('GET', '/storage/v1/b/bucket/o/dir%2Fa.txt', ('status', 503))
+    ]
+
+    self.assertEqual([], self.rsync('gs://bucket/dir/', 'local'))
+    self.assertEqual(data, self.read_file('local/a.txt'))
+    self.assertEqual(['/storage/v1/b/bucket/o/dir%2Fa.txt'] * 3,
+                     self.media_requests())
+    self.assertEqual(['a.txt'], os.listdir(self.root + '/local'))
+
+  def test_download_md5_mismatch(self):
+    self.http.add_object('bucket', 'dir/a.txt', 'a')
+    self.http.add_object('bucket', 'dir/b.txt', 'b')
+    objects = self.storage.list_objects
+    self.storage.list_objects = lambda bucket, prefix: dict(
+        objects(bucket, prefix), **{'dir/b.txt': (1, 'bad')})
+
+    errors = self.rsync('gs://bucket/dir/', 'local')
+    self.assertEqual(1, len(errors))
+    self.assertIn('MD5 hash mismatch', str(errors[0]))
+    self.assertEqual(['a.txt'], os.listdir(self.root + '/local'))
+
+  def test_upload(self):
+    self.write_file('local/a.txt', 'a')
+    self.write_file('local/sub/b.txt', 'b')
+    self.write_file('local/empty.txt', '')
+    self.http.add_object('bucket', 'dir/sub/b.txt', 'b')
+
+    self.assertEqual([], self.rsync('local', 'gs://bucket/dir'))
+    self.assertEqual('a', self.http.objects[('bucket', 'dir/a.txt')])
+    self.assertEqual('', self.http.objects[('bucket', 'dir/empty.txt')])
+    self.assertEqual(['dir/a.txt', 'dir/empty.txt'],
+                     sorted(name for _, name, _ in self.http.uploads.values()))
+
+  def test_upload_resumed(self):
+    gcs_transfer_chunk_size = gcs_transfer._CHUNK_SIZE
+    gcs_transfer._CHUNK_SIZE = 256 * 1024
+    try:
+      data = os.urandom(600 * 1024)
+      self.write_file('local/a.bin', data)
+      self.http.failures = [('PUT', '/upload', ('reset', 0)),
+                            ('PUT', '/upload', ('status', 503))]
+      self.assertEqual([], self.rsync('local', 'gs://bucket/dir/'))
+    finally:
+      gcs_transfer._CHUNK_SIZE = gcs_transfer_chunk_size
+
+    self.assertEqual(data, self.http.objects[('bucket', 'dir/a.bin')])
+    # Sent (the response lost), queried (failed), queried, sent, sent.
+    self.assertEqual(5, len([m for m, _ in self.http.requests if m == 'PUT']))
+
+  def test_permanent_error(self):
+    self.write_file('local/a.txt', 'a')
+    self.http.failures = [('POST', '/upload', ('status', 403))]
+    errors = self.rsync('local', 'gs://bucket/dir/')
+    self.assertEqual(1, len(errors))
+    self.assertIn('HTTP 403', str(errors[0]))
+
+  def test_unexpected_error(self):
+    self.write_file('local/a.txt', 'a')
+    self.write_file('local/b.txt', 'b')
+
+    def upload(path, bucket, name):
+      if path.endswith('a.txt'):
+        raise AttributeError('unexpected')
+      self.http.objects[(bucket, name)] = 'b'
+
+    self.storage.upload = upload
+    errors = self.rsync('local', 'gs://bucket/dir/')
+    self.assertEqual(1, len(errors))
+    self.assertIsInstance(errors[0], AttributeError)
+    self.assertEqual('b', self.http.objects[('bucket', 'dir/b.txt')])
+
+  def test_no_upload_session(self):
+    self.write_file('local/a.txt', 'a')
+    self.storage.list_objects = lambda bucket, prefix: {}
+    self.storage.call = lambda *args, **kwargs: FakeResponse(200)
+    errors = self.rsync('local', 'gs://bucket/dir/')
+    self.assertEqual(1, len(errors))
+    self.assertIn('no upload session URL', str(errors[0]))
+
+  def test_transient_errors_exhausted(self):
+    self.http.add_object('bucket', 'dir/a.txt', 'a')
+    self.http.failures = [('GET', '/storage/v1/b/bucket/o?', ('status', 503))
+                         ] * gcs_transfer._MAX_ATTEMPTS
+    with self.assertRaises(gcs_transfer.TransferError):
+      self.rsync('gs://bucket/dir/', 'local')
+
+  def test_main_usage(self):
+    self.assertEqual(2, gcs_transfer.main(['-m', 'cp', 'a', 'b']))
+    self.assertEqual(1, gcs_transfer.main(['-m', 'rsync', '-r', 'a', 'b']))
+    self.assertIn('Exactly one of a and b', sys.stderr.getvalue())
+
+
+if __name__ == '__main__':
+  unittest.main()
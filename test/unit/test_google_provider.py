@@ -0,0 +1,876 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for the google provider that do not call the Pipelines API."""
+
+import email.utils
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+import apiclient.errors
+from dsub.lib import job_util
+from dsub.lib import journal_util
+from dsub.lib import operation_cache
+from dsub.lib import param_util
+from dsub.lib import timestamp_util
+from dsub.providers import google
+import httplib2
+import parameterized
+
+
+class FakeCredentials(object):
+
+  def authorize(self, http):
+    return http
+
+
+class OfflineGoogleJobProvider(google.GoogleJobProvider):
+  """Google provider with no API service; submission is simulated."""
+
+  def __init__(self, submit_parallelism=1, submit_batch_size=1):
+    super(OfflineGoogleJobProvider, self).__init__(
+        False,
+        False,
+        'my-project',
+        credentials=FakeCredentials(),
+        submit_parallelism=submit_parallelism,
+        submit_batch_size=submit_batch_size)
+    self.submit_threads = set()
+
+  @classmethod
+  def _setup_service(cls, credentials=None):
+    return None
+
+  def _submit_pipeline(self, request, http=None):
+    self.submit_threads.add(threading.current_thread().name)
+    time.sleep(request['delay'])
+    return request['task-id']
+
+
+class TestSubmitPipelines(unittest.TestCase):
+
+  def make_requests(self, count):
+    # Make earlier requests slower so that they complete out of order.
+    return [{
+        'task-id': 'task-%d' % i,
+        'delay': 0.001 * (count - i)
+    } for i in range(1, count + 1)]
+
+  def test_serial_submission(self):
+    prov = OfflineGoogleJobProvider()
+    tasks = list(prov._submit_pipelines(self.make_requests(5)))
+    self.assertEqual(['task-%d' % i for i in range(1, 6)], tasks)
+    self.assertEqual(set([threading.current_thread().name]),
+                     prov.submit_threads)
+
+  def test_parallel_submission_keeps_order(self):
+    prov = OfflineGoogleJobProvider(submit_parallelism=4)
+    tasks = list(prov._submit_pipelines(iter(self.make_requests(50))))
+    self.assertEqual(['task-%d' % i for i in range(1, 51)], tasks)
+    self.assertNotIn(threading.current_thread().name, prov.submit_threads)
+
+  def test_parallelism_minimum(self):
+    prov = OfflineGoogleJobProvider(submit_parallelism=0)
+    self.assertEqual(1, prov._submit_parallelism)
+
+
+def _http_error(status):
+  return apiclient.errors.HttpError(httplib2.Response({'status': status}), '')
+
+
+class FakeBatch(object):
+
+  def __init__(self, service, callback):
+    self._service = service
+    self._callback = callback
+    self._requests = []
+
+  def add(self, request, request_id):
+    self._requests.append((request_id, request))
+
+  def execute(self, http=None):
+    self._service.batches.append([body['task-id'] for _, body in self._requests])
+    for request_id, body in self._requests:
+      failures = self._service.failures.get(body['task-id'])
+      if failures:
+        self._service.failures[body['task-id']] -= 1
+        self._callback(request_id, None, _http_error(body['status']))
+      else:
+        self._callback(request_id, {
+            'name': 'operations/%s' % body['task-id'],
+            'done': False,
+            'metadata': {
+                'labels': {
+                    'task-id': body['task-id']
+                }
+            }
+        }, None)
+
+
+class FakePipelinesService(object):
+  """Service whose pipelines().run() calls can only be sent in a batch."""
+
+  def __init__(self, failures=None):
+    self.failures = failures or {}
+    self.batches = []
+
+  def pipelines(self):
+    return self
+
+  def run(self, body):
+    return body
+
+  def new_batch_http_request(self, callback):
+    return FakeBatch(self, callback)
+
+
+class TestSubmitPipelinesBatch(unittest.TestCase):
+
+  def setUp(self):
+    self.sleeps = []
+    self.saved_sleep = google.SLEEP_FUNCTION
+    google.SLEEP_FUNCTION = self.sleeps.append
+
+  def tearDown(self):
+    google.SLEEP_FUNCTION = self.saved_sleep
+
+  def make_requests(self, count, status=503):
+    return [{
+        'task-id': 'task-%d' % i,
+        'status': status
+    } for i in range(1, count + 1)]
+
+  def test_batches_keep_order(self):
+    service = FakePipelinesService()
+    tasks = google._Pipelines.run_pipelines(service, self.make_requests(3))
+    self.assertEqual(['operations/task-%d' % i for i in range(1, 4)],
+                     [op['name'] for op in tasks])
+    self.assertEqual(1, len(service.batches))
+
+  def test_only_failed_calls_are_resubmitted(self):
+    service = FakePipelinesService(failures={'task-2': 2, 'task-4': 1})
+    ops = google._Pipelines.run_pipelines(service, self.make_requests(5))
+    self.assertEqual(['operations/task-%d' % i for i in range(1, 6)],
+                     [op['name'] for op in ops])
+    self.assertEqual([['task-1', 'task-2', 'task-3', 'task-4', 'task-5'],
+                      ['task-2', 'task-4'], ['task-2']], service.batches)
+    self.assertEqual([1, 2], self.sleeps)
+
+  def test_permanent_failure_raises(self):
+    service = FakePipelinesService(failures={'task-1': 1})
+    with self.assertRaises(google.PipelineBatchError) as context:
+      google._Pipelines.run_pipelines(service, self.make_requests(2, 400))
+    self.assertEqual(1, len(service.batches))
+    self.assertEqual(400, context.exception.error.resp.status)
+    # The operation launched alongside the failed call is returned.
+    self.assertEqual([None, 'operations/task-2'], [
+        op and op['name'] for op in context.exception.operations
+    ])
+
+  def test_retries_exhausted_raises(self):
+    service = FakePipelinesService(
+        failures={'task-2': google._BATCH_MAX_ATTEMPTS})
+    with self.assertRaises(google.PipelineBatchError) as context:
+      google._Pipelines.run_pipelines(service, self.make_requests(3))
+    self.assertEqual(google._BATCH_MAX_ATTEMPTS, len(service.batches))
+    self.assertEqual(['operations/task-1', None, 'operations/task-3'], [
+        op and op['name'] for op in context.exception.operations
+    ])
+
+  def test_provider_groups_requests(self):
+    prov = OfflineGoogleJobProvider(submit_parallelism=2, submit_batch_size=3)
+    prov._service = FakePipelinesService()
+    tasks = list(prov._submit_pipelines(self.make_requests(8)))
+    self.assertEqual(['task-%d' % i for i in range(1, 9)], tasks)
+    self.assertEqual([3, 3, 2], sorted(
+        [len(batch) for batch in prov._service.batches], reverse=True))
+
+  def test_failed_batch_is_journaled(self):
+    journal_dir = tempfile.mkdtemp()
+    try:
+      journal = journal_util.SubmitJournal.create({'job-id': 'job'},
+                                                  'tasks.tsv', journal_dir)
+      prov = OfflineGoogleJobProvider(submit_batch_size=3)
+      prov._service = FakePipelinesService(failures={'task-2': 1})
+      with self.assertRaises(google.PipelineBatchError):
+        list(prov._submit_pipelines(self.make_requests(3, 400), journal))
+
+      journal = journal_util.SubmitJournal.load('job', journal_dir)
+      self.assertEqual([True, False, True],
+                       [journal.is_launched(i) for i in range(1, 4)])
+    finally:
+      shutil.rmtree(journal_dir)
+
+
+class TestPipelineTemplates(unittest.TestCase):
+
+  def setUp(self):
+    self.prov = OfflineGoogleJobProvider()
+    self.job_resources = job_util.JobResources(
+        logging=param_util.build_logging_param('gs://bucket/logs/'),
+        zones=['us-central1-*'],
+        image='ubuntu',
+        scopes=['https://www.googleapis.com/auth/bigquery'])
+    self.job_metadata = self.prov.prepare_job_metadata('script.sh', None, 'me')
+    self.job_metadata['script'] = job_util.Script('script.sh', 'echo hi')
+
+  def make_task_data(self, task_id, input_uri, output_uri, recursive):
+    input_util = param_util.InputFileParamUtil('input')
+    output_util = param_util.OutputFileParamUtil('output')
+    return {
+        'task-id': task_id,
+        'labels': [],
+        'envs': [param_util.EnvParam('SAMPLE', 'sample-%d' % task_id)],
+        'inputs': [input_util.make_param('IN', input_uri, recursive)],
+        'outputs': [output_util.make_param('OUT', output_uri, recursive)],
+    }
+
+  def build_requests(self, all_task_data, use_templates):
+    if use_templates:
+      return list(
+          self.prov._build_pipeline_requests(self.job_resources,
+                                             self.job_metadata, all_task_data))
+    return [
+        self.prov._build_pipeline_request(
+            self.job_resources,
+            dict(self.job_metadata, **{'task-id': task_data['task-id']}),
+            task_data) for task_data in all_task_data
+    ]
+
+  @parameterized.parameterized.expand([
+      ('files', 'gs://in/sample-%d.bam', 'gs://out/sample-%d.txt', False),
+      ('shared_output_dir', 'gs://in/sample-%d.bam', 'gs://out/*.txt', False),
+      ('wildcards', 'gs://in/sample-%d/*.bam', 'gs://out/%d/*.txt', False),
+      ('recursive', 'gs://in/sample-%d/', 'gs://out/sample-%d/', True),
+  ])
+  def test_templates_match_direct_build(self, unused_name, input_fmt,
+                                        output_fmt, recursive):
+
+    def all_task_data():
+      return [
+          self.make_task_data(i, input_fmt.replace('%d', str(i % 3)),
+                              output_fmt.replace('%d', str(i % 2)), recursive)
+          for i in range(1, 7)
+      ]
+
+    self.assertEqual(
+        self.build_requests(all_task_data(), False),
+        self.build_requests(all_task_data(), True))
+
+  def test_alike_tasks_share_template(self):
+    requests = self.build_requests([
+        self.make_task_data(i, 'gs://in/%d.bam' % i, 'gs://out/a.txt', False)
+        for i in range(1, 4)
+    ], True)
+    first, last = requests[0]['ephemeralPipeline'], requests[2][
+        'ephemeralPipeline']
+    self.assertIs(first['docker'], last['docker'])
+    self.assertEqual('input/gs/in/3.bam',
+                     last['inputParameters'][2]['localCopy']['path'])
+    self.assertEqual('sample-3', requests[2]['pipelineArgs']['inputs']['SAMPLE'])
+
+
+def _make_op(job_id, task_id, done=True, user_id='me'):
+  return {
+      'name': 'operations/%s.%s' % (job_id, task_id),
+      'done': done,
+      'metadata': {
+          'request': {
+              '@type': 'type.googleapis.com/'
+                       'google.genomics.v1alpha2.RunPipelineRequest'
+          },
+          'labels': {
+              'job-id': job_id,
+              'job-name': job_id.split('--')[0],
+              'user-id': user_id,
+              'task-id': task_id,
+          },
+      },
+  }
+
+
+class TestSetupGsutil(unittest.TestCase):
+  """Runs the gsutil setup of the docker command, for an image without it."""
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.transfer_path = google._GCS_TRANSFER_PATH
+    google._GCS_TRANSFER_PATH = os.path.join(self.tmp_dir, 'gcs_transfer.py')
+
+  def tearDown(self):
+    google._GCS_TRANSFER_PATH = self.transfer_path
+    shutil.rmtree(self.tmp_dir)
+
+  def test_staged_gcs_transfer(self):
+    setup = google._build_setup_gsutil_command()
+    process = subprocess.Popen(
+        ['bash', '-c', setup + 'gsutil -m cp a b\n'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+
+    self.assertEqual(2, process.returncode)
+    self.assertIn('Usage: gcs_transfer.py', stderr)
+    with open(google._GCS_TRANSFER_PATH) as f:
+      staged = f.read()
+    with open(os.path.splitext(google.gcs_transfer.__file__)[0] + '.py') as f:
+      self.assertEqual(f.read() + '\n', staged)
+
+  def test_only_for_recursive_parameters(self):
+    input_util = param_util.InputFileParamUtil('input')
+    inputs = [input_util.make_param('IN', 'gs://bucket/path/file', False)]
+    self.assertNotIn(
+        'gcs_transfer',
+        google._Pipelines._build_pipeline_docker_command('script.sh', inputs,
+                                                         []))
+
+    inputs.append(input_util.make_param('DIR', 'gs://bucket/dir/', True))
+    self.assertIn(
+        'gcs_transfer',
+        google._Pipelines._build_pipeline_docker_command('script.sh', inputs,
+                                                         []))
+
+
+class FakeListRequest(object):
+
+  def __init__(self, response, service=None):
+    self._response = response
+    self._service = service
+
+  def execute(self, http=None):
+    if self._service:
+      self._service.https.append(http)
+      self._service.in_flight += 1
+      time.sleep(self._service.delay)
+      self._service.in_flight -= 1
+    return self._response
+
+
+class FakeOperationsService(object):
+  """Returns operations in pages, applying only job-id filters."""
+
+  def __init__(self, ops, page_size=2, delay=0):
+    self.ops = ops
+    self.page_size = page_size
+    self.delay = delay
+    self.filters = []
+    self.fields = []
+    self.page_tokens = []
+    self.threads = set()
+    # The Http objects of the requests, and the number of requests running.
+    self.https = []
+    self.in_flight = 0
+
+  def operations(self):
+    return self
+
+  def list(self, name, filter, pageToken, pageSize, fields=None):  # pylint: disable=redefined-builtin
+    del name, pageSize  # unused
+    self.page_tokens.append(pageToken)
+    if not pageToken:
+      self.filters.append(filter)
+      self.fields.append(fields)
+      self.threads.add(threading.current_thread().name)
+
+    # Only job-id filters are applied.
+    ops = self.ops
+    match = re.search(r'labels.job-id = (\S+)', filter)
+    if match:
+      ops = [
+          op for op in ops
+          if op['metadata']['labels']['job-id'] == match.group(1)
+      ]
+
+    start = int(pageToken or 0)
+    response = {'operations': ops[start:start + self.page_size]}
+    if start + self.page_size < len(ops):
+      response['nextPageToken'] = str(start + self.page_size)
+    return FakeListRequest(response, self)
+
+
+class TestLookupPlan(unittest.TestCase):
+
+  JOB_IDS = ['job--me--170102-030405-67', 'job--me--170101-010203-45']
+
+  def test_small_fanout_is_kept(self):
+    plan = google._LookupPlan(['RUNNING', 'FAILURE'], ['*'], self.JOB_IDS,
+                              ['*'], ['*'], None)
+    self.assertEqual(4, plan.fanout())
+    self.assertIsNone(plan.predicate())
+
+  def test_job_ids_collapse_to_create_time(self):
+    job_ids = ['job--me--1701%02d-010203-45' % day for day in range(1, 29)]
+    plan = google._LookupPlan(['RUNNING', 'FAILURE'], ['*'], job_ids, ['*'],
+                              ['*'], None)
+    self.assertEqual(2, plan.fanout())
+    self.assertEqual(set(job_ids), plan.client_filters['job-id'])
+    self.assertEqual(google._job_id_create_time(job_ids[0]), plan.create_time)
+
+  def test_user_create_time_is_kept_if_later(self):
+    job_ids = ['job--me--1701%02d-010203-45' % day for day in range(1, 29)]
+    plan = google._LookupPlan(['*'], ['*'], job_ids, ['*'], ['*'], 2000000000)
+    self.assertEqual(1, plan.fanout())
+    self.assertEqual(2000000000, plan.create_time)
+
+  def test_never_drops_last_narrowing_filter(self):
+    job_ids = ['job-%d' % i for i in range(10)]
+    plan = google._LookupPlan(['RUNNING', 'FAILURE'], ['*'], job_ids, ['*'],
+                              ['*'], None)
+    self.assertEqual(10, plan.fanout())
+    self.assertEqual(['status'], plan.client_filters.keys())
+
+  def test_job_ids_collapse_with_user_filter(self):
+    job_ids = ['job-%d' % i for i in range(10)]
+    plan = google._LookupPlan(['*'], ['me'], job_ids, ['*'], ['*'], None)
+    self.assertEqual(1, plan.fanout())
+    self.assertIsNone(plan.create_time)
+
+  def test_duplicate_values(self):
+    plan = google._LookupPlan(['*'], ['*'], ['a', 'b', 'a'], ['*'], ['*'],
+                              None)
+    self.assertEqual(2, plan.fanout())
+
+  def test_lookup_filters_client_side(self):
+    job_ids = ['job--me--1701%02d-010203-45' % day for day in range(1, 11)]
+    ops = [
+        _make_op(job_id, 'task-%d' % task)
+        for job_id in job_ids + ['other--me--170101-010203-45']
+        for task in range(1, 3)
+    ]
+    prov = OfflineGoogleJobProvider()
+    prov._service = FakeOperationsService(ops)
+
+    tasks = prov.lookup_job_tasks(['*'], job_list=job_ids[:5], task_list=['1'])
+    self.assertEqual(1, len(prov._service.filters))
+    self.assertIn('labels.task-id = task-1', prov._service.filters[0])
+    self.assertNotIn('labels.job-id', prov._service.filters[0])
+    # The fake service ignores the filter, so only job-ids are matched.
+    self.assertEqual(
+        set('%s.task-%d' % (job_id, task)
+            for job_id in job_ids[:5]
+            for task in range(1, 3)),
+        set(task.get_operation_full_job_id() for task in tasks))
+
+    tasks = prov.lookup_job_tasks(['*'], job_list=job_ids[:5], max_tasks=3)
+    self.assertEqual(3, len(tasks))
+
+
+class TestLookupFanout(unittest.TestCase):
+
+  def setUp(self):
+    self.job_ids = ['job-%d' % i for i in range(10)]
+    self.prov = OfflineGoogleJobProvider()
+    self.prov._service = FakeOperationsService(
+        [_make_op(job_id, 'task-1') for job_id in self.job_ids] +
+        [_make_op(job_id, 'task-2') for job_id in self.job_ids])
+
+  def test_parallel_queries_keep_order(self):
+    tasks = self.prov.lookup_job_tasks(['RUNNING', 'SUCCESS'],
+                                       job_list=self.job_ids)
+    # Job-ids without a timestamp can't be collapsed; so one query per job.
+    self.assertEqual(10, len(self.prov._service.filters))
+    self.assertNotIn(threading.current_thread().name,
+                     self.prov._service.threads)
+    self.assertEqual([
+        '%s.task-%d' % (job_id, task)
+        for job_id in self.job_ids
+        for task in range(1, 3)
+    ], [task.get_operation_full_job_id() for task in tasks])
+
+  def test_duplicate_operations_are_merged(self):
+    tasks = self.prov.lookup_job_tasks(
+        ['*'], user_list=['me', 'you'], job_list=self.job_ids[:2])
+    self.assertEqual(4, len(self.prov._service.filters))
+    self.assertEqual(4, len(tasks))
+
+  def test_max_tasks(self):
+    tasks = self.prov.lookup_job_tasks(
+        ['*'], job_list=self.job_ids, max_tasks=3)
+    self.assertEqual(['job-0.task-1', 'job-0.task-2', 'job-1.task-1'],
+                     [task.get_operation_full_job_id() for task in tasks])
+
+
+class TestListPrefetch(unittest.TestCase):
+
+  def setUp(self):
+    self.service = FakeOperationsService(
+        [_make_op('job', 'task-%d' % i) for i in range(7)])
+
+  def test_all_pages(self):
+    ops = google._Operations.list(self.service, 'projectId = my-project')
+    self.assertEqual(['task-%d' % i for i in range(7)],
+                     [op.get_field('task-id') for op in ops])
+    self.assertEqual([None, '2', '4', '6'], self.service.page_tokens)
+
+  def test_next_page_fetched_while_consuming(self):
+    ops = google._Operations.iter_list(self.service, 'projectId = my-project')
+    self.assertEqual('task-0', next(ops).get_field('task-id'))
+    deadline = time.time() + 5
+    while len(self.service.page_tokens) < 2 and time.time() < deadline:
+      time.sleep(0.01)
+    self.assertEqual([None, '2'], self.service.page_tokens)
+    ops.close()
+
+  def test_max_ops_stops_prefetch(self):
+    ops = google._Operations.list(
+        self.service, 'projectId = my-project', max_ops=3)
+    self.assertEqual(3, len(ops))
+    self.assertEqual([None, '2'], self.service.page_tokens)
+
+  def test_prefetch_threads_are_shared(self):
+    google._Operations.list(self.service, 'projectId = my-project')
+    threads = threading.active_count()
+    for _ in range(3):
+      google._Operations.list(self.service, 'projectId = my-project')
+    self.assertEqual(threads, threading.active_count())
+
+  def test_early_stop_waits_for_prefetch(self):
+    self.service.delay = 0.2
+    ops = google._Operations.iter_list(
+        self.service, 'projectId = my-project', predicate=lambda op: True)
+    self.assertEqual('task-0', next(ops).get_field('task-id'))
+    ops.close()
+    self.assertEqual([None, '2'], self.service.page_tokens)
+    self.assertEqual(0, self.service.in_flight)
+
+  def test_listing_has_own_http(self):
+    prov = OfflineGoogleJobProvider()
+    prov._service = self.service
+    prov.lookup_job_tasks(['*'], job_list=['job'])
+    prov.lookup_job_tasks(['*'], job_list=['job'])
+    self.assertNotIn(None, self.service.https)
+    self.assertEqual(2, len(set(self.service.https)))
+
+  def test_errors_are_raised(self):
+    self.service.list = lambda **unused_kwargs: FakeFailingRequest()
+    with self.assertRaises(apiclient.errors.HttpError):
+      list(google._Operations.iter_list(self.service, 'projectId = my-project'))
+
+
+class FakeFailingRequest(object):
+
+  def execute(self, http=None):
+    del http  # unused
+    raise _http_error(400)
+
+
+class TestLookupFields(unittest.TestCase):
+
+  def test_all_fields(self):
+    self.assertIsNone(google._Operations.get_fields(None))
+
+  def test_short_fields_skip_request(self):
+    fields = google._Operations.get_fields(
+        ['job-name', 'task-id', 'last-update', 'status-message'])
+    self.assertTrue(fields.startswith('nextPageToken,operations('))
+    self.assertIn('metadata/labels', fields)
+    self.assertIn('metadata/request/@type', fields)
+    self.assertNotIn('pipelineArgs', fields)
+    self.assertNotIn('ephemeralPipeline', fields)
+
+  def test_full_fields_skip_docker(self):
+    fields = google._Operations.get_fields(['envs', 'inputs', 'outputs'])
+    self.assertEqual(1, fields.count('metadata/request/pipelineArgs/inputs'))
+    self.assertIn('metadata/request/pipelineArgs/outputs', fields)
+    self.assertIn('metadata/request/ephemeralPipeline/inputParameters', fields)
+    self.assertNotIn('docker', fields)
+
+  def test_lookup_passes_fields(self):
+    prov = OfflineGoogleJobProvider()
+    prov._service = FakeOperationsService([_make_op('job-1', 'task-1')])
+    prov.lookup_job_tasks(['*'], job_list=['job-1'], fields=['task-id'])
+    prov.lookup_job_tasks(['*'], job_list=['job-1'])
+    self.assertEqual([google._Operations.get_fields(['task-id']), None],
+                     prov._service.fields)
+
+
+class FakeGetBatch(object):
+
+  def __init__(self, service, callback):
+    self._service = service
+    self._callback = callback
+    self._names = []
+
+  def add(self, name, request_id):
+    self._names.append((request_id, name))
+
+  def execute(self, http=None):
+    self._service.batch_sizes.append(len(self._names))
+    for request_id, name in self._names:
+      if name in self._service.ops:
+        self._callback(request_id, self._service.ops[name], None)
+      else:
+        self._callback(request_id, None, _http_error(404))
+
+
+class FakeGetService(object):
+  """Service whose operations().get() calls can only be sent in a batch."""
+
+  def __init__(self, ops):
+    self.ops = {op['name']: op for op in ops}
+    self.batch_sizes = []
+
+  def operations(self):
+    return self
+
+  def get(self, name):
+    return name
+
+  def new_batch_http_request(self, callback):
+    return FakeGetBatch(self, callback)
+
+
+class TestRefreshTasks(unittest.TestCase):
+
+  def test_refresh_tasks_in_batches(self):
+    tasks = [
+        google.GoogleOperation(_make_op('job', 'task-%d' % i, done=False))
+        for i in range(300)
+    ]
+    prov = OfflineGoogleJobProvider()
+    prov._service = FakeGetService(
+        [_make_op('job', 'task-%d' % i) for i in range(1, 300)])
+
+    refreshed = prov.refresh_tasks(tasks)
+    self.assertEqual([256, 44], prov._service.batch_sizes)
+    # Operations which could not be fetched are returned unchanged.
+    self.assertIs(tasks[0], refreshed[0])
+    self.assertEqual(['RUNNING'] + ['SUCCESS'] * 299,
+                     [task.get_field('task-status') for task in refreshed])
+
+
+def _timed_op(task_id, create_time, done=True):
+  op = _make_op('job', task_id, done=done)
+  op['metadata']['createTime'] = time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                               time.gmtime(create_time))
+  return op
+
+
+class FakeCachedOperationsService(FakeOperationsService):
+  """Also applies createTime filters, and gets operations by name."""
+
+  def __init__(self, ops):
+    super(FakeCachedOperationsService, self).__init__(ops)
+    self.batch_sizes = []
+
+  def list(self, name, filter, pageToken, pageSize, fields=None):  # pylint: disable=redefined-builtin
+    all_ops = self.ops
+    match = re.search(r'createTime >= (\d+)', filter)
+    if match:
+      self.ops = [
+          op for op in all_ops
+          if timestamp_util.parse_rfc3339_utc_seconds(
+              op['metadata']['createTime']) >= int(match.group(1))
+      ]
+    try:
+      return super(FakeCachedOperationsService, self).list(
+          name, filter, pageToken, pageSize, fields)
+    finally:
+      self.ops = all_ops
+
+  def get(self, name):
+    return name
+
+  def new_batch_http_request(self, callback):
+    get_service = FakeGetService(self.ops)
+    get_service.batch_sizes = self.batch_sizes
+    return FakeGetBatch(get_service, callback)
+
+
+class TestOperationCache(unittest.TestCase):
+
+  NOW = 1500000000
+
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    self.prov = OfflineGoogleJobProvider()
+    self.prov._operation_cache = operation_cache.OperationCache(self.cache_dir)
+    self.prov._service = FakeCachedOperationsService([
+        _timed_op('task-0', self.NOW),
+        _timed_op('task-1', self.NOW - 1000),
+        _timed_op('task-2', self.NOW - 1000, done=False),
+    ])
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+
+  def lookup(self, status_list):
+    return [
+        task.get_field('task-id')
+        for task in self.prov.lookup_job_tasks(status_list, job_list=['job'])
+    ]
+
+  def test_only_new_and_running_operations_are_fetched(self):
+    self.assertEqual(['task-2'], self.lookup(['RUNNING']))
+    # The status is matched client-side, so that all operations are cached.
+    self.assertEqual(['projectId = my-project AND labels.job-id = job'],
+                     self.prov._service.filters)
+
+    self.prov._service.ops = [
+        _timed_op('task-3', self.NOW + 1000, done=False),
+        _timed_op('task-0', self.NOW),
+        _timed_op('task-1', self.NOW - 1000),
+        _timed_op('task-2', self.NOW - 1000),
+    ]
+    self.assertEqual(['task-3'], self.lookup(['RUNNING']))
+    self.assertEqual(
+        'projectId = my-project AND labels.job-id = job AND createTime >= %d' %
+        (self.NOW - google._CACHE_CREATE_TIME_MARGIN_SECONDS),
+        self.prov._service.filters[-1])
+    # Only the cached running operation was fetched by name.
+    self.assertEqual([1], self.prov._service.batch_sizes)
+
+    self.assertEqual(['task-3', 'task-0', 'task-1', 'task-2'],
+                     self.lookup(['*']))
+    self.assertEqual(
+        'projectId = my-project AND labels.job-id = job AND createTime >= %d' %
+        (self.NOW + 1000 - google._CACHE_CREATE_TIME_MARGIN_SECONDS),
+        self.prov._service.filters[-1])
+    # The running task-3 is listed again (it is newer than the margin).
+    self.assertEqual([1], self.prov._service.batch_sizes)
+
+  def test_max_tasks(self):
+    tasks = self.prov.lookup_job_tasks(['*'], job_list=['job'], max_tasks=2)
+    self.assertEqual(['task-0', 'task-1'],
+                     [task.get_field('task-id') for task in tasks])
+    # All operations were cached, whatever the limit.
+    self.assertEqual(3, len(self.prov._operation_cache.load(
+        'projectId = my-project AND labels.job-id = job|')[2]))
+
+  def test_age(self):
+    lookup = lambda age: [
+        task.get_field('task-id')
+        for task in self.prov.lookup_job_tasks(
+            ['*'], job_list=['job'], create_time=self.NOW - age)
+    ]
+    self.assertEqual(['task-0'], lookup(500))
+    self.assertEqual(
+        'projectId = my-project AND labels.job-id = job AND createTime >= %d' %
+        (self.NOW - 500), self.prov._service.filters[-1])
+
+    # A later bound is covered by the cache: the age is not part of the query.
+    self.assertEqual(['task-0'], lookup(400))
+    self.assertEqual(
+        'projectId = my-project AND labels.job-id = job AND createTime >= %d' %
+        (self.NOW - google._CACHE_CREATE_TIME_MARGIN_SECONDS),
+        self.prov._service.filters[-1])
+
+    # An earlier bound is listed from the server again.
+    self.assertEqual(['task-0', 'task-1', 'task-2'], lookup(2000))
+    self.assertEqual(
+        'projectId = my-project AND labels.job-id = job AND createTime >= %d' %
+        (self.NOW - 2000), self.prov._service.filters[-1])
+    conn = self.prov._operation_cache._connect()
+    try:
+      self.assertEqual(
+          1,
+          conn.execute('SELECT COUNT(*) FROM queries').fetchone()[0])
+    finally:
+      conn.close()
+
+
+class TestGoogleOperationFields(unittest.TestCase):
+
+  def make_operation(self):
+    op = _make_op('job--me--170101-120000-00', 'task-1')
+    op['metadata']['createTime'] = '2017-01-01T12:00:00.123456Z'
+    op['metadata']['endTime'] = '2017-01-01T13:00:00Z'
+    return google.GoogleOperation(op)
+
+  def test_fields(self):
+    operation = self.make_operation()
+    self.assertEqual('job--me--170101-120000-00', operation.get_field('job-id'))
+    self.assertEqual('task-1', operation.get_field('task-id'))
+    self.assertEqual('SUCCESS', operation.get_field('task-status'))
+    self.assertEqual('Success', operation.get_field('status-message'))
+    self.assertEqual(
+        operation.get_field('end-time'), operation.get_field('last-update'))
+
+  def test_unsupported_field(self):
+    with self.assertRaises(ValueError):
+      self.make_operation().get_field('color')
+
+  def test_datestamps_parsed_once(self):
+    operation = self.make_operation()
+    calls = []
+    localize = google.GoogleOperation._localize_datestamp
+
+    def counting_localize(datestamp):
+      calls.append(datestamp)
+      return localize(datestamp)
+
+    google.GoogleOperation._localize_datestamp = staticmethod(counting_localize)
+    try:
+      for _ in range(2):
+        for field in ['create-time', 'end-time', 'last-update']:
+          operation.get_field(field)
+    finally:
+      google.GoogleOperation._localize_datestamp = staticmethod(localize)
+
+    self.assertEqual(
+        ['2017-01-01T12:00:00.123456Z', '2017-01-01T13:00:00Z'], calls)
+
+  def test_no_instance_dict(self):
+    self.assertFalse(hasattr(self.make_operation(), '__dict__'))
+
+
+class TestApiBackoff(unittest.TestCase):
+
+  def test_throttled_extends_hold(self):
+    backoff = google._ApiBackoff()
+    backoff.throttled()
+    backoff.throttled()
+    self.assertEqual(2, backoff._throttle_count)
+    self.assertGreater(backoff._resume_time, time.time() + 1)
+
+  def test_succeeded_resets_growth(self):
+    backoff = google._ApiBackoff()
+    backoff.throttled()
+    backoff.succeeded()
+    self.assertEqual(0, backoff._throttle_count)
+
+  def test_throttled_honors_retry_after(self):
+    backoff = google._ApiBackoff()
+    backoff.throttled(retry_after=30)
+    self.assertGreater(backoff._resume_time, time.time() + 29)
+
+  def test_retry_after_seconds(self):
+    self.assertEqual(
+        7, google._retry_after_seconds(httplib2.Response({'retry-after': '7'})))
+    self.assertIsNone(google._retry_after_seconds(httplib2.Response({})))
+    self.assertIsNone(
+        google._retry_after_seconds(
+            httplib2.Response({'retry-after': 'soon'})))
+
+  def test_retry_after_date(self):
+    when = email.utils.formatdate(time.time() + 60, usegmt=True)
+    seconds = google._retry_after_seconds(
+        httplib2.Response({'retry-after': when}))
+    self.assertGreater(seconds, 50)
+    self.assertLessEqual(seconds, 60)
+
+  def test_wait_without_hold(self):
+    backoff = google._ApiBackoff()
+    start = time.time()
+    backoff.wait()
+    self.assertLess(time.time() - start, 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,92 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for dsub.lib.journal_util."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from dsub.lib import journal_util
+
+JOB_METADATA = {
+    'job-id': 'script--me--170101-120000-00',
+    'job-name': 'script',
+    'user-id': 'me',
+    'dsub-version': 'v0-1-0',
+    'script': object(),
+}
+
+
+class TestSubmitJournal(unittest.TestCase):
+
+  def setUp(self):
+    self.journal_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.journal_dir)
+
+  def create(self):
+    return journal_util.SubmitJournal.create(
+        JOB_METADATA, 'gs://bucket/tasks.tsv', journal_dir=self.journal_dir)
+
+  def load(self):
+    return journal_util.SubmitJournal.load(
+        JOB_METADATA['job-id'], journal_dir=self.journal_dir)
+
+  def test_record_and_load(self):
+    journal = self.create()
+    journal.record(['task-1', 'task-3'])
+    journal.record(['4', None])
+
+    loaded = self.load()
+    self.assertEqual('gs://bucket/tasks.tsv', loaded.tasks)
+    self.assertNotIn('script', loaded.job_metadata)
+    self.assertEqual(JOB_METADATA['job-id'], loaded.job_metadata['job-id'])
+    for task_id in [1, 3, 4]:
+      self.assertTrue(loaded.is_launched(task_id))
+    self.assertFalse(loaded.is_launched(2))
+
+  def test_unlaunched_tasks(self):
+    self.create().record([1, 2])
+    all_task_data = [{'task-id': i} for i in range(1, 5)]
+    self.assertEqual([{
+        'task-id': 3
+    }, {
+        'task-id': 4
+    }], list(self.load().unlaunched_tasks(all_task_data)))
+
+  def test_partial_last_line_ignored(self):
+    journal = self.create()
+    journal.record([1])
+    path = os.path.join(self.journal_dir, '%s.jsonl' % JOB_METADATA['job-id'])
+    with open(path, 'a') as f:
+      f.write('{"task-i')
+    self.load().record([2])
+    loaded = self.load()
+    self.assertTrue(loaded.is_launched(1))
+    self.assertTrue(loaded.is_launched(2))
+
+  def test_create_existing_fails(self):
+    self.create()
+    with self.assertRaises(ValueError):
+      self.create()
+
+  def test_load_missing_fails(self):
+    with self.assertRaises(ValueError):
+      self.load()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,704 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for the task lookups and runner script of the local provider."""
+
+import distutils.spawn
+import fcntl
+import json
+import os
+import pipes
+import shutil
+import subprocess
+import tempfile
+import textwrap
+import unittest
+
+from dsub.lib import param_util
+from dsub.providers import local
+import yaml
+
+CREATE_TIME = '2017-01-01 12:00:00.000000'
+
+
+class RecordingLocalJobProvider(local.LocalJobProvider):
+  """Local provider rooted in a temporary directory."""
+
+  def __init__(self, root):
+    super(RecordingLocalJobProvider, self).__init__()
+    self.provider_root_cache = root
+    self.read = []
+
+  def _get_task_from_task_dir(self, job_id, user_id, task_id):
+    self.read.append((job_id, task_id))
+    return super(RecordingLocalJobProvider, self)._get_task_from_task_dir(
+        job_id, user_id, task_id)
+
+
+class TestTaskIndex(unittest.TestCase):
+
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.prov = RecordingLocalJobProvider(self.root)
+
+  def tearDown(self):
+    shutil.rmtree(self.root)
+
+  def make_task(self, job_id, task_id, status, labels=None, indexed=True):
+    """Writes the files of a finished task, as the provider and runner do."""
+    task_dir = self.prov._task_directory(job_id, task_id)
+    os.makedirs(task_dir)
+    with open(os.path.join(task_dir, 'status.txt'), 'w') as f:
+      f.write(status + '\n')
+    with open(os.path.join(task_dir, 'status_message.txt'), 'w') as f:
+      f.write('I: Done\n')
+    with open(os.path.join(task_dir, 'task.pid'), 'w') as f:
+      f.write('0\n')
+
+    task_metadata = {
+        'job-id': job_id,
+        'task-id': task_id,
+        'job-name': job_id.split('--')[0],
+        'logging': '/tmp/logs',
+    }
+    task_data = {'labels': labels or []}
+    self.prov._write_task_metadata(task_metadata, task_data, CREATE_TIME)
+    if indexed:
+      self.prov._task_index().set_status(job_id, task_id, status)
+    else:
+      # As if submitted by an earlier version of dsub.
+      os.remove(self.prov._task_index().path)
+
+  def lookup(self, status_list, **kwargs):
+    tasks = self.prov.lookup_job_tasks(status_list, **kwargs)
+    return [(task.get_field('job-id'), task.get_field('task-id'))
+            for task in tasks]
+
+  def test_load_folds_status(self):
+    index = self.prov._task_index()
+    index.add_task({'job-id': 'job-1', 'task-id': 1, 'job-name': 'job'},
+                   CREATE_TIME, {})
+    index.set_status('job-1', 1, 'FAILURE')
+    index.set_status('job-2', None, 'SUCCESS')
+    with open(index.path, 'a') as f:
+      f.write('{"job-id": "job-1", "tas')
+
+    tasks = index.load()
+    self.assertEqual([('job-1', '1')], tasks.keys())
+    self.assertEqual('FAILURE', tasks[('job-1', '1')]['status'])
+
+  def test_load_compacts(self):
+    self.make_task('job-a', 1, 'SUCCESS')
+    self.make_task('job-b', 1, 'SUCCESS')
+    shutil.rmtree(os.path.join(self.root, 'job-b'))
+    index = self.prov._task_index()
+    for _ in range(local._INDEX_COMPACT_MIN_LINES):
+      index.set_status('job-a', 1, 'RUNNING')
+    index.set_status('job-a', 1, 'FAILURE')
+
+    self.assertEqual([('job-a', '1'), ('job-b', '1')], index.load().keys())
+    with open(index.path) as f:
+      self.assertEqual(1, len(f.readlines()))
+    tasks = index.load()
+    self.assertEqual([('job-a', '1')], tasks.keys())
+    self.assertEqual('FAILURE', tasks[('job-a', '1')]['status'])
+
+  def test_lookup_reads_matching_tasks_only(self):
+    self.make_task('job-a', 1, 'SUCCESS')
+    self.make_task('job-a', 2, 'FAILURE')
+    self.make_task('job-b', None, 'SUCCESS',
+                   labels=[param_util.LabelParam('batch', 'one')])
+
+    self.assertEqual([('job-a', '2')], self.lookup(['FAILURE']))
+    self.assertEqual([('job-a', '2')], self.prov.read)
+
+    self.prov.read = []
+    self.assertEqual(
+        [('job-b', None)],
+        self.lookup(['*'], labels=[param_util.LabelParam('batch', 'one')]))
+    self.assertEqual([('job-b', None)], self.prov.read)
+
+    self.prov.read = []
+    self.assertEqual([('job-a', '1')],
+                     self.lookup(['*'], job_list=['job-a'], task_list=['1']))
+    self.assertEqual([('job-a', '1')], self.prov.read)
+
+  def test_unindexed_jobs_are_listed(self):
+    self.make_task('job-a', 1, 'SUCCESS', indexed=False)
+    self.make_task('job-b', 1, 'SUCCESS')
+    self.assertEqual([('job-b', '1'), ('job-a', '1')],
+                     self.lookup(['SUCCESS']))
+
+  def test_state_directories_are_not_jobs(self):
+    self.make_task('job-a', 1, 'SUCCESS')
+    # As left by the runner script of a task.
+    for subdir, filename in [(local.SCHEDULER_SUBDIR, 'scheduler.lock'),
+                             (local.IMAGE_SUBDIR, 'ubuntu.tag'),
+                             (local.INPUT_CACHE_SUBDIR, 'cache.lock')]:
+      state_dir = self.prov._state_directory(subdir)
+      os.makedirs(state_dir)
+      open(os.path.join(state_dir, filename), 'w').close()
+    # As in a job directory of an earlier version of dsub.
+    os.makedirs(os.path.join(self.root, 'job-b'))
+    open(os.path.join(self.root, 'job-b', 'stray.txt'), 'w').close()
+
+    self.assertEqual([('job-a', '1')], self.lookup(['*']))
+
+  def test_runner_status_line(self):
+    index = self.prov._task_index()
+    index.add_task({'job-id': 'it\'s--me', 'task-id': None, 'job-name': 'x'},
+                   CREATE_TIME, {})
+    # As the runner script records a status.
+    subprocess.check_call(
+        [
+            'bash', '-c', 'readonly INDEX_KEY=%s; readonly INDEX_FILE=%s; %s '
+            'set_status SUCCESS' %
+            (pipes.quote(local._TaskIndex.task_key('it\'s--me', None)),
+             pipes.quote(index.path), local._SET_STATUS)
+        ],
+        cwd=self.root)
+    with open(index.path) as f:
+      self.assertEqual({
+          'job-id': 'it\'s--me',
+          'task-id': None,
+          'status': 'SUCCESS'
+      }, json.loads(f.readlines()[-1]))
+    self.assertEqual('SUCCESS', index.load()[('it\'s--me', None)]['status'])
+
+
+class TestTaskMetadata(unittest.TestCase):
+
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.prov = local.LocalJobProvider()
+    self.prov.provider_root_cache = self.root
+    self.task_dir = self.prov._task_directory('job-1', 1)
+    os.makedirs(self.task_dir)
+    self.task_metadata = {
+        'job-id': 'job-1',
+        'task-id': 1,
+        'job-name': 'job',
+        'logging': '/tmp/logs',
+    }
+    self.task_data = {
+        'envs': [param_util.EnvParam('VAR', 'value')],
+        'labels': [param_util.LabelParam('batch', 'one')],
+    }
+
+  def tearDown(self):
+    shutil.rmtree(self.root)
+
+  def test_json_metadata(self):
+    self.prov._write_task_metadata(self.task_metadata, self.task_data,
+                                   CREATE_TIME)
+    self.assertEqual(['meta.json'], os.listdir(self.task_dir))
+
+    meta, _ = self.prov._read_task_metadata(self.task_dir)
+    self.assertEqual('job', meta['job-name'])
+    self.assertEqual(CREATE_TIME, meta['create-time'])
+    self.assertEqual({'VAR': 'value'}, meta['envs'])
+    self.assertEqual('one', meta['labels']['batch'])
+
+  def test_cached_until_modified(self):
+    self.prov._write_task_metadata(self.task_metadata, self.task_data,
+                                   CREATE_TIME)
+    meta, mtime = self.prov._read_task_metadata(self.task_dir)
+    self.assertIs(meta, self.prov._read_task_metadata(self.task_dir)[0])
+
+    os.utime(os.path.join(self.task_dir, 'meta.json'), (mtime + 1, mtime + 1))
+    self.assertIsNot(meta, self.prov._read_task_metadata(self.task_dir)[0])
+
+  def test_yaml_metadata(self):
+    with open(os.path.join(self.task_dir, 'meta.yaml'), 'w') as f:
+      f.write(yaml.dump({'job-name': 'job', 'create-time': CREATE_TIME}))
+    meta, _ = self.prov._read_task_metadata(self.task_dir)
+    self.assertEqual('job', meta['job-name'])
+
+  def test_missing_metadata(self):
+    with self.assertRaises(IOError):
+      self.prov._read_task_metadata(self.task_dir)
+
+
+@unittest.skipUnless(
+    distutils.spawn.find_executable('flock'), 'requires the flock command')
+class TestWaitForCapacity(unittest.TestCase):
+  """Runs the wait_for_capacity function of the runner script."""
+
+  def setUp(self):
+    self.task_dir = tempfile.mkdtemp()
+    self.scheduler_dir = os.path.join(self.task_dir, 'scheduler')
+    os.makedirs(self.scheduler_dir)
+    self.running = []
+
+  def tearDown(self):
+    for f in self.running:
+      f.close()
+    shutil.rmtree(self.task_dir)
+
+  def reserve(self, name, cores, ram_mb, running=True):
+    """Adds a reservation, held by this process if the task is running."""
+    f = open(os.path.join(self.scheduler_dir, name + '.task'), 'w')
+    f.write('%d %d\n' % (cores, ram_mb))
+    f.flush()
+    if running:
+      fcntl.flock(f, fcntl.LOCK_EX)
+      self.running.append(f)
+    else:
+      f.close()
+
+  def wait(self, max_concurrent_tasks=0):
+    """Waits for a task of 2 cores and 1 GB on a host of 4 cores and 4 GB.
+
+    Args:
+      max_concurrent_tasks: the --max-concurrent-tasks of the task.
+
+    Returns:
+      The exit code of the runner (124 if still queued after half a second)
+      and the last status it set.
+    """
+    script = textwrap.dedent("""\
+        readonly NAME='task'
+        readonly SCHEDULER_DIR=%s
+        readonly SCHEDULER_POLL_SECONDS=0.1
+        readonly MAX_CONCURRENT_TASKS=%d
+        readonly HOST_CORES=4
+        readonly HOST_RAM_MB=4096
+        readonly TASK_CORES=2
+        readonly TASK_RAM_MB=1024
+        set_status() { echo "$1" > status.txt; }
+        log_info() { true; }
+        cleanup() { true; }
+        """) % (pipes.quote(self.scheduler_dir), max_concurrent_tasks)
+    script += local._WAIT_FOR_CAPACITY + textwrap.dedent("""\
+        set_status QUEUED
+        wait_for_capacity
+        set_status RUNNING
+        """)
+    returncode = subprocess.call(
+        ['timeout', '0.5', 'bash', '-c', script], cwd=self.task_dir)
+    with open(os.path.join(self.task_dir, 'status.txt')) as f:
+      return returncode, f.read().strip()
+
+  def test_admitted_alongside_running_tasks(self):
+    self.reserve('running', 2, 1024)
+    self.reserve('killed', 4, 4096, running=False)
+    self.assertEqual((0, 'RUNNING'), self.wait())
+    self.assertEqual(['running.task', 'task.task'], [
+        name for name in sorted(os.listdir(self.scheduler_dir))
+        if name.endswith('.task')
+    ])
+    with open(os.path.join(self.scheduler_dir, 'task.task')) as f:
+      self.assertEqual('2 1024', f.read().strip())
+
+  def test_queued_without_cores(self):
+    self.reserve('running', 3, 0)
+    self.assertEqual((124, 'QUEUED'), self.wait())
+
+  def test_queued_without_ram(self):
+    self.reserve('running', 0, 3500)
+    self.assertEqual((124, 'QUEUED'), self.wait())
+
+  def test_max_concurrent_tasks(self):
+    self.reserve('running', 0, 0)
+    self.assertEqual((124, 'QUEUED'), self.wait(max_concurrent_tasks=1))
+    self.assertEqual((0, 'RUNNING'), self.wait(max_concurrent_tasks=2))
+
+  def test_oversized_task_runs_alone(self):
+    self.reserve('killed', 8, 0, running=False)
+    self.assertEqual((0, 'RUNNING'), self.wait(max_concurrent_tasks=1))
+
+  def test_canceled_while_queued(self):
+    self.reserve('running', 4, 0)
+    open(os.path.join(self.task_dir, 'die'), 'w').close()
+    self.assertEqual((1, 'CANCELED'), self.wait())
+
+
+class TestResolveImage(unittest.TestCase):
+  """Runs the image functions of the runner script, with a fake docker."""
+
+  def setUp(self):
+    self.task_dir = tempfile.mkdtemp()
+    self.bin_dir = os.path.join(self.task_dir, 'bin')
+    os.makedirs(self.bin_dir)
+    self.calls = os.path.join(self.task_dir, 'calls.txt')
+    self.image_id = os.path.join(self.task_dir, 'image-id.txt')
+    self.set_image_id('sha256:1234')
+
+    # docker and gcloud record the commands they are given.
+    self.write_command(
+        'docker',
+        textwrap.dedent("""\
+            #!/bin/bash
+            echo "$1" >> %s
+            case "$1" in
+              inspect) cat %s ;;
+              run) echo "1000:1000" ;;
+            esac
+            """) % (pipes.quote(self.calls), pipes.quote(self.image_id)))
+    self.write_command(
+        'gcloud',
+        textwrap.dedent("""\
+            #!/bin/bash
+            sleep 0.2
+            echo "$3" >> %s
+            """) % pipes.quote(self.calls))
+
+  def tearDown(self):
+    shutil.rmtree(self.task_dir)
+
+  def write_command(self, name, text):
+    path = os.path.join(self.bin_dir, name)
+    with open(path, 'w') as f:
+      f.write(text)
+    os.chmod(path, 0700)
+
+  def set_image_id(self, image_id):
+    with open(self.image_id, 'w') as f:
+      f.write(image_id + '\n')
+
+  def start_task(self, image, job_id):
+    script = textwrap.dedent("""\
+        readonly JOB_ID=%s
+        readonly NAME='task'
+        readonly IMAGE=%s
+        readonly IMAGE_CACHE_DIR=%s
+        log_info() { true; }
+        log_error() { true; }
+        """) % (pipes.quote(job_id), pipes.quote(image),
+                pipes.quote(os.path.join(self.task_dir, 'images')))
+    script += local._RESOLVE_IMAGE + 'resolve_image\nget_docker_user\n'
+    env = dict(os.environ)
+    env['PATH'] = self.bin_dir + os.pathsep + env['PATH']
+    return subprocess.Popen(
+        ['bash', '-c', script],
+        cwd=self.task_dir,
+        env=env,
+        stdout=subprocess.PIPE)
+
+  def read_calls(self):
+    if not os.path.exists(self.calls):
+      return []
+    with open(self.calls) as f:
+      calls = f.read().split()
+    os.remove(self.calls)
+    return calls
+
+  def run_task(self, image='ubuntu', job_id='job-1'):
+    """Returns the docker user of the task and the commands it ran."""
+    output, _ = self.start_task(image, job_id).communicate()
+    return output.strip(), self.read_calls()
+
+  def test_resolved_once_per_job(self):
+    self.assertEqual(('1000:1000', ['inspect', 'run']), self.run_task())
+    self.assertEqual(('1000:1000', []), self.run_task())
+
+    # The user is cached by image ID.
+    self.assertEqual(('1000:1000', ['inspect']), self.run_task(job_id='job-2'))
+    self.set_image_id('sha256:5678')
+    self.assertEqual(('1000:1000', ['inspect', 'run']),
+                     self.run_task(job_id='job-3'))
+
+  def test_gcr_image_pulled_once_per_job(self):
+    image = 'gcr.io/project/image'
+    self.assertEqual(('1000:1000', ['pull', 'inspect', 'run']),
+                     self.run_task(image))
+    self.assertEqual(('1000:1000', []), self.run_task(image))
+    self.assertEqual(('1000:1000', ['pull', 'inspect']),
+                     self.run_task(image, job_id='job-2'))
+
+  def test_image_named_by_digest_not_pulled(self):
+    self.assertEqual(('1000:1000', ['inspect', 'inspect', 'run']),
+                     self.run_task('gcr.io/project/image@sha256:1234'))
+
+  def test_not_cached_without_image_id(self):
+    self.set_image_id('')
+    self.assertEqual(('1000:1000', ['inspect', 'run', 'inspect']),
+                     self.run_task())
+    self.assertEqual(('1000:1000', ['inspect', 'run', 'inspect']),
+                     self.run_task())
+
+  @unittest.skipUnless(
+      distutils.spawn.find_executable('flock'), 'requires the flock command')
+  def test_concurrent_tasks_pull_once(self):
+    tasks = [self.start_task('gcr.io/project/image', 'job-1') for _ in range(5)]
+    for task in tasks:
+      self.assertEqual('1000:1000', task.communicate()[0].strip())
+    self.assertEqual(1, self.read_calls().count('pull'))
+
+  def test_run_and_chown(self):
+    user_script = os.path.join(self.task_dir, 'script.sh')
+    with open(user_script, 'w') as f:
+      f.write('#!/bin/bash\necho out > "$(dirname "$0")/out.txt"\nexit 3\n')
+    os.chmod(user_script, 0700)
+
+    script = local._RUN_AND_CHOWN + (
+        'sh -c "${RUN_AND_CHOWN}" run_and_chown %s "$(id -u):$(id -g)" %s' %
+        (pipes.quote(user_script), pipes.quote(self.task_dir)))
+    self.assertEqual(3, subprocess.call(['bash', '-c', script]))
+    self.assertTrue(os.path.exists(os.path.join(self.task_dir, 'out.txt')))
+
+
+class TestTransfer(unittest.TestCase):
+  """Runs the transfer functions of the runner script."""
+
+  def setUp(self):
+    self.task_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.task_dir)
+
+  def run_script(self, text, env=None):
+    script = textwrap.dedent("""\
+        set -o nounset
+        readonly TRANSFER_PARALLELISM=2
+        log_info() { true; }
+        """) + local._TRANSFER + textwrap.dedent(text)
+    return subprocess.call(['bash', '-c', script], cwd=self.task_dir, env=env)
+
+  def read_lines(self, filename):
+    with open(os.path.join(self.task_dir, filename)) as f:
+      return f.read().splitlines()
+
+  def test_parallelism(self):
+    self.assertEqual(0, self.run_script("""\
+        mkdir running
+        copy() {
+          touch "running/$1"
+          ls running | wc -l >> counts.txt
+          sleep 0.2
+          rm "running/$1"
+        }
+        for i in 1 2 3 4 5; do
+          start_transfer copy "${i}"
+        done
+        wait_transfers
+        """))
+    counts = [int(count) for count in self.read_lines('counts.txt')]
+    self.assertEqual(5, len(counts))
+    self.assertEqual(2, max(counts))
+
+  def test_slow_copy_does_not_hold_back_others(self):
+    # The slow copy waits (for up to 5 seconds) for the last one to be done.
+    self.assertEqual(0, self.run_script("""\
+        copy() {
+          sleep 0.1
+          touch "$1"
+        }
+        slow_copy() {
+          for ((i = 0; i < 50; i++)); do
+            [[ -e last ]] && return
+            sleep 0.1
+          done
+          return 1
+        }
+        start_transfer slow_copy
+        for i in 1 2 3 4 last; do
+          start_transfer copy "${i}"
+        done
+        wait_transfers
+        """))
+
+  def test_retried_once(self):
+    script = """\
+        copy() {
+          echo "$1" >> attempts.txt
+          [[ -e "$1" ]] || { touch "$1" 2> /dev/null; false; }
+        }
+        start_transfer copy %s
+        start_transfer true
+        wait_transfers
+        """
+    self.assertEqual(0, self.run_script(script % 'flaky'))
+    self.assertEqual(['flaky', 'flaky'], self.read_lines('attempts.txt'))
+
+    os.remove(os.path.join(self.task_dir, 'attempts.txt'))
+    self.assertEqual(1, self.run_script(script % 'missing/file'))
+    self.assertEqual(['missing/file'] * 2, self.read_lines('attempts.txt'))
+
+  def test_copy_files(self):
+    bin_dir = os.path.join(self.task_dir, 'bin')
+    os.makedirs(bin_dir)
+    gsutil = os.path.join(bin_dir, 'gsutil')
+    with open(gsutil, 'w') as f:
+      f.write('#!/bin/bash\necho "$@" > args.txt\ncat > manifest.txt\n')
+    os.chmod(gsutil, 0700)
+    env = dict(os.environ)
+    env['PATH'] = bin_dir + os.pathsep + env['PATH']
+
+    self.assertEqual(0, self.run_script(
+        'copy_files dest/ "gs://bucket/a b" "gs://bucket/*.txt"', env=env))
+    self.assertEqual(['-m -q cp -I dest/'], self.read_lines('args.txt'))
+    self.assertEqual(['gs://bucket/a b', 'gs://bucket/*.txt'],
+                     self.read_lines('manifest.txt'))
+
+
+@unittest.skipUnless(
+    distutils.spawn.find_executable('flock') and
+    distutils.spawn.find_executable('sha1sum'),
+    'requires the flock and sha1sum commands')
+class TestLocalizeInput(unittest.TestCase):
+  """Runs the localize_input function of the runner script, with a fake GCS."""
+
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.bin_dir = os.path.join(self.root, 'bin')
+    self.bucket_dir = os.path.join(self.root, 'bucket')
+    self.cache_dir = os.path.join(self.root, 'inputs')
+    self.data_dir = os.path.join(self.root, 'data')
+    for path in [self.bin_dir, self.bucket_dir, self.data_dir]:
+      os.makedirs(path)
+    self.calls = os.path.join(self.root, 'calls.txt')
+
+    # gsutil serves gs://bucket/<name> from bucket/<name>, with a generation
+    # and MD5 hash in bucket/<name>.stat, and records the commands it is given.
+    gsutil = os.path.join(self.bin_dir, 'gsutil')
+    with open(gsutil, 'w') as f:
+      f.write(
+          textwrap.dedent("""\
+              #!/bin/bash
+              echo "$2" >> %(calls)s
+              source="${3/#gs:\/\/bucket/%(bucket)s}"
+              case "$2" in
+                stat) cat "${source}.stat" ;;
+                cp) cp "${source}" "$4" ;;
+              esac
+              """) % {'calls': self.calls, 'bucket': self.bucket_dir})
+    os.chmod(gsutil, 0700)
+
+  def tearDown(self):
+    for dirpath, _, _ in os.walk(self.root):
+      os.chmod(dirpath, 0700)
+    shutil.rmtree(self.root)
+
+  def write_object(self, name, text, md5=None, generation=1):
+    with open(os.path.join(self.bucket_dir, name), 'w') as f:
+      f.write(text)
+    with open(os.path.join(self.bucket_dir, name + '.stat'), 'w') as f:
+      f.write('gs://bucket/%s:\n' % name)
+      f.write('    Content-Length:         %d\n' % len(text))
+      if md5:
+        f.write('    Hash (md5):             %s\n' % md5)
+      f.write('    Generation:             %d\n' % generation)
+
+  def localize(self, source, target, max_mb=1, file_provider=None):
+    """Localizes the source (by default gs://bucket/<source>).
+
+    Args:
+      source: name of the object in gs://bucket, or path of the local file.
+      target: path of the input in the data directory.
+      max_mb: INPUT_CACHE_MAX_MB of the task.
+      file_provider: "local" if the source is a local file.
+
+    Returns:
+      The gsutil commands run.
+    """
+    if os.path.exists(self.calls):
+      os.remove(self.calls)
+    if not file_provider:
+      file_provider = 'google-cloud-storage'
+      source = 'gs://bucket/' + source
+    script = textwrap.dedent("""\
+        set -o errexit
+        readonly INPUT_CACHE_DIR=%s
+        readonly INPUT_CACHE_MAX_MB=%d
+        """) % (pipes.quote(self.cache_dir), max_mb)
+    script += local._LOCALIZE_INPUT + 'localize_input %s %s %s\n' % (
+        file_provider, pipes.quote(source),
+        pipes.quote(os.path.join(self.data_dir, target)))
+    env = dict(os.environ)
+    env['PATH'] = self.bin_dir + os.pathsep + env['PATH']
+    subprocess.check_call(['bash', '-c', script], env=env)
+    if not os.path.exists(self.calls):
+      return []
+    with open(self.calls) as f:
+      return f.read().split()
+
+  def read_target(self, target):
+    with open(os.path.join(self.data_dir, target)) as f:
+      return f.read()
+
+  def cache_entries(self):
+    return sorted(
+        name for name in os.listdir(self.cache_dir) if '.' not in name)
+
+  def test_copied_once_per_content(self):
+    self.write_object('ref.fa', 'ACGT', md5='md5-1')
+    self.write_object('copy.fa', 'ACGT', md5='md5-1')
+    self.assertEqual(['stat', 'cp'], self.localize('ref.fa', 'a.fa'))
+    self.assertEqual(['stat'], self.localize('ref.fa', 'b.fa'))
+    self.assertEqual(['stat'], self.localize('copy.fa', 'c.fa'))
+
+    self.assertEqual('ACGT', self.read_target('c.fa'))
+    self.assertEqual(1, len(self.cache_entries()))
+    entry = os.path.join(self.cache_dir, self.cache_entries()[0])
+    target = os.path.join(self.data_dir, 'c.fa')
+    self.assertFalse(os.path.samefile(entry, target))
+    self.assertFalse(os.stat(entry).st_mode & 0222)
+
+    self.write_object('ref.fa', 'TTTT', md5='md5-2')
+    self.assertEqual(['stat', 'cp'], self.localize('ref.fa', 'd.fa'))
+    self.assertEqual('TTTT', self.read_target('d.fa'))
+
+  def test_task_cannot_modify_cache(self):
+    self.write_object('ref.fa', 'ACGT', md5='md5-1')
+    self.localize('ref.fa', 'a.fa')
+    # As a task running as root, or as the owner of its data, changes its input.
+    subprocess.check_call(
+        ['bash', '-c', 'chmod u+w a.fa && echo TTTT > a.fa'], cwd=self.data_dir)
+
+    self.assertEqual(['stat'], self.localize('ref.fa', 'b.fa'))
+    self.assertEqual('ACGT', self.read_target('b.fa'))
+
+  def test_composite_object_keyed_by_generation(self):
+    self.write_object('ref.fa', 'ACGT')
+    self.assertEqual(['stat', 'cp'], self.localize('ref.fa', 'a.fa'))
+    self.assertEqual(['stat'], self.localize('ref.fa', 'b.fa'))
+    self.write_object('ref.fa', 'TTTT', generation=2)
+    self.assertEqual(['stat', 'cp'], self.localize('ref.fa', 'c.fa'))
+    self.assertEqual('TTTT', self.read_target('c.fa'))
+
+  def test_local_file_keyed_by_mtime(self):
+    path = os.path.join(self.bucket_dir, 'ref.fa')
+    self.write_object('ref.fa', 'ACGT')
+    self.assertEqual(['cp'], self.localize(path, 'a.fa', file_provider='local'))
+    self.assertEqual([], self.localize(path, 'b.fa', file_provider='local'))
+    os.utime(path, (0, 0))
+    self.assertEqual(['cp'], self.localize(path, 'c.fa', file_provider='local'))
+
+  def test_least_recently_used_evicted(self):
+    for name in ['a', 'b', 'c']:
+      self.write_object(name, name * (400 * 1024), md5=name)
+    self.localize('a', 'a')
+    self.localize('b', 'b')
+    entry_a = os.path.join(self.cache_dir, self.cache_entries()[0])
+    os.utime(entry_a + '.used', (0, 0))
+    self.localize('c', 'c')
+
+    self.assertEqual(2, len(self.cache_entries()))
+    self.assertFalse(os.path.exists(entry_a))
+    self.assertFalse(os.path.exists(entry_a + '.lock'))
+    self.assertEqual(['cache.lock'], [
+        name for name in os.listdir(self.cache_dir)
+        if name.split('.')[0] not in self.cache_entries()
+    ])
+    self.assertEqual('a' * (400 * 1024), self.read_target('a'))
+
+  def test_no_cache(self):
+    self.write_object('ref.fa', 'ACGT', md5='md5-1')
+    self.assertEqual(['cp'], self.localize('ref.fa', 'a.fa', max_mb=0))
+    self.assertEqual(['cp'], self.localize('ref.fa', 'b.fa', max_mb=0))
+    self.assertFalse(os.path.exists(self.cache_dir))
+
+
+if __name__ == '__main__':
+  unittest.main()
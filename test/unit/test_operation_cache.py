@@ -0,0 +1,105 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for dsub.lib.operation_cache."""
+
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+from dsub.lib import operation_cache
+
+
+def _op(name, done):
+  return {'name': name, 'done': done}
+
+
+class TestOperationCache(unittest.TestCase):
+
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    self.cache = operation_cache.OperationCache(self.cache_dir)
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+
+  def test_unknown_query(self):
+    self.assertEqual((None, None, []), self.cache.load('query'))
+
+  def test_store_and_load(self):
+    self.cache.store('query', [('a', 100, True, _op('a', True)),
+                               ('b', 200, False, _op('b', False))], 200)
+    self.cache.store('other', [('c', 300, True, _op('c', True))], 300, 250)
+    # Operations are replaced by name; the newest is listed first.
+    self.cache.store('query', [('b', 200, True, _op('b', True))], 200)
+
+    # A new cache object reads the same database.
+    cache = operation_cache.OperationCache(self.cache_dir)
+    self.assertEqual((200, None, [_op('b', True), _op('a', True)]),
+                     cache.load('query'))
+    self.assertEqual((300, 250, [_op('c', True)]), cache.load('other'))
+
+  def test_empty_query_is_stored(self):
+    self.cache.store('query', [], None)
+    self.cache.store('other', [], 100)
+    self.assertEqual((None, None, []), self.cache.load('query'))
+    self.assertEqual((100, None, []), self.cache.load('other'))
+
+  def test_unused_queries_expire(self):
+    self.cache.store('old', [('a', 100, True, _op('a', True))], 100)
+    conn = self.cache._connect()
+    with conn:
+      conn.execute('UPDATE queries SET last_used = 0')
+    conn.close()
+
+    self.cache.store('new', [], None)
+    self.assertEqual((None, None, []), self.cache.load('old'))
+
+  def test_least_recently_used_queries_expire(self):
+    self.cache.store('old', [('a', 100, True, _op('a', True))], 100)
+    conn = self.cache._connect()
+    with conn:
+      conn.execute('UPDATE queries SET last_used = last_used - 1')
+    conn.close()
+
+    for i in range(operation_cache._MAX_QUERIES):
+      self.cache.store('new-%d' % i, [], None)
+    self.assertEqual((None, None, []), self.cache.load('old'))
+    conn = self.cache._connect()
+    try:
+      self.assertEqual(
+          [(operation_cache._MAX_QUERIES, 0)],
+          conn.execute('SELECT (SELECT COUNT(*) FROM queries), '
+                       '(SELECT COUNT(*) FROM operations)').fetchall())
+    finally:
+      conn.close()
+
+  def test_unreadable_cache_is_empty(self):
+    with open(os.path.join(self.cache_dir, 'operations.db'), 'w') as f:
+      f.write('not a database' * 100)
+
+    stderr = sys.stderr
+    sys.stderr = StringIO.StringIO()
+    try:
+      self.cache.store('query', [('a', 100, True, _op('a', True))], 100)
+      self.assertEqual((None, None, []), self.cache.load('query'))
+      self.assertIn('Warning: operation cache', sys.stderr.getvalue())
+    finally:
+      sys.stderr = stderr
+
+
+if __name__ == '__main__':
+  unittest.main()
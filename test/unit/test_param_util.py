@@ -111,6 +111,27 @@ class ParamUtilTest(unittest.TestCase):
       self.assertEqual('output/gs/outputs/results-00%d/' % i,
                        job_data['outputs'][0].docker_path)
 
+  def testTasksFileToJobDataStream(self):
+    input_file_param_util = param_util.InputFileParamUtil('input')
+    output_file_param_util = param_util.OutputFileParamUtil('output')
+    job_data_stream = param_util.tasks_file_to_job_data_stream({
+        'path': 'test/testdata/params_tasks.tsv',
+        'min': 2,
+        'max': 3
+    }, input_file_param_util, output_file_param_util)
+    self.assertEqual(2, next(job_data_stream)['task-id'])
+    self.assertEqual([3], [job_data['task-id'] for job_data in job_data_stream])
+
+  def testTasksFileToJobDataStreamNoTasks(self):
+    input_file_param_util = param_util.InputFileParamUtil('input')
+    output_file_param_util = param_util.OutputFileParamUtil('output')
+    job_data_stream = param_util.tasks_file_to_job_data_stream({
+        'path': 'test/testdata/params_tasks.tsv',
+        'min': 10
+    }, input_file_param_util, output_file_param_util)
+    with self.assertRaisesRegexp(ValueError, 'No tasks added'):
+      list(job_data_stream)
+
   # Fixed values for age_to_create_time
   fixed_time = datetime.datetime(2017, 1, 1)
   fixed_time_utc = int(
@@ -354,6 +375,20 @@ class TestSubmitValidator(unittest.TestCase):
           output_providers=outwl,
           logging_providers=logwl)
 
+  def test_validated_task_data_is_lazy(self):
+    resources = job_util.JobResources(logging=param_util.LoggingParam(
+        'gs://buck/logs', PG))
+    task_data = param_util.validated_task_data(
+        job_resources=resources,
+        all_task_data=iter(self.task_data),
+        provider_name='MYPROVIDER',
+        input_providers=[PG],
+        output_providers=[PL],
+        logging_providers=[PG])
+    self.assertEqual(self.task_data[0], next(task_data))
+    with self.assertRaisesRegexp(ValueError, 'Unsupported output path'):
+      next(task_data)
+
 
 class TestParamUtilDocs(unittest.TestCase):
 
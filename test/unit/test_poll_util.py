@@ -0,0 +1,59 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for dsub.lib.poll_util."""
+
+import unittest
+
+from dsub.lib import poll_util
+
+
+def no_jitter(a, b):
+  del a, b  # Unused
+  return 0
+
+
+class TestPollScheduler(unittest.TestCase):
+
+  def test_fixed_interval(self):
+    scheduler = poll_util.PollScheduler(10)
+    self.assertFalse(scheduler.adaptive)
+    self.assertEqual([10, 10, 10],
+                     [scheduler.next_interval(False) for _ in range(3)])
+
+  def test_max_below_min_is_fixed(self):
+    scheduler = poll_util.PollScheduler(10, 5)
+    self.assertFalse(scheduler.adaptive)
+    self.assertEqual(10, scheduler.next_interval(False))
+
+  def test_backoff_and_reset(self):
+    scheduler = poll_util.PollScheduler(2, 5, random_function=no_jitter)
+    intervals = [scheduler.next_interval(changed)
+                 for changed in [True, False, False, False, True, False]]
+    self.assertEqual([2, 3, 4.5, 5, 2, 3], intervals)
+
+  def test_first_interval_is_minimum(self):
+    scheduler = poll_util.PollScheduler(2, 5, random_function=no_jitter)
+    self.assertEqual(2, scheduler.next_interval(False))
+
+  def test_jitter(self):
+    scheduler = poll_util.PollScheduler(
+        10, 60, random_function=lambda a, b: b)
+    self.assertAlmostEqual(11, scheduler.next_interval(True))
+    scheduler = poll_util.PollScheduler(
+        10, 60, random_function=lambda a, b: a)
+    self.assertAlmostEqual(9, scheduler.next_interval(True))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,102 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for dsub.lib.providers_util."""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from dsub.lib import param_util
+from dsub.lib import providers_util
+
+
+class TestRecursiveCopyCommands(unittest.TestCase):
+  """Runs the recursive copy commands, with a fake rsync."""
+
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.bin_dir = os.path.join(self.root, 'bin')
+    os.makedirs(self.bin_dir)
+    # rsync records its source, and fails for sources named "missing". For
+    # sources named "slow", it waits (for up to 5 seconds) for the source
+    # named "last" to be copied, and fails if it was not.
+    rsync = os.path.join(self.bin_dir, 'rsync')
+    with open(rsync, 'w') as f:
+      f.write('#!/bin/bash\n'
+              'echo "$2" >> %(root)s/calls.txt\n'
+              'last=%(root)s/input/file/source/last/copied\n'
+              'if [[ "$2" == */slow/ ]]; then\n'
+              '  for ((i = 0; i < 50; i++)); do\n'
+              '    [[ -e "${last}" ]] && break\n'
+              '    sleep 0.1\n'
+              '  done\n'
+              '  [[ -e "${last}" ]] || exit 1\n'
+              'fi\n'
+              '[[ "$2" != */missing/ ]] && touch "$3/copied"\n' % {
+                  'root': self.root
+              })
+    os.chmod(rsync, 0700)
+    self.input_util = param_util.InputFileParamUtil('input')
+
+  def tearDown(self):
+    shutil.rmtree(self.root)
+
+  def run_localize(self, names):
+    inputs = [
+        self.input_util.make_param('IN%d' % i, '/source/%s/' % name, True)
+        for i, name in enumerate(names)
+    ]
+    script = providers_util.build_recursive_localize_command(
+        self.root, inputs, param_util.P_LOCAL)
+    env = dict(os.environ)
+    env['PATH'] = self.bin_dir + os.pathsep + env['PATH']
+    returncode = subprocess.call(['bash', '-c', script], env=env)
+    with open(os.path.join(self.root, 'calls.txt')) as f:
+      calls = f.read().split()
+    return returncode, sorted(calls)
+
+  def copied(self, name):
+    return os.path.exists(
+        os.path.join(self.root, 'input/file/source', name, 'copied'))
+
+  def test_all_copied(self):
+    names = ['dir%d' % i for i in range(providers_util.TRANSFER_PARALLELISM + 2)]
+    returncode, calls = self.run_localize(names)
+    self.assertEqual(0, returncode)
+    self.assertEqual(sorted('/source/%s/' % name for name in names), calls)
+    self.assertTrue(all(self.copied(name) for name in names))
+
+  def test_slow_copy_does_not_hold_back_others(self):
+    names = ['slow'] + [
+        'dir%d' % i for i in range(providers_util.TRANSFER_PARALLELISM * 2)
+    ] + ['last']
+    returncode, calls = self.run_localize(names)
+    self.assertEqual(0, returncode)
+    self.assertEqual(sorted('/source/%s/' % name for name in names), calls)
+
+  def test_failure_after_other_copies(self):
+    returncode, calls = self.run_localize(['missing', 'dir'])
+    self.assertEqual(1, returncode)
+    self.assertEqual(['/source/dir/'] + ['/source/missing/'] * 3, calls)
+    self.assertTrue(self.copied('dir'))
+
+  def test_no_inputs(self):
+    self.assertEqual('', providers_util.build_recursive_localize_command(
+        self.root, [], param_util.P_LOCAL))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,89 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for dsub.lib.timestamp_util."""
+
+from datetime import datetime
+import unittest
+
+from dsub.lib import timestamp_util
+import parameterized
+
+# 2016-11-14T23:04:55Z
+_SECONDS = 1479164695
+
+
+class TestParseRfc3339(unittest.TestCase):
+
+  @parameterized.parameterized.expand([
+      ('seconds', '2016-11-14T23:04:55Z'),
+      ('millis', '2016-11-14T23:04:55.010Z'),
+      ('nanos', '2016-11-14T23:04:55.010429380Z'),
+  ])
+  def test_parse(self, unused_name, datestamp):
+    self.assertEqual(_SECONDS,
+                     timestamp_util.parse_rfc3339_utc_seconds(datestamp))
+
+  @parameterized.parameterized.expand([
+      ('empty', ''),
+      ('no_zulu', '2016-11-14T23:04:55+01:00'),
+      ('date_only', '2016-11-14Z'),
+      ('space', '2016-11-14 23:04:55Z'),
+      ('signed', '2016-11-14T+3:04:55Z'),
+      ('bad_day', '2016-02-30T23:04:55Z'),
+  ])
+  def test_parse_fails(self, unused_name, datestamp):
+    self.assertIsNone(timestamp_util.parse_rfc3339_utc_seconds(datestamp))
+
+
+class TestLocalize(unittest.TestCase):
+
+  def setUp(self):
+    timestamp_util._LOCALIZED_RFC3339.clear()
+
+  def test_localize(self):
+    expected = datetime.fromtimestamp(_SECONDS).strftime('%Y-%m-%d %H:%M:%S')
+    self.assertEqual(expected,
+                     timestamp_util.localize_rfc3339('2016-11-14T23:04:55Z'))
+    # Cached
+    self.assertEqual(expected,
+                     timestamp_util.localize_rfc3339('2016-11-14T23:04:55Z'))
+
+  def test_unparsed_returned(self):
+    self.assertEqual('yesterday', timestamp_util.localize_rfc3339('yesterday'))
+
+  def test_local_datetime(self):
+    self.assertIsNone(timestamp_util.utc_seconds_to_local_datetime(None))
+    self.assertEqual(
+        datetime.fromtimestamp(_SECONDS),
+        timestamp_util.utc_seconds_to_local_datetime(_SECONDS))
+
+
+class TestLruCache(unittest.TestCase):
+
+  def test_evicts_least_recently_used(self):
+    cache = timestamp_util._LruCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.put('c', 3)
+    # 'a' and 'b' are now the previous generation; reading 'a' keeps it.
+    self.assertEqual(1, cache.get('a'))
+    cache.put('d', 4)
+    self.assertIsNone(cache.get('b'))
+    self.assertEqual(1, cache.get('a'))
+    self.assertEqual(3, cache.get('c'))
+    self.assertEqual(4, cache.get('d'))
+
+
+if __name__ == '__main__':
+  unittest.main()